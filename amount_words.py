@@ -0,0 +1,132 @@
+"""Сумма прописью по-русски: рубли и копейки с правильными формами слов.
+
+Сумма разбирается через ``Decimal`` и округляется до копеек по правилу
+«половина вверх», поэтому ``0.995`` — это ровно 1 рубль, а не 99 или 100
+копеек из-за погрешности float. Число записывается тройками разрядов:
+«тысяча» женского рода («одна тысяча», «две тысячи»), остальные разряды —
+мужского. Форма существительного выбирается по последним цифрам: 1, 21 —
+«рубль»/«копейка», 2–4, 22 — «рубля»/«копейки», 0, 5–20 — «рублей»/«копеек».
+
+Готовые строки запоминаются в LRU (``LEADFORCE_AMOUNT_WORDS_MEMO_SIZE``
+последних сумм): CRM повторяет одни и те же суммы в счетах, предпросмотре и
+ретраях.
+"""
+
+import os
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import lru_cache
+
+AMOUNT_WORDS_MEMO_SIZE = int(os.environ.get("LEADFORCE_AMOUNT_WORDS_MEMO_SIZE", "1024"))
+
+# Копейки цифрами («50 копеек») — как в счёте; 1 — словами («пятьдесят копеек»).
+KOPECKS_IN_WORDS = os.environ.get("LEADFORCE_KOPECKS_IN_WORDS", "0") == "1"
+
+UNITS_MASCULINE = ("", "один", "два", "три", "четыре", "пять", "шесть", "семь", "восемь", "девять")
+UNITS_FEMININE = ("", "одна", "две") + UNITS_MASCULINE[3:]
+TEENS = (
+    "десять", "одиннадцать", "двенадцать", "тринадцать", "четырнадцать",
+    "пятнадцать", "шестнадцать", "семнадцать", "восемнадцать", "девятнадцать",
+)
+TENS = ("", "", "двадцать", "тридцать", "сорок", "пятьдесят", "шестьдесят", "семьдесят", "восемьдесят", "девяносто")
+HUNDREDS = ("", "сто", "двести", "триста", "четыреста", "пятьсот", "шестьсот", "семьсот", "восемьсот", "девятьсот")
+
+# Разряды начиная с тысяч: (формы для 1, 2–4, 5+; женский род).
+SCALES = (
+    (("тысяча", "тысячи", "тысяч"), True),
+    (("миллион", "миллиона", "миллионов"), False),
+    (("миллиард", "миллиарда", "миллиардов"), False),
+    (("триллион", "триллиона", "триллионов"), False),
+    (("квадриллион", "квадриллиона", "квадриллионов"), False),
+    (("квинтиллион", "квинтиллиона", "квинтиллионов"), False),
+    (("секстиллион", "секстиллиона", "секстиллионов"), False),
+)
+MAX_NUMBER = 1000 ** (len(SCALES) + 1) - 1
+
+RUBLE_FORMS = ("рубль", "рубля", "рублей")
+KOPECK_FORMS = ("копейка", "копейки", "копеек")
+
+_KOPECK = Decimal("0.01")
+
+
+def plural_form(number: int, forms: tuple) -> str:
+    """Форма существительного для числа: ``forms`` — (1, 2–4, 5+), например («рубль», «рубля», «рублей»)."""
+
+    number = abs(number)
+    if 11 <= number % 100 <= 14:
+        return forms[2]
+    last = number % 10
+    if last == 1:
+        return forms[0]
+    if 2 <= last <= 4:
+        return forms[1]
+    return forms[2]
+
+
+def _triad_words(number: int, feminine: bool) -> list:
+    """Слова для числа 1..999."""
+
+    words = [HUNDREDS[number // 100]]
+    rest = number % 100
+    if 10 <= rest < 20:
+        words.append(TEENS[rest - 10])
+    else:
+        units = UNITS_FEMININE if feminine else UNITS_MASCULINE
+        words += [TENS[rest // 10], units[rest % 10]]
+    return [word for word in words if word]
+
+
+def number_in_words(number: int, feminine: bool = False) -> str:
+    """Целое число словами: ``21`` -> «двадцать один» (``feminine`` — «двадцать одна»).
+
+    Бросает ``ValueError`` для чисел больше ``MAX_NUMBER`` по модулю.
+    """
+
+    if number < 0:
+        return "минус " + number_in_words(-number, feminine)
+    if number == 0:
+        return "ноль"
+    if number > MAX_NUMBER:
+        raise ValueError(f"Слишком большое число: {number}")
+
+    words = _triad_words(number % 1000, feminine)
+    number //= 1000
+    for forms, scale_feminine in SCALES:
+        if not number:
+            break
+        triad = number % 1000
+        if triad:
+            words = _triad_words(triad, scale_feminine) + [plural_form(triad, forms)] + words
+        number //= 1000
+    return " ".join(words)
+
+
+def parse_kopecks(value) -> int:
+    """Сумма в копейках со знаком: ``"1 234,565"`` -> ``123457``; бросает ``ValueError``."""
+
+    try:
+        amount = Decimal(str(value).strip().replace(" ", "").replace(",", "."))
+        # quantize отказывает и бесконечностям, и числам длиннее точности Decimal.
+        return int(amount.quantize(_KOPECK, rounding=ROUND_HALF_UP) * 100)
+    except (InvalidOperation, ValueError, OverflowError):
+        raise ValueError(f"Некорректная сумма: {value!r}") from None
+
+
+@lru_cache(maxsize=AMOUNT_WORDS_MEMO_SIZE)
+def _amount_words(total_kopecks: int, kopecks_in_words: bool) -> str:
+    rubles, kopecks = divmod(abs(total_kopecks), 100)
+    text = f"{number_in_words(rubles)} {plural_form(rubles, RUBLE_FORMS)}"
+    if total_kopecks < 0:
+        text = "минус " + text
+    kopecks_text = number_in_words(kopecks, feminine=True) if kopecks_in_words else f"{kopecks:02d}"
+    text = f"{text} {kopecks_text} {plural_form(kopecks, KOPECK_FORMS)}"
+    return text[0].upper() + text[1:]
+
+
+def amount_in_words(value, kopecks_in_words: bool = KOPECKS_IN_WORDS) -> str:
+    """Сумма прописью: ``"29990.50"`` -> «Двадцать девять тысяч девятьсот девяносто рублей 50 копеек».
+
+    ``value`` — строка или число; запятая как десятичный разделитель и пробелы
+    между разрядами допускаются. Бросает ``ValueError``, если сумма не разбирается.
+    """
+
+    return _amount_words(parse_kopecks(value), kopecks_in_words)
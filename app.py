@@ -1,59 +1,99 @@
 import base64
+import functools
+import json
 import os
 import platform
+import re
+import signal
 import subprocess
+import time
 import traceback
-import uuid
-from datetime import datetime
+from contextlib import contextmanager, nullcontext
 from io import BytesIO
-import zipfile
-from docx.shared import Pt
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
-
-from typing import Any, Optional, cast
-
-from docx import Document
-from docx.shared import Mm
-try:
-    from docx.enum.table import WD_ROW_HEIGHT_RULE, WD_ALIGN_VERTICAL  # type: ignore[import-not-found]
-except ImportError:  # pragma: no cover - handled at runtime
-    WD_ROW_HEIGHT_RULE = None  # type: ignore[assignment]
-    WD_ALIGN_VERTICAL = None  # type: ignore[assignment]
-from flask import Flask, jsonify, request, send_file
-from flasgger import Swagger
-from num2words import num2words
-
-try:
-    import qrcode  # type: ignore[import-not-found]
-    from qrcode.constants import ERROR_CORRECT_M  # type: ignore[import-not-found]
-except ImportError:  # pragma: no cover - handled at runtime
-    qrcode = None  # type: ignore[assignment]
-    ERROR_CORRECT_M = None  # type: ignore[assignment]
-
-try:
-    from PIL import Image  # type: ignore[import-not-found]
+from typing import NamedTuple, Optional
+
+from flask import Flask, Response, g, jsonify, request, send_file
+
+from artifact_cache import get_artifact_cache, make_cache_key
+from conversion_slots import (
+    ConversionBusyError,
+    ConversionSlot,
+    conversion_background,
+    get_conversion_slots,
+)
+from converter import get_soffice_pool
+from deadlines import (
+    StageTimeout,
+    conversion_timeout,
+    ensure_stage_budget,
+    request_deadline,
+    stage_deadline,
+    stage_time_left,
+)
+from docx_template import CompiledTemplate
+from fast_pdf import FAST_PDF_ENABLED, get_fast_pdf_engine, preload_fonts
+from generation_request import DEFAULT_QR_WIDTH_MM, GenerationRequest, RequestValidationError
+from payment_qr import (
+    QR_RENDER_DPI,
+    generate_payment_qr_image,
+    insert_payment_qr,
+    insert_qr_code_into_document,
+    render_payment_qr_png,
+    render_qr_png_uncached,
+)
+from metrics import (
+    count_converter_kill,
+    count_stage_error,
+    count_stage_timeout,
+    observe_output_size,
+    observe_stage,
+    render_metrics,
+    request_finished,
+    request_started,
+)
+from jobs import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    get_job_queue,
+    get_job_store,
+    job_owner_alive,
+    public_job_state,
+    validate_callback_url,
+)
+from reproducible import normalize_pdf_metadata
+from stage_pool import get_stage_pool
+from profiling import (
+    PROFILE_HEADER,
+    PROFILE_ID_HEADER,
+    profile_path,
+    profiling_authorized,
+    save_profile,
+    start_profile,
+)
+from temp_store import get_temp_store, register_temp_area
+from template_registry import UnknownTemplateError, get_template_registry
+from zip_stream import stream_zip, stream_zip_length, zip_bytes
+
+# Swagger UI и спецификация нужны людям, а не CRM: LEADFORCE_SWAGGER=0 убирает
+# импорт flasgger (~0.1 с на воркер) и маршруты /apidocs/ и /openapi.json.
+SWAGGER_ENABLED = os.environ.get("LEADFORCE_SWAGGER", "1") == "1"
+Swagger = None
+if SWAGGER_ENABLED:
     try:
-        from PIL.Image import Resampling as PILResampling  # Pillow ≥ 9.1
-    except Exception:
-        PILResampling = None  # type: ignore[assignment]
-except ImportError:
-    Image = None  # type: ignore[assignment]
-    PILResampling = None  # type: ignore[assignment]
-
-# Явный тип для Pylance
-RESAMPLE_NEAREST: int
-if PILResampling is not None:
-    RESAMPLE_NEAREST = int(PILResampling.NEAREST)  # enum -> int
-elif Image is not None and hasattr(Image, "NEAREST"):
-    RESAMPLE_NEAREST = int(getattr(Image, "NEAREST"))
-else:
-    RESAMPLE_NEAREST = 0  # числовой фоллбэк; PIL понимает 0 как NEAREST
-# --- /Pillow compat ---        # старые версии
-
-TEMPLATE_PATH = "./Templates/LeadsForce_v0.docx"
-OUTPUT_DIR = "./output"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+        from flasgger import Swagger  # type: ignore[import-not-found,no-redef]
+    except ImportError:  # pragma: no cover - handled at runtime
+        Swagger = None
+
+
+# Прежние версии сервиса оставляли в ./output файлы <uuid>.docx/.pdf/_qr.png на
+# каждый запрос; подкаталоги (кэш, задания) принадлежат своим компонентам.
+LEGACY_OUTPUT_DIR = "./output"
+register_temp_area("legacy_output", LEGACY_OUTPUT_DIR, files_only=True)
+
+# Шаблоны компилируются при старте воркера, чтобы первый запрос не платил за разбор.
+get_template_registry().preload()
 
 PLACEHOLDERS = [
     "ID", "INVOICE_DATE", "CUSTOMER", "PRODUCT", "SUM", "AMOUNT_IN_WORDS",
@@ -66,6 +106,79 @@ PLACEHOLDERS = [
 
 app = Flask(__name__)
 
+
+@app.before_request
+def _ensure_temp_sweeper():
+    """Запускает фоновую уборку временных файлов в воркере при первом запросе."""
+
+    get_temp_store()
+
+
+def _metrics_route() -> str:
+    """Шаблон маршрута для меток метрик (``/Jobs/<job_id>``, а не конкретный id)."""
+
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+@app.before_request
+def _track_request_start():
+    g.metrics_started = time.perf_counter()
+    g.metrics_route = _metrics_route()
+    request_started(g.metrics_route)
+
+
+@app.after_request
+def _track_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def _track_request_end(error=None):
+    if "metrics_started" not in g:
+        return
+    status = g.get("metrics_status", 500)
+    request_finished(g.metrics_route, request.method, status, time.perf_counter() - g.metrics_started)
+
+
+def request_timings() -> dict:
+    """Словарь длительностей этапов текущего запроса для заголовка Server-Timing."""
+
+    if "server_timings" not in g:
+        g.server_timings = {}
+    return g.server_timings
+
+
+def server_timing_header(timings: dict, total: float) -> str:
+    """Форматирует длительности (в секундах) как ``qr;dur=12.3, ..., total;dur=250.0``."""
+
+    metrics = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+@app.after_request
+def _add_server_timing(response):
+    if "server_timings" in g:
+        total = time.perf_counter() - g.metrics_started
+        response.headers["Server-Timing"] = server_timing_header(g.server_timings, total)
+    return response
+
+
+@app.before_request
+def _start_request_profile():
+    if request.endpoint != "get_profile" and profiling_authorized(request.headers.get(PROFILE_HEADER)):
+        g.profiler = start_profile()
+
+
+@app.after_request
+def _save_request_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        response.headers[PROFILE_ID_HEADER] = save_profile(profiler, request.path)
+    return response
+
+
 SWAGGER_PARAMETERS = {
     "price": {
         "name": "price",
@@ -94,7 +207,13 @@ SWAGGER_PARAMETERS = {
     "deal": {
         "name": "deal",
         "in": "query",
-        "description": "Номер сделки/счёта",
+        "description": "Номер сделки/счёта. Без него номер случайный, ответ не кэшируется и не получает ETag",
+        "schema": {"type": "string"}
+    },
+    "template": {
+        "name": "template",
+        "in": "query",
+        "description": "Имя шаблона из каталога Templates без расширения (по умолчанию основной)",
         "schema": {"type": "string"}
     },
     "service": {
@@ -225,6 +344,21 @@ SWAGGER_PARAMETERS = {
     }
 }
 
+# Для POST-маршрутов те же параметры сделки передаются JSON-объектом в теле.
+SWAGGER_PARAMETERS["deal_body"] = {
+    "name": "body",
+    "in": "body",
+    "required": True,
+    "description": "Параметры сделки JSON-объектом — те же поля, что и query-параметры GET-маршрутов",
+    "schema": {
+        "type": "object",
+        "properties": {
+            name: {"type": "string", "description": parameter["description"]}
+            for name, parameter in SWAGGER_PARAMETERS.items()
+        },
+    },
+}
+
 swagger_template = {
     "swagger": "2.0",
     "info": {
@@ -251,687 +385,866 @@ swagger_config = {
     "specs_route": "/apidocs/"
 }
 
-swagger = Swagger(app, template=swagger_template, config=swagger_config)
+swagger = Swagger(app, template=swagger_template, config=swagger_config) if Swagger is not None else None
+
+
+def convert_many_to_pdf(documents: list, use_pool: bool = True) -> list:
+    """Конвертирует несколько DOCX в PDF за один вызов конвертера.
+
+    Возвращает список той же длины: байты PDF или исключение для каждого документа.
+    На Windows используется Word, на *nix — пул постоянно запущенных экземпляров
+    LibreOffice (см. ``converter.py``); без модуля ``uno`` или при
+    ``LEADFORCE_SOFFICE_POOL_SIZE=0`` (или ``use_pool=False``) запускается один
+    процесс soffice на все файлы с профилем слота конвертации. Конвертация занимает слот общего для всех
+    воркеров семафора (``conversion_slots.py``); если слота не дождаться,
+    бросается ``ConversionBusyError``. Конвертация ограничена остатком доли
+    этапа в бюджете запроса (``deadlines.conversion_timeout``): по его истечении
+    конвертер убивается вместе с группой процессов и бросается ``StageTimeout``.
+    Конвертеру нужны файлы на диске, поэтому DOCX кладутся в черновой каталог
+    области ``convert`` хранилища временных файлов (по умолчанию tmpfs
+    ``/dev/shm``) и удаляются сразу после чтения PDF. Даты и ``/ID`` готовых
+    PDF нормализуются (``reproducible.normalize_pdf_metadata``).
+    """
 
-DEFAULT_PAYMENT_DETAILS = {
-    "Name": "ИП Абакумова Наталья Александровна",
-    "PersonalAcc": "40802810200006322048",
-    "BankName": "АО «Тинькофф Банк»",
-    "BIC": "044525974",
-    "CorrespAcc": "30101810145250000974",
-    "PayeeINN": "720206359451",
-    "Purpose": "Оплата по счету №{{ID}}"
-}
+    if not documents:
+        return []
 
-QR_QUERY_MAP = {
-    "qr_name": "Name",
-    "qr_personal_account": "PersonalAcc",
-    "qr_bank_name": "BankName",
-    "qr_bic": "BIC",
-    "qr_correspondent_account": "CorrespAcc",
-    "qr_inn": "PayeeINN",
-    "qr_kpp": "PayeeKPP",
-    "qr_payer_address": "PayerAddress"
-}
+    if platform.system() == "Windows":
+        return _convert_many_to_pdf_locally(documents, None)
 
-QR_CODE_PLACEHOLDER = "{{QR_CODE}}"
+    slots = get_conversion_slots()
+    with slots.acquire(stage_time_left()) if slots is not None else nullcontext() as slot:
+        timeout = conversion_timeout()
+        if timeout is not None and timeout <= 0:
+            raise converter_timeout_error(0.0)
+        pool = get_soffice_pool() if use_pool else None
+        if pool is not None:
+            return normalize_pdfs(pool.convert_many_bytes(documents, timeout))
+        return _convert_many_to_pdf_locally(documents, slot, timeout)
 
-from xml.sax.saxutils import escape
 
-def fill_template_xml(template_path: str, replacements: dict, output_path: str):
-    """Создаёт копию DOCX-шаблона с заменой плейсхолдеров внутри XML."""
+def _run_converter_process(args: list, timeout: Optional[float]) -> None:
+    """Запускает разовый конвертер в своей группе процессов.
 
-    with zipfile.ZipFile(template_path, 'r') as zin:
-        with zipfile.ZipFile(output_path, 'w') as zout:
-            for item in zin.infolist():
-                data = zin.read(item.filename)
-                if item.filename == 'word/document.xml':
-                    xml = data.decode('utf-8')
-                    for key, value in replacements.items():
-                        safe = escape(str(value or ""))
-                        xml = xml.replace(f'{{{{{key}}}}}', safe)
-                    data = xml.encode('utf-8')
-                zout.writestr(item, data)
+    Если он не завершился за ``timeout`` секунд, убивается вся группа (soffice
+    запускает дочерний soffice.bin) и бросается ``StageTimeout``.
+    """
 
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, start_new_session=True)
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_converter_group(process.pid)
+        process.wait()
+        raise converter_timeout_error(timeout)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
 
-def convert_to_pdf(input_docx: str, output_dir: str):
-    """Конвертирует DOCX в PDF, используя Word на Windows или LibreOffice на *nix."""
 
-    if platform.system() == "Windows":
-        import pythoncom  # type: ignore
-        import win32com.client  # type: ignore
+def kill_converter_group(pid: int) -> None:
+    """Убивает группу процессов зависшего разового конвертера."""
 
-        pythoncom.CoInitialize()
-        try:
-            word = win32com.client.Dispatch("Word.Application")
-            word.Visible = False
-            abs_input = os.path.abspath(input_docx).replace("/", "\\")
-            doc = word.Documents.Open(abs_input)
-            output_pdf = os.path.splitext(abs_input)[0] + ".pdf"
-            doc.SaveAs(output_pdf, FileFormat=17)
-            doc.Close(False)
-            word.Quit()
-            return output_pdf
-        finally:
-            pythoncom.CoUninitialize()
-    else:
-        subprocess.run([
-            "soffice", "--headless", "--convert-to", "pdf",
-            "--outdir", output_dir, input_docx
-        ], check=True)
-        return os.path.splitext(input_docx)[0] + ".pdf"
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    count_converter_kill("process")
 
 
-def zip_single_file(file_path, arcname):
-    """Создаёт архив в памяти с единственным файлом."""
+def converter_timeout_error(timeout: Optional[float]) -> StageTimeout:
+    """Учитывает таймаут конвертации в метриках и возвращает исключение для ответа 504."""
 
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, "w") as zf:
-        zf.write(file_path, arcname=arcname)
-    buffer.seek(0)
-    return buffer
+    count_stage_timeout(STAGE_CONVERT)
+    return StageTimeout(STAGE_CONVERT, timeout or 0.0)
 
 
-def zip_files(file_mappings):
-    """Архивирует несколько файлов, пропуская отсутствующие пути."""
+def _convert_many_to_pdf_locally(documents: list, slot: Optional[ConversionSlot],
+                                 timeout: Optional[float] = None) -> list:
+    """Конвертирует DOCX через Word (Windows) или разовый запуск soffice с профилем слота ``slot``."""
 
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, "w") as zf:
-        for path, arcname in file_mappings:
-            if path and os.path.exists(path):
-                zf.write(path, arcname=arcname)
-    buffer.seek(0)
-    return buffer
+    with get_temp_store().scratch_dir("convert") as scratch:
+        jobs = write_convert_inputs(scratch, documents)
 
+        results: list = []
+        if platform.system() == "Windows":
+            import pythoncom  # type: ignore
+            import win32com.client  # type: ignore
 
-def encode_file_to_base64(file_path: str) -> str:
-    """Возвращает содержимое файла в виде base64-строки."""
+            pythoncom.CoInitialize()
+            try:
+                word = win32com.client.Dispatch("Word.Application")
+                word.Visible = False
+                try:
+                    for input_docx, output_pdf in jobs:
+                        try:
+                            doc = word.Documents.Open(os.path.abspath(input_docx).replace("/", "\\"))
+                            doc.SaveAs(os.path.abspath(output_pdf).replace("/", "\\"), FileFormat=17)
+                            doc.Close(False)
+                            results.append(None)
+                        except Exception as error:
+                            results.append(error)
+                finally:
+                    word.Quit()
+            finally:
+                pythoncom.CoUninitialize()
+        else:
+            _run_converter_process(soffice_command(scratch, jobs, slot), timeout)
+            results = [None] * len(jobs)
 
-    with open(file_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("ascii")
+        return read_converted_pdfs(jobs, results)
 
 
-PAYMENT_QR_FIELDS_ORDER = [
-    "Name",
-    "PersonalAcc",
-    "BankName",
-    "BIC",
-    "CorrespAcc",
-    "PayeeINN",
-    "PayeeKPP",
-    "PayerAddress",
-    "Sum",
-    "Purpose",
-]
+def write_convert_inputs(scratch: str, documents: list) -> list:
+    """Кладёт DOCX в черновой каталог и возвращает пары ``(docx, pdf)`` для конвертера."""
 
+    jobs = []
+    for index, docx_bytes in enumerate(documents):
+        input_docx = os.path.join(scratch, f"document_{index}.docx")
+        with open(input_docx, "wb") as docx_file:
+            docx_file.write(docx_bytes)
+        jobs.append((input_docx, os.path.join(scratch, f"document_{index}.pdf")))
+    return jobs
 
-DEFAULT_QR_WIDTH_MM = 36  # 35–40 мм — рабочий диапазон для СБП
-MIN_QR_MM = 20
-MAX_QR_MM = 45
 
-# Дополнительный запас, который мы оставляем внутри ячейки таблицы при вставке QR.
-# На Linux LibreOffice при конвертации DOCX -> PDF заметно сильнее подрезает
-# изображения, если они вплотную подходят к границам ячейки, поэтому держим
-# небольшой фиксированный и относительный зазоры.
-QR_CELL_MARGIN_MM = 2
-QR_CELL_MARGIN_RATIO = 0.1
+def soffice_command(scratch: str, jobs: list, slot: Optional[ConversionSlot]) -> list:
+    """Команда разовой конвертации всех ``jobs`` в PDF с профилем слота ``slot``."""
 
-# На Linux при конвертации в PDF LibreOffice иногда обрезает саму картинку даже при
-# соблюдении отступов в таблице, если у PNG слишком тонкая белая рамка. Поэтому мы
-# принудительно добавляем запас вокруг QR-кода при сохранении файла.
-QR_IMAGE_PADDING_PX = 0
-QR_IMAGE_PADDING_RATIO = 0.0
+    # soffice принимает сразу много входных файлов — один запуск на весь пакет.
+    # Свой профиль у слота: параллельные soffice не ждут общую блокировку профиля.
+    profile = [f"-env:UserInstallation={slot.profile_url}"] if slot is not None else []
+    return [
+        "soffice", *profile, "--headless", "--convert-to", "pdf",
+        "--outdir", scratch, *(input_docx for input_docx, _ in jobs)
+    ]
 
 
-def build_payment_qr_payload(details: dict) -> str:
-    """Формирует строку payload для СБП, учитывая фиксированный порядок полей."""
+def read_converted_pdfs(jobs: list, results: list) -> list:
+    """Читает PDF конвертера: байты (с нормализованными метаданными) или исключение на документ."""
 
-    parts = ["ST00012"]
-    used_keys = set()
+    pdfs: list = []
+    for (_, output_pdf), error in zip(jobs, results):
+        if error is not None:
+            pdfs.append(error)
+            continue
+        try:
+            with open(output_pdf, "rb") as pdf_file:
+                pdfs.append(pdf_file.read())
+        except OSError:
+            pdfs.append(RuntimeError("Конвертер не создал PDF для документа"))
+    return normalize_pdfs(pdfs)
 
-    for field in PAYMENT_QR_FIELDS_ORDER:
-        value = (details.get(field) or "").strip()
-        if value:
-            parts.append(f"{field}={value}")
-            used_keys.add(field)
 
-    for key, value in details.items():
-        if key in used_keys:
-            continue
-        value = (value or "").strip()
-        if value:
-            parts.append(f"{key}={value}")
+def normalize_pdfs(results: list) -> list:
+    """Нормализует метаданные каждого PDF из результатов конвертера; ошибки оставляет как есть."""
 
-    return "|".join(parts)
+    return [result if isinstance(result, Exception) else normalize_pdf_metadata(result) for result in results]
 
 
-def _require_qr_dependencies() -> Optional[str]:
-    """Возвращает строку с недостающими модулями для генерации QR или None."""
+def convert_to_pdf(docx_bytes: bytes, use_pool: bool = True) -> bytes:
+    """Конвертирует один DOCX в PDF и возвращает байты PDF."""
 
-    missing = []
-    if qrcode is None:
-        missing.append("qrcode")
-    if Image is None:
-        missing.append("Pillow")
-    if missing:
-        return ", ".join(missing)
-    return None
-def generate_payment_qr_image(details: dict, file_id: str) -> tuple[str, str]:
-    """Генерирует PNG с QR-кодом и возвращает payload вместе с путём к файлу."""
-
-    missing = _require_qr_dependencies()
-    if missing:
-        raise RuntimeError(
-            "Для генерации QR-кода необходимо установить зависимости: "
-            f"{missing}. Выполните 'pip install -r requirements.txt'."
-        )
+    result = convert_many_to_pdf([docx_bytes], use_pool)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
-    payload = build_payment_qr_payload(details)
-    if len(payload) <= len("ST00012"):
-        return "", ""
-
-    qr_path = os.path.join(OUTPUT_DIR, f"{file_id}_qr.png")
-    qr_module = cast(Any, qrcode)
-    error_correction = cast(int, ERROR_CORRECT_M)
-    qr = qr_module.QRCode(error_correction=error_correction, box_size=10, border=4)
-    qr.add_data(payload)
-    qr.make(fit=True)
-    qr_image = qr.make_image(fill_color="black", back_color="white")
-    pil_image = qr_image.get_image() if hasattr(qr_image, "get_image") else qr_image
-    if not hasattr(pil_image, "save"):
-        raise TypeError("Объект QR-кода не поддерживает сохранение в файл")
-    pil_image.save(qr_path, format="PNG", dpi=(300, 300))
-    return payload, qr_path
-
-def _zero_paragraph_spacing(paragraph):
-    """Сбрасывает отступы и настройки переноса абзаца."""
-
-    pf = paragraph.paragraph_format
-    pf.space_before = Pt(0)
-    pf.space_after = Pt(0)
-    pf.line_spacing = 1.0
-    pf.keep_with_next = False
-    pf.keep_together = False
-
-def _set_cell_margins(cell, top=40, bottom=40, left=40, right=40):
-    """
-    Устанавливает внутренние поля ячейки таблицы в twips (1/20 pt).
-    40 twips ≈ 0.7 мм — хватает, чтобы LibreOffice не "съедал" верхние пиксели.
+
+def encode_bytes_to_base64(data: bytes) -> str:
+    """Возвращает байты ``data`` в виде base64-строки (ASCII)."""
+
+    return base64.b64encode(data).decode("ascii")
+
+
+ARTIFACT_DOCX = "docx"
+ARTIFACT_PDF = "pdf"
+ARTIFACT_QR = "qr"
+ALL_ARTIFACTS = frozenset({ARTIFACT_DOCX, ARTIFACT_PDF, ARTIFACT_QR})
+
+
+class GeneratedDocuments(NamedTuple):
+    """Результат генерации: байты артефактов (None — не запрашивался) и payload QR."""
+
+    docx: Optional[bytes]
+    pdf: Optional[bytes]
+    qr_png: Optional[bytes]
+    qr_payload: str
+
+
+STAGE_QR = "qr"
+STAGE_FILL = "fill"
+STAGE_QR_INSERT = "qr_insert"
+STAGE_CONVERT = "convert"
+STAGE_PDF_STAMP = "pdf_stamp"
+STAGE_ZIP = "zip"
+
+
+@contextmanager
+def _stage(timings: Optional[dict], name: str):
+    """Учитывает длительность блока в метриках этапа и в ``timings[name]``, если словарь передан.
+
+    Блоку отводится доля бюджета запроса (``deadlines.stage_deadline``): если
+    она исчерпана или превышена, бросается ``StageTimeout``. Исключение,
+    вышедшее из блока, засчитывается как ошибка этапа.
     """
-    tcPr = cell._tc.get_or_add_tcPr()
-    tcMar = tcPr.find(qn('w:tcMar'))
-    if tcMar is None:
-        tcMar = OxmlElement('w:tcMar')
-        tcPr.append(tcMar)
-
-    def _ensure_side(name: str, val: int):
-        el = tcMar.find(qn(f'w:{name}'))
-        if el is None:
-            el = OxmlElement(f'w:{name}')
-            tcMar.append(el)
-        el.set(qn('w:w'), str(int(val)))
-        el.set(qn('w:type'), 'dxa')
-
-    for side, val in (('top', top), ('bottom', bottom), ('left', left), ('right', right),
-                      ('start', left), ('end', right)):
-        _ensure_side(side, val)
-
-def _replace_paragraph_with_image(paragraph, image_path: str, width_mm: float):
-    """Очищает параграф и вставляет изображение заданной ширины вместо текста."""
-
-    while paragraph.runs:
-        paragraph._element.remove(paragraph.runs[0]._r)
-    _zero_paragraph_spacing(paragraph)
-    run = paragraph.add_run()
-    run.add_picture(image_path, width=Mm(width_mm))
-
-
-def _replace_in_paragraphs(paragraphs, placeholder: str, image_path: str, width_mm: float) -> bool:
-    """Заменяет плейсхолдер на изображение и сообщает об успешной вставке."""
-
-    for paragraph in paragraphs:
-        if placeholder in paragraph.text:
-            paragraph.text = paragraph.text.replace(placeholder, "")
-            _replace_paragraph_with_image(paragraph, image_path, width_mm)
-            return True
-    return False
-
-
-def _ensure_qr_image_padding(image_path: str) -> None:
-    """Добавляет белую рамку вокруг QR-кода, чтобы избежать обрезания при экспорте."""
-    if Image is None:
-        return
 
+    started = time.perf_counter()
     try:
-        with Image.open(image_path) as img:
-            qr_image = img.convert("RGB")
-            min_side = min(qr_image.size)
-            padding = max(int(min_side * QR_IMAGE_PADDING_RATIO), QR_IMAGE_PADDING_PX)
-            if padding <= 0:
-                return
-
-            new_size = (qr_image.width + padding * 2, qr_image.height + padding * 2)
-            padded = Image.new("RGB", new_size, "white")
-            padded.paste(qr_image, (padding, padding))
-            padded.save(image_path, format="PNG")
+        with stage_deadline(name):
+            yield
     except Exception:
-        traceback.print_exc()
+        count_stage_error(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe_stage(name, elapsed)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+# CPU-этапы, которые может выполнять пул процессов (``stage_pool.py``).
+CPU_STAGES = {
+    STAGE_QR: generate_payment_qr_image,
+    STAGE_FILL: CompiledTemplate.render,
+    STAGE_QR_INSERT: insert_payment_qr,
+}
 
 
-def _apply_qr_margin(limit_mm: float) -> float:
-    """Возвращает максимально допустимую ширину с учётом фиксированного и относительного зазоров."""
-    if not limit_mm:
-        return 0
+def run_cpu_stage(stage: str, *args):
+    """Выполняет CPU-этап в пуле процессов, если он включён (``LEADFORCE_STAGE_POOL=1``), иначе здесь же."""
 
-    margin = max(QR_CELL_MARGIN_MM, limit_mm * QR_CELL_MARGIN_RATIO)
-    return max(limit_mm - margin, 5)
+    pool = get_stage_pool()
+    if pool is None:
+        return CPU_STAGES[stage](*args)
+    if stage == STAGE_FILL:
+        return pool.fill(stage, *args)
+    return pool.run(stage, CPU_STAGES[stage], *args)
 
 
-def _ensure_cell_can_fit_image(row, cell, image_width_mm: float) -> None:
-    """Настраивает параметры строки и ячейки таблицы, чтобы QR полностью уместился."""
-    try:
-        margin = max(QR_CELL_MARGIN_MM, image_width_mm * QR_CELL_MARGIN_RATIO)
-        required_height_mm = image_width_mm + 2 * margin 
+# Payload временного QR, с которым верстается базовый PDF быстрого пути.
+FAST_PDF_BASE_QR_PAYLOAD = "ST00012|Name=LeadForce"
 
-        if WD_ROW_HEIGHT_RULE is not None:
-            try:
-                row.height_rule = WD_ROW_HEIGHT_RULE.AT_LEAST
-            except Exception:
-                traceback.print_exc()
 
+def _fast_pdf_base(template: CompiledTemplate, width_mm: float, use_pool: bool = True) -> tuple:
+    """Базовый PDF для быстрого пути: шаблон с плейсхолдерами и временным QR ширины ``width_mm``.
+
+    Возвращает (байты PDF, PNG временного QR или None, если в шаблоне нет ``{{QR_CODE}}``).
+    Временный QR строится без кэша артефактов: базовый PDF собирается раз на ширину.
+    """
+
+    qr_png = render_qr_png_uncached(FAST_PDF_BASE_QR_PAYLOAD, width_mm, QR_RENDER_DPI)
+    docx_bytes = template.render({})
+    with_qr = insert_qr_code_into_document(docx_bytes, qr_png, width_mm)
+    return convert_to_pdf(with_qr, use_pool), qr_png if with_qr != docx_bytes else None
+
+
+def render_pdf_fast(values: dict, qr_payload: str, qr_width_mm: float,
+                    timings: Optional[dict] = None,
+                    template: Optional[CompiledTemplate] = None) -> Optional[bytes]:
+    """Штампует значения в базовый PDF шаблона; None — нужна обычная конвертация DOCX."""
+
+    template = template or get_template_registry().get()
+    engine = get_fast_pdf_engine(template.version, functools.partial(_fast_pdf_base, template))
+    if engine is None:
+        return None
+    with _stage(timings, STAGE_PDF_STAMP):
         try:
-            current_height_mm = getattr(getattr(row, "height", None), "mm", None)
+            qr_png = render_payment_qr_png(qr_payload, qr_width_mm) if qr_payload else None
+            pdf = engine.render(values, qr_png, qr_width_mm)
+            return normalize_pdf_metadata(pdf) if pdf is not None else None
+        except (ConversionBusyError, StageTimeout):
+            raise
         except Exception:
-            current_height_mm = None
+            traceback.print_exc()
+            return None
+
+
+def build_doc(inputs: GenerationRequest, artifacts=ALL_ARTIFACTS, timings: Optional[dict] = None,
+              template: Optional[CompiledTemplate] = None, defer_convert: bool = False) -> GeneratedDocuments:
+    """Создаёт запрошенные артефакты (DOCX, PDF, QR) сделки ``inputs`` целиком в памяти.
+
+    Этапы, результат которых не нужен ни одному из ``artifacts``, пропускаются:
+    для DOCX не запускается конвертация в PDF, для одного QR не заполняется шаблон.
+    PDF сначала пробует собрать быстрый путь (``fast_pdf.py``); если он выключен
+    или отказался, PDF конвертируется из DOCX. На диск попадает только временная
+    копия DOCX для конвертера. В ``timings`` (если передан) записывается
+    длительность каждого этапа. ``template`` — скомпилированный шаблон (по
+    умолчанию шаблон из параметра ``template`` сделки). С ``defer_convert``
+    конвертация не запускается: PDF остаётся None при готовом DOCX, и его
+    конвертирует вызывающий (так ASGI-режим ждёт конвертер, не занимая поток).
+    Этапы QR, заполнения и вставки QR выполняются через ``run_cpu_stage`` — в
+    пуле процессов, если он включён.
+    """
 
-        if current_height_mm is None or current_height_mm < required_height_mm:
-            try:
-                row.height = Mm(required_height_mm)
-                if WD_ROW_HEIGHT_RULE is not None:
-                    row.height_rule = WD_ROW_HEIGHT_RULE.AT_LEAST
-            except Exception:
-                traceback.print_exc()
+    artifacts = frozenset(artifacts)
+    template = template or resolve_template(inputs)
+    unknown = artifacts - ALL_ARTIFACTS
+    if unknown:
+        raise ValueError(f"Неизвестные артефакты: {', '.join(sorted(unknown))}")
 
-        _set_cell_margins(cell, top=40, bottom=40, left=40, right=40)
+    payment_details = inputs.payment_details()
+    qr_width_mm = inputs.qr_width_mm
+    replacements_for_template = inputs.replacements()
+    qr_payload = ""
+    qr_png = b""
 
-        if WD_ALIGN_VERTICAL is not None and cell is not None:
+    with _stage(timings, STAGE_QR):
+        try:
+            qr_payload, qr_png = run_cpu_stage(STAGE_QR, payment_details)
+        except Exception as qr_error:
+            traceback.print_exc()
+            count_stage_error(STAGE_QR)
+            replacements_for_template["PAYMENT_QR_PAYLOAD"] = str(qr_error)
+            replacements_for_template["PAYMENT_QR_BASE64"] = ""
+
+    if qr_payload and qr_png:
+        replacements_for_template["PAYMENT_QR_PAYLOAD"] = qr_payload
+        replacements_for_template["PAYMENT_QR_BASE64"] = encode_bytes_to_base64(qr_png)
+
+    pdf_bytes = None
+    if ARTIFACT_PDF in artifacts:
+        pdf_bytes = render_pdf_fast(
+            replacements_for_template, qr_payload if qr_png else "", qr_width_mm, timings, template
+        )
+
+    need_convert = ARTIFACT_PDF in artifacts and pdf_bytes is None
+    if not (need_convert or ARTIFACT_DOCX in artifacts):
+        return GeneratedDocuments(None, pdf_bytes, qr_png or None, qr_payload)
+
+    with _stage(timings, STAGE_FILL):
+        docx_bytes = run_cpu_stage(STAGE_FILL, template, replacements_for_template)
+
+    if qr_payload and qr_png:
+        with _stage(timings, STAGE_QR_INSERT):
             try:
-                cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
+                docx_bytes = run_cpu_stage(STAGE_QR_INSERT, docx_bytes, qr_payload, qr_width_mm)
             except Exception:
                 traceback.print_exc()
+                count_stage_error(STAGE_QR_INSERT)
 
-    except Exception:
-        traceback.print_exc()
+    if need_convert and not defer_convert:
+        with _stage(timings, STAGE_CONVERT):
+            pdf_bytes = convert_to_pdf(docx_bytes)
+    return GeneratedDocuments(docx_bytes, pdf_bytes, qr_png or None, qr_payload)
 
 
-def _paragraph_has_placeholder(paragraph) -> bool:
-    """Возвращает True, если параграф содержит маркер вставки QR-кода."""
+# Увеличивается, когда меняется сам способ генерации и старые записи кэша
+# перестают соответствовать тому, что сформировал бы текущий код.
+# 2 — артефакты побайтно воспроизводимы (фиксированные даты в ZIP и PDF).
+# 3 — ключ строится из нормализованной модели запроса (GenerationRequest).
+CACHE_FORMAT_VERSION = 3
 
-    if QR_CODE_PLACEHOLDER in getattr(paragraph, "text", ""):
-        return True
+CACHE_KINDS = {ARTIFACT_DOCX: "docx", ARTIFACT_PDF: "pdf", ARTIFACT_QR: "png"}
 
-    try:
-        return QR_CODE_PLACEHOLDER in ''.join(run.text for run in getattr(paragraph, "runs", []))
-    except Exception:
-        return False
 
+def generation_cache_key(inputs: GenerationRequest, template: Optional[CompiledTemplate] = None) -> str:
+    """Возвращает стабильный ключ кэша по нормализованной модели запроса и версии шаблона."""
 
-def _clamp_width_to_cell(width_mm: float, row, cell) -> float:
-    """Ограничивает ширину изображения значением, допустимым для ячейки."""
+    template = template or resolve_template(inputs)
+    return make_cache_key(
+        CACHE_FORMAT_VERSION,
+        inputs.canonical(),
+        template.version,
+        "stamp" if FAST_PDF_ENABLED else "convert",
+    )
 
-    limits = []
 
-    cell_width_attr = getattr(cell, "width", None)
-    cell_width_mm = getattr(cell_width_attr, "mm", None) if cell_width_attr else None
-    if cell_width_mm:
-        limits.append(_apply_qr_margin(cell_width_mm))
+def load_cached_documents(cache, key: str, artifacts) -> Optional[GeneratedDocuments]:
+    """Возвращает артефакты из кэша, если там есть все запрошенные, иначе None."""
 
-    if not limits:
-        tc_pr = getattr(getattr(cell, "_tc", None), "tcPr", None)
-        tc_w = getattr(tc_pr, "tcW", None) if tc_pr is not None else None
-        width_twips = getattr(tc_w, "w", None) if tc_w is not None else None
-        try:
-            width_twips_int = int(width_twips) if width_twips is not None else None
-        except (TypeError, ValueError):
-            width_twips_int = None
-        if width_twips_int:
-            width_mm_from_twips = width_twips_int * 25.4 / 1440
-            limits.append(_apply_qr_margin(width_mm_from_twips))
-
-    if not limits:
-        return width_mm
-
-    safe_limit = min(limit for limit in limits if limit)
-    return min(width_mm, safe_limit)
-
-def _ensure_table_fixed_layout(cell) -> None:
-    """Включает фиксированную ширину колонок для таблицы, содержащей ячейку."""
-
-    tr = cell._tc.getparent()
-    tbl = tr.getparent()
-    tblPr = tbl.tblPr
-    if tblPr is None:
-        tblPr = OxmlElement('w:tblPr')
-        tbl.insert(0, tblPr)
-    tblLayout = tblPr.find(qn('w:tblLayout'))
-    if tblLayout is None:
-        tblLayout = OxmlElement('w:tblLayout')
-        tblPr.append(tblLayout)
-    tblLayout.set(qn('w:type'), 'fixed')
-
-def _ensure_gridcol_min_width(cell, min_width_mm: float) -> None:
-    """Задаёт минимальную ширину столбца через элементы <w:tblGrid>/<w:gridCol>."""
-
-    twips = int(round(min_width_mm * 1440 / 25.4))
-    tr = cell._tc.getparent()
-    tbl = tr.getparent()
-
-    columns = [tc for tc in tr.iterchildren() if tc.tag == qn('w:tc')]
-    col_idx = columns.index(cell._tc)
-
-    tblGrid = tbl.tblGrid
-    if tblGrid is None:
-        tblGrid = OxmlElement('w:tblGrid')
-        for _ in range(len(columns)):
-            tblGrid.append(OxmlElement('w:gridCol'))
-        insert_at = 1 if tbl.tblPr is not None else 0
-        tbl.insert(insert_at, tblGrid)
-
-    cols = [c for c in tblGrid.iterchildren() if c.tag == qn('w:gridCol')]
-    while len(cols) <= col_idx:
-        tblGrid.append(OxmlElement('w:gridCol'))
-        cols = [c for c in tblGrid.iterchildren() if c.tag == qn('w:gridCol')]
-
-    curr = cols[col_idx].get(qn('w:w'))
-    try:
-        curr_int = int(curr) if curr else 0
-    except ValueError:
-        curr_int = 0
-    if curr_int < twips:
-        cols[col_idx].set(qn('w:w'), str(twips))
+    cached = cache.get(key, sorted(CACHE_KINDS[artifact] for artifact in artifacts))
+    if cached is None:
+        return None
+    payload = cache.read_optional(key, "payload") or b""
+    return GeneratedDocuments(
+        cached.get("docx"), cached.get("pdf"), cached.get("png"), payload.decode("utf-8")
+    )
 
 
-def insert_qr_code_into_document(docx_path: str, qr_image_path: str, width_mm: float) -> bool:
-    """Вставляет QR-код в документ, отдавая приоритет таблицам с плейсхолдером."""
+def store_cached_documents(cache, key: str, documents: GeneratedDocuments) -> None:
+    """Сохраняет сформированные артефакты в кэш; ошибки записи не прерывают запрос."""
 
-    document = Document(docx_path)
+    try:
+        cache.put(key, {
+            "docx": documents.docx,
+            "pdf": documents.pdf,
+            "png": documents.qr_png,
+            "payload": documents.qr_payload.encode("utf-8"),
+        })
+    except OSError:
+        traceback.print_exc()
 
-    for table in document.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if any(_paragraph_has_placeholder(p) for p in cell.paragraphs):
-                    desired_mm = width_mm
-                    _ensure_table_fixed_layout(cell)
-                    _ensure_gridcol_min_width(cell, desired_mm)
 
-                    effective_width = _clamp_width_to_cell(desired_mm, row, cell)
-                    _ensure_cell_can_fit_image(row, cell, effective_width)
+def build_doc_cached(inputs: GenerationRequest, artifacts=ALL_ARTIFACTS,
+                     timings: Optional[dict] = None,
+                     template: Optional[CompiledTemplate] = None) -> GeneratedDocuments:
+    """Возвращает артефакты из общего кэша или генерирует их через ``build_doc``.
 
-                    if _replace_in_paragraphs(cell.paragraphs, QR_CODE_PLACEHOLDER, qr_image_path, effective_width):
-                        document.save(docx_path)
-                        return True
+    Невоспроизводимые запросы (без ``deal`` номер счёта — случайный UUID) кэш
+    не читают и не пишут.
+    """
 
-    if _replace_in_paragraphs(document.paragraphs, QR_CODE_PLACEHOLDER, qr_image_path, width_mm):
-        document.save(docx_path)
-        return True
+    template = template or resolve_template(inputs)
+    cache = get_artifact_cache() if inputs.reproducible else None
+    if cache is None:
+        return build_doc(inputs, artifacts, timings, template)
 
-    return False
+    key = generation_cache_key(inputs, template)
+    documents = load_cached_documents(cache, key, artifacts)
+    if documents is None:
+        documents = build_doc(inputs, artifacts, timings, template)
+        store_cached_documents(cache, key, documents)
+    return documents
 
 
-MONTHS_RU = {
-    '01': 'января', '02': 'февраля', '03': 'марта',
-    '04': 'апреля', '05': 'мая', '06': 'июня',
-    '07': 'июля', '08': 'августа', '09': 'сентября',
-    '10': 'октября', '11': 'ноября', '12': 'декабря'
-}
+def resolve_template(inputs: GenerationRequest) -> CompiledTemplate:
+    """Шаблон из параметра ``template`` сделки (по умолчанию — основной).
 
+    Бросает ``UnknownTemplateError``, если такого шаблона нет в каталоге.
+    """
 
-def parse_sum_to_kopecks(price_str: str) -> str:
-    """Преобразует строку с суммой в количество копеек для QR-платежей."""
+    return get_template_registry().get(inputs.template or None)
 
-    normalized = (price_str or "").replace(" ", "").replace(",", ".")
-    if not normalized:
-        return ""
 
-    try:
-        amount = float(normalized)
-    except ValueError:
-        return ""
+def request_params() -> dict:
+    """Параметры текущего запроса: query string, дополненная полями JSON-объекта из тела.
 
-    return str(int(round(amount * 100)))
+    Бросает ``RequestValidationError``, если тело POST-запроса — не JSON-объект.
+    """
 
+    params: dict = request.args.to_dict()
+    if request.method == "POST" and request.data:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise RequestValidationError({"body": "ожидается JSON-объект с параметрами сделки"})
+        params.update(body)
+    return params
 
-def get_qr_width_mm(args) -> float:
-    """Читает ширину QR из запроса и ограничивает её допустимым диапазоном."""
 
-    raw = (args.get("qr_width_mm", "") or "").strip()
-    try:
-        width = float(raw.replace(",", ".")) if raw else DEFAULT_QR_WIDTH_MM
-    except ValueError:
-        width = DEFAULT_QR_WIDTH_MM
-    return max(MIN_QR_MM, min(width, MAX_QR_MM))
+# Сколько секунд клиенты и прокси могут отдавать ответ без перепроверки ETag.
+HTTP_MAX_AGE_S = int(os.environ.get("LEADFORCE_HTTP_MAX_AGE_S", "0"))
 
 
-def get_payment_details(args, replacements: dict) -> dict:
-    """Собирает реквизиты для QR-платежа из запроса и дефолтных значений."""
+def response_etag(kind: str, *parts) -> str:
+    """Сильный ETag ответа вида ``kind`` по нормализованным входным данным.
 
-    details = DEFAULT_PAYMENT_DETAILS.copy()
+    Артефакты побайтно воспроизводимы (см. ``reproducible.py``), поэтому
+    одинаковые входные данные дают и одинаковый ETag, и одинаковое тело.
+    """
 
-    for query_param, payload_key in QR_QUERY_MAP.items():
-        value = (args.get(query_param, "") or "").strip()
-        if value:
-            details[payload_key] = value
+    return make_cache_key("etag", kind, *parts)[:32]
 
-    invoice_id = replacements.get("ID", "")
 
-    sum_override = (args.get("qr_sum", "") or "").strip()
-    if sum_override:
-        details["Sum"] = sum_override
-    else:
-        auto_sum = parse_sum_to_kopecks(replacements.get("SUM", ""))
-        if auto_sum:
-            details["Sum"] = auto_sum
+def with_cache_headers(response: Response, etag: Optional[str]) -> Response:
+    """Ставит ETag и Cache-Control; без ETag ответ запрещено сохранять."""
 
-    purpose_override = (args.get("qr_purpose", "") or "").strip()
-    if purpose_override:
-        details["Purpose"] = purpose_override
+    if etag is None:
+        response.headers["Cache-Control"] = "no-store"
     else:
-        purpose = details.get("Purpose", "")
-        if purpose and "{{ID}}" in purpose:
-            details["Purpose"] = purpose.replace("{{ID}}", invoice_id)
-        elif not purpose and invoice_id:
-            details["Purpose"] = f"Оплата по счету №{invoice_id}"
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"public, max-age={HTTP_MAX_AGE_S}, must-revalidate"
+    return response
 
-    return details
 
+def not_modified(etag: Optional[str]) -> Optional[Response]:
+    """Ответ 304, если ``If-None-Match`` GET-запроса совпал с ``etag``, иначе None."""
 
-def format_invoice_date(date_str):
-    """Форматирует дату счёта в человекочитаемый вид или возвращает исходную строку."""
+    if etag is None or request.method not in ("GET", "HEAD") or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_cache_headers(Response(status=304), etag)
 
-    try:
-        day, month, year = date_str.strip().split('.')
-        return f"{int(day)} {MONTHS_RU[month]} {year} г."
-    except Exception:
-        return date_str
 
+def validation_error_response(error: RequestValidationError):
+    """Ответ 400 с описанием каждого некорректного параметра."""
 
-def get_replacements():
-    """Формирует словарь значений для подстановки в шаблон документа."""
+    return jsonify({"error": str(error), "fields": error.errors}), 400
 
-    args = request.args
 
-    price_str = args.get("price", "").replace(",", ".").strip()
-    price_text = args.get("price_text", "").strip()
+def busy_response(error: ConversionBusyError) -> Response:
+    """Ответ 429: конвертер перегружен, клиенту стоит повторить запрос через ``Retry-After`` секунд."""
 
-    bill_date_raw = args.get("bill_date", "").strip()
-    bill_date = bill_date_raw.split()[0] if bill_date_raw and " " in bill_date_raw else ""
-    invoice_date = bill_date or args.get("invoiceDate", "").strip()
-    if not invoice_date:
-        invoice_date = datetime.today().strftime('%d.%m.%Y')
+    response = jsonify({"error": str(error)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
 
-    try:
-        if not price_text:
-            price_float = float(price_str)
-            rub = int(price_float)
-            kop = int(round((price_float - rub) * 100))
-            amount_in_words = f"{num2words(rub, lang='ru').capitalize()} рублей {kop:02d} копеек"
-        else:
-            amount_in_words = price_text
-    except Exception:
-        amount_in_words = ""
-
-    customer_parts = [
-        args.get("name", "").strip(),
-        args.get("phone", "").strip(),
-        args.get("email", "").strip(),
-        args.get("inn", "").strip(),
-        args.get("companyName", "").strip()
-    ]
-    customer = ", \n".join(filter(None, customer_parts))
 
-    product_service = args.get("service", "").strip()
-    product = f"Система привлечения клиентов / {product_service}" if product_service else "Система привлеения клиентов"
+def deadline_response(error: StageTimeout):
+    """Ответ 504: этап ``error.stage`` не уложился в бюджет запроса."""
 
-    return {
-        "ID": args.get("deal", str(uuid.uuid4())[:8]),
-        "INVOICE_DATE": format_invoice_date(invoice_date),
-        "CUSTOMER": customer,
-        "PRODUCT": product,
-        "SUM": price_str,
-        "AMOUNT_IN_WORDS": amount_in_words,
-        "DEAL": args.get("deal", ""),
-        "SERVICE": args.get("service", ""),
-        "CITY": args.get("city", ""),
-        "LEAD_SUM": args.get("lead_sum", ""),
-        "LEAD_COST": args.get("lead_cost", ""),
-        "REVENUE": args.get("revenue", ""),
-        "PRICE": price_str,
-        "EMAIL": args.get("email", ""),
-        "PHONE": args.get("phone", ""),
-        "NAME": args.get("name", ""),
-        "INN": args.get("inn", ""),
-        "COMPANYNAME": args.get("companyName", ""),
-        
-        "CUSTOMER_NAME": args.get("name", "").strip(),
-        "CUSTOMER_EMAIL": args.get("email", "").strip(),
-        "CUSTOMER_PHONE": args.get("phone", "").strip(),
-        "CUSTOMER_INN": args.get("inn", "").strip(),
-        "CUSTOMER_COMPANYNAME": args.get("companyName", "").strip(),
-        
-        "PAYMENT_QR_BASE64": "",
-        "PAYMENT_QR_PAYLOAD": ""
-    }
+    return jsonify({"error": str(error), "stage": error.stage}), 504
 
 
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
-def prepare_generation_inputs():
-    """Возвращает данные для генерации документов: плейсхолдеры, реквизиты и ширину QR."""
+# Формат ответа -> (нужные артефакты, имя файла для скачивания, MIME-тип).
+DOCUMENT_FORMATS = {
+    "pdf": (frozenset({ARTIFACT_PDF}), "document.pdf", "application/pdf"),
+    "docx": (frozenset({ARTIFACT_DOCX}), "document.docx", DOCX_MIMETYPE),
+    "zip_pdf": (frozenset({ARTIFACT_PDF}), "document_pdf.zip", "application/zip"),
+    "zip_docx": (frozenset({ARTIFACT_DOCX}), "document_docx.zip", "application/zip"),
+    "zip_all": (ALL_ARTIFACTS, "documents_full.zip", "application/zip"),
+}
 
-    replacements = get_replacements()
-    payment_details = get_payment_details(request.args, replacements)
-    qr_width_mm = get_qr_width_mm(request.args)
-    return replacements, payment_details, qr_width_mm
 
+# ZIP-формат -> файлы архива: (поле GeneratedDocuments, имя в архиве).
+ZIP_FORMAT_MEMBERS = {
+    "zip_pdf": (("pdf", "document.pdf"),),
+    "zip_docx": (("docx", "document.docx"),),
+    "zip_all": (("docx", "document.docx"), ("pdf", "document.pdf"), ("qr_png", "payment_qr.png")),
+}
 
-def _rescale_png_to_mm(image_path: str, width_mm: float, dpi: int = 300):
-    """Масштабирует квадратный PNG до указанной ширины в миллиметрах."""
 
-    if Image is None:
-        return
-    try:
-        target_px = max(64, int(round(width_mm / 25.4 * dpi)))
-        with Image.open(image_path) as img:
-            img = img.resize((target_px, target_px), resample=RESAMPLE_NEAREST)
-            img.save(image_path, format="PNG", dpi=(dpi, dpi))
-    except Exception:
-        traceback.print_exc()
+def zip_members(output_format: str, documents: GeneratedDocuments) -> list:
+    """Возвращает пары ``(байты, имя в архиве)`` для ZIP-формата ответа."""
 
+    return [(getattr(documents, field), arcname) for field, arcname in ZIP_FORMAT_MEMBERS[output_format]]
 
-def replace_placeholders_in_docx(docx_path: str, replacements: dict) -> None:
-    """Подставляет значения в плейсхолдеры внутри DOCX с сохранением форматирования."""
 
-    doc = Document(docx_path)
+def package_documents(output_format: str, documents: GeneratedDocuments) -> bytes:
+    """Упаковывает сформированные артефакты в тело ответа нужного формата."""
 
-    def replace_in_paragraph(paragraph):
-        if not paragraph.runs:
-            return
-        text = "".join(run.text or "" for run in paragraph.runs)
-        changed = False
-        for key, value in replacements.items():
-            placeholder = f"{{{{{key}}}}}"
-            if placeholder in text:
-                text = text.replace(placeholder, str(value or ""))
-                changed = True
-        if changed:
-            for run in paragraph.runs:
-                run.text = ""
-            paragraph.runs[0].text = text
+    if output_format == "pdf":
+        return documents.pdf or b""
+    if output_format == "docx":
+        return documents.docx or b""
+    if output_format in ZIP_FORMAT_MEMBERS:
+        return zip_bytes(zip_members(output_format, documents))
+    raise ValueError(f"Неизвестный формат документа: {output_format}")
 
-    def walk_tables(tables):
-        for table in tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        replace_in_paragraph(paragraph)
-                    if cell.tables:
-                        walk_tables(cell.tables)
 
-    for paragraph in doc.paragraphs:
-        replace_in_paragraph(paragraph)
+def _measured_stream(chunks, output_format: str):
+    """Пропускает куски архива, учитывая время их сборки (этап ``zip``) и итоговый размер."""
 
-    walk_tables(doc.tables)
+    iterator = iter(chunks)
+    elapsed = 0.0
+    size = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        except Exception:
+            count_stage_error(STAGE_ZIP)
+            raise
+        finally:
+            elapsed += time.perf_counter() - started
+        size += len(chunk)
+        yield chunk
+    observe_stage(STAGE_ZIP, elapsed)
+    observe_output_size(output_format, size)
 
-    for section in doc.sections:
-        for paragraph in section.header.paragraphs:
-            replace_in_paragraph(paragraph)
-        walk_tables(section.header.tables)
-        for paragraph in section.footer.paragraphs:
-            replace_in_paragraph(paragraph)
-        walk_tables(section.footer.tables)
 
-    doc.save(docx_path)
+def zip_response(members: list, download_name: str, output_format: str) -> Response:
+    """Отдаёт ZIP-архив потоком; Content-Length — когда размер известен заранее."""
 
+    response = Response(
+        _measured_stream(stream_zip(members), output_format),
+        mimetype="application/zip",
+        direct_passthrough=True,
+    )
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    length = stream_zip_length(members)
+    if length is not None:
+        response.content_length = length
+    return response
 
-def build_doc(replacements: dict, payment_details: dict, qr_width_mm: float):
-    """Создаёт DOCX и PDF на основе шаблона и реквизитов, возвращая пути к файлам."""
 
-    file_id = str(uuid.uuid4())
-    docx_path = os.path.join(OUTPUT_DIR, f"{file_id}.docx")
+class DocumentPlan(NamedTuple):
+    """Разобранный запрос документа: модель сделки, шаблон и ETag будущего ответа."""
 
-    replacements_for_template = dict(replacements)
-    qr_payload = ""
-    qr_path = ""
+    inputs: GenerationRequest
+    template: CompiledTemplate
+    etag: Optional[str]
 
-    try:
-        qr_payload, qr_path = generate_payment_qr_image(payment_details, file_id)
-    except Exception as qr_error:
-        traceback.print_exc()
-        replacements_for_template["PAYMENT_QR_PAYLOAD"] = str(qr_error)
-        replacements_for_template["PAYMENT_QR_BASE64"] = ""
 
-    if qr_payload and qr_path and os.path.exists(qr_path):
+def plan_document_request(output_format: str):
+    """Разбирает параметры текущего запроса документа.
+
+    Возвращает ``DocumentPlan`` или готовый ответ 304, если ``If-None-Match``
+    совпал с ETag, — тогда генерация не нужна. Ошибки параметров и шаблона
+    бросаются как есть (см. ``document_error_response``).
+    """
+
+    inputs = GenerationRequest.from_params(request_params())
+    template = resolve_template(inputs)
+    etag = None
+    if inputs.reproducible:
+        etag = response_etag(output_format, generation_cache_key(inputs, template))
+        cached_response = not_modified(etag)
+        if cached_response is not None:
+            return cached_response
+    return DocumentPlan(inputs, template, etag)
+
+
+def document_file_response(output_format: str, documents: GeneratedDocuments, etag: Optional[str]) -> Response:
+    """Ответ с готовыми документами в формате ``output_format`` (файл или ZIP потоком)."""
+
+    _, download_name, mimetype = DOCUMENT_FORMATS[output_format]
+    if output_format in ZIP_FORMAT_MEMBERS:
+        # Архив собирается потоком уже после заголовков 200 — бюджет проверяется до них.
+        ensure_stage_budget(STAGE_ZIP)
+        response = zip_response(zip_members(output_format, documents), download_name, output_format)
+        return with_cache_headers(response, etag)
+    body = package_documents(output_format, documents)
+    observe_output_size(output_format, len(body))
+    response = send_file(
+        BytesIO(body),
+        download_name=download_name,
+        mimetype=mimetype,
+        as_attachment=True,
+    )
+    return with_cache_headers(response, etag)
+
+
+def document_error_response(error: Exception):
+    """Ответ на ошибку генерации: 400, 429, 504 или 500 (вызывается из ``except``)."""
+
+    if isinstance(error, RequestValidationError):
+        return validation_error_response(error)
+    if isinstance(error, UnknownTemplateError):
+        return jsonify({"error": str(error)}), 400
+    if isinstance(error, ConversionBusyError):
+        return busy_response(error)
+    if isinstance(error, StageTimeout):
+        return deadline_response(error)
+    traceback.print_exc()
+    return jsonify({"error": str(error)}), 500
+
+
+def _document_response(output_format: str):
+    """Генерирует документы по параметрам запроса и отдаёт их файлом нужного формата.
+
+    Параметры берутся из query string и (для POST) из JSON-объекта в теле и
+    проверяются до генерации: ошибки — ответ 400. Воспроизводимый ответ
+    получает сильный ETag по входным данным; на совпавший ``If-None-Match``
+    сразу уходит 304 — без заполнения шаблона и конвертации. Асинхронный
+    вариант того же маршрута — ``asgi.document_view``.
+    """
+
+    artifacts = DOCUMENT_FORMATS[output_format][0]
+    with request_deadline():
         try:
-            replacements_for_template["PAYMENT_QR_PAYLOAD"] = qr_payload
-            replacements_for_template["PAYMENT_QR_BASE64"] = encode_file_to_base64(qr_path)
-        except Exception:
-            traceback.print_exc()
+            plan = plan_document_request(output_format)
+            if not isinstance(plan, DocumentPlan):
+                return plan
+            documents = build_doc_cached(plan.inputs, artifacts, request_timings(), plan.template)
+            return document_file_response(output_format, documents, plan.etag)
+        except Exception as e:
+            return document_error_response(e)
 
-    fill_template_xml(TEMPLATE_PATH, replacements_for_template, docx_path)
 
-    try:
-        replace_placeholders_in_docx(docx_path, replacements_for_template)
-    except Exception:
-        traceback.print_exc()
+def run_document_job(params: dict, timings: dict) -> tuple:
+    """Выполняет фоновое задание: возвращает (байты результата, имя файла, MIME-тип).
+
+    Задание уже стоит в своей очереди, поэтому слот конвертации оно ждёт без
+    ограничения очереди и времени (``conversion_background``). Задание формата
+    ``batch`` — большой пакет ``/Document/Batch`` с элементами в ``items``.
+    """
+
+    output_format = params.get("format") or "pdf"
+    if output_format == BATCH_JOB_FORMAT:
+        with conversion_background():
+            file_mappings = build_batch_archive(params["items"], timings)
+        with _stage(timings, STAGE_ZIP):
+            body = zip_bytes(file_mappings)
+        observe_output_size(output_format, len(body))
+        return body, "documents_batch.zip", "application/zip"
+
+    artifacts, download_name, mimetype = DOCUMENT_FORMATS[output_format]
+    with conversion_background():
+        documents = build_doc_cached(GenerationRequest.from_params(params), artifacts, timings)
+    if output_format in ZIP_FORMAT_MEMBERS:
+        with _stage(timings, STAGE_ZIP):
+            body = package_documents(output_format, documents)
+    else:
+        body = package_documents(output_format, documents)
+    observe_output_size(output_format, len(body))
+    return body, download_name, mimetype
+
+
+def start_job_queue() -> None:
+    """Поднимает очередь заданий процесса сервиса: она подбирает задания завершившихся процессов."""
+
+    get_job_queue(run_document_job)
+
+
+BATCH_MAX_ITEMS = int(os.environ.get("LEADFORCE_BATCH_MAX_ITEMS", "500"))
+# Столько сделок укладывается в бюджет синхронного запроса; пакет больше
+# выполняется фоновым заданием, а его PDF конвертируются частями такого размера.
+BATCH_SYNC_MAX_ITEMS = max(1, int(os.environ.get("LEADFORCE_BATCH_SYNC_MAX_ITEMS", "20")))
+BATCH_JOB_FORMAT = "batch"
+BATCH_FOLDER_RE = re.compile(r"[^\w.-]+")
+
+
+def batch_items_error(items) -> Optional[tuple]:
+    """Ответ 400, если тело пакетного запроса — не непустой JSON-массив допустимой длины."""
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Ожидается непустой JSON-массив с параметрами сделок"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"В пакете не больше {BATCH_MAX_ITEMS} сделок"}), 400
+    return None
+
+
+def job_accepted_response(state: dict) -> Response:
+    """Ответ 202 на принятое задание: идентификатор и ссылки на статус и результат."""
+
+    status_url = f"/Jobs/{state['id']}"
+    response = jsonify({
+        "id": state["id"],
+        "status": state["status"],
+        "status_url": status_url,
+        "result_url": f"{status_url}/result",
+    })
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return response
+
+
+def submit_batch_job(items: list):
+    """Ставит пакет больше ``LEADFORCE_BATCH_SYNC_MAX_ITEMS`` в очередь заданий.
+
+    Возвращает ответ 202 (или 400 на недопустимый ``callback_url``) либо None,
+    если пакет достаточно мал, чтобы обработать его в запросе.
+    """
+
+    if len(items) <= BATCH_SYNC_MAX_ITEMS:
+        return None
+    callback_url = (request.args.get("callback_url") or "").strip()
+    if callback_url:
+        error = validate_callback_url(callback_url)
+        if error:
+            return jsonify({"error": error}), 400
+    state = get_job_queue(run_document_job).submit({"format": BATCH_JOB_FORMAT, "items": items}, callback_url)
+    return job_accepted_response(state)
+
+
+def _parse_batch_item(item) -> GenerationRequest:
+    """Разбирает элемент пакета — JSON-объект с теми же полями, что и query string."""
+
+    if not isinstance(item, dict):
+        raise RequestValidationError({"item": "ожидается JSON-объект с параметрами сделки"})
+    return GenerationRequest.from_params(item)
+
 
-    if qr_payload and qr_path and os.path.exists(qr_path):
+def _batch_folder_name(index: int, deal: str, used: set) -> str:
+    """Возвращает уникальное имя папки элемента в архиве: номер сделки или порядковый номер."""
+
+    deal = BATCH_FOLDER_RE.sub("_", deal).strip("._")
+    base = deal or f"item_{index + 1:04d}"
+    name = base
+    suffix = 2
+    while name in used:
+        name = f"{base}_{suffix}"
+        suffix += 1
+    used.add(name)
+    return name
+
+
+def build_batch_archive(items: list, timings: Optional[dict] = None) -> list:
+    """Генерирует документы для пакета сделок и возвращает файлы будущего ZIP.
+
+    Результат — пары ``(байты, имя в архиве)`` вместе с ``manifest.json``.
+    Все DOCX заполняются по очереди, а PDF для них создаются вызовами
+    конвертера по ``LEADFORCE_BATCH_SYNC_MAX_ITEMS`` файлов. Ошибки отдельных
+    элементов попадают в ``manifest.json`` и не прерывают остальной пакет.
+    В ``timings`` суммируются длительности этапов по всем элементам.
+    """
+
+    entries = prepare_batch_entries(items, timings)
+    pending = batch_pending_entries(entries)
+    pdfs: list = []
+    for start in range(0, len(pending), BATCH_SYNC_MAX_ITEMS):
+        chunk = [e["documents"].docx for e in pending[start:start + BATCH_SYNC_MAX_ITEMS]]
         try:
-            _rescale_png_to_mm(qr_path, qr_width_mm)
-            insert_qr_code_into_document(docx_path, qr_path, qr_width_mm)
-        except Exception:
+            with _stage(timings, STAGE_CONVERT):
+                pdfs.extend(convert_many_to_pdf(chunk))
+        except (ConversionBusyError, StageTimeout):
+            # Перегрузка и исчерпанный бюджет — ответ на весь пакет (429/504), а не ошибка каждого элемента.
+            raise
+        except Exception as error:
             traceback.print_exc()
+            pdfs.extend([error] * len(chunk))
+    return finish_batch_archive(entries, pending, pdfs)
+
+
+def prepare_batch_entries(items: list, timings: Optional[dict] = None) -> list:
+    """Разбирает элементы пакета и готовит DOCX и QR каждого (из кэша, если можно), без PDF."""
+
+    entries = []
+    used_folders: set = set()
+    for index, item in enumerate(items):
+        # Номер сделки берётся до проверки, чтобы и ошибка попала в папку сделки.
+        deal = item.get("deal") if isinstance(item, dict) else None
+        deal = "" if deal is None else str(deal).strip()
+        entry: dict = {"index": index, "deal": deal, "documents": None, "errors": [],
+                       "folder": _batch_folder_name(index, deal, used_folders)}
+        entries.append(entry)
+        try:
+            inputs = _parse_batch_item(item)
+            template = resolve_template(inputs)
+
+            cache = get_artifact_cache() if inputs.reproducible else None
+            if cache is not None:
+                entry["cache"] = cache
+                entry["cache_key"] = generation_cache_key(inputs, template)
+                entry["documents"] = load_cached_documents(cache, entry["cache_key"], ALL_ARTIFACTS)
+            if entry["documents"] is None:
+                entry["documents"] = build_doc(inputs, {ARTIFACT_DOCX, ARTIFACT_QR}, timings, template)
+        except (RequestValidationError, UnknownTemplateError) as error:
+            entry["errors"].append(str(error))
+        except StageTimeout:
+            raise
+        except Exception as error:
+            traceback.print_exc()
+            entry["errors"].append(str(error))
+    return entries
+
+
+def batch_pending_entries(entries: list) -> list:
+    """Элементы пакета, которым ещё нужна конвертация в PDF."""
+
+    return [e for e in entries if e["documents"] is not None and e["documents"].pdf is None]
+
+
+def finish_batch_archive(entries: list, pending: list, pdfs: list) -> list:
+    """Раскладывает PDF (или ошибки конвертера) по элементам ``pending`` и собирает файлы ZIP с манифестом."""
+
+    for entry, pdf in zip(pending, pdfs):
+        if isinstance(pdf, Exception):
+            entry["errors"].append(f"PDF: {pdf}")
+            continue
+        entry["documents"] = entry["documents"]._replace(pdf=pdf)
+        if "cache" in entry:
+            store_cached_documents(entry["cache"], entry["cache_key"], entry["documents"])
+
+    file_mappings = []
+    manifest = []
+    for entry in entries:
+        documents = entry["documents"]
+        files = []
+        if documents is not None:
+            for data, name in ((documents.docx, "document.docx"),
+                               (documents.pdf, "document.pdf"),
+                               (documents.qr_png, "payment_qr.png")):
+                if data:
+                    arcname = f"{entry['folder']}/{name}"
+                    file_mappings.append((data, arcname))
+                    files.append(arcname)
+        manifest.append({
+            "index": entry["index"],
+            "deal": entry["deal"],
+            "folder": entry["folder"],
+            "status": "error" if entry["errors"] else "ok",
+            "errors": entry["errors"],
+            "files": files,
+        })
+
+    manifest_bytes = json.dumps({"items": manifest}, ensure_ascii=False, indent=2).encode("utf-8")
+    file_mappings.append((manifest_bytes, "manifest.json"))
+    return file_mappings
 
-    pdf_path = convert_to_pdf(docx_path, OUTPUT_DIR)
-    return docx_path, pdf_path, qr_path
 
 def _build_service_description() -> dict:
     """Возвращает краткое описание сервиса и доступные маршруты."""
@@ -944,7 +1257,11 @@ def _build_service_description() -> dict:
             "zip_pdf": "/Document/GetPdfZip",
             "zip_docx": "/Document/GetDocxZip",
             "zip_all": "/Document/GetAllZip",
-            "qr_png": "/Document/GetPaymentQr"
+            "qr_png": "/Document/GetPaymentQr",
+            "batch": "/Document/Batch",
+            "jobs": "/Jobs",
+            "stats": "/Stats",
+            "metrics": "/metrics"
         },
         "docs": "Отправьте GET-запрос на любой endpoint, передав параметры сделки в query string."
     }
@@ -976,6 +1293,80 @@ def docs():
     return jsonify(_build_service_description())
 
 
+@app.route("/Stats")
+def stats():
+    """Статистика кэша артефактов и временных файлов
+    ---
+    tags:
+      - Service
+    responses:
+      200:
+        description: JSON со счётчиками кэша, общими для всех воркеров, занятостью слотов конвертации, объёмом временных файлов по областям и версиями шаблонов
+    """
+    cache = get_artifact_cache()
+    slots = get_conversion_slots()
+    return jsonify({
+        "cache": cache.stats() if cache is not None else None,
+        "convert": slots.stats() if slots is not None else None,
+        "temp": get_temp_store().stats(),
+        "templates": get_template_registry().versions(),
+    })
+
+
+@app.route("/metrics")
+def metrics():
+    """Метрики Prometheus
+    ---
+    tags:
+      - Service
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Метрики в текстовом формате Prometheus, суммарно по всем воркерам
+      503:
+        description: Не установлен пакет prometheus_client
+    """
+    rendered = render_metrics()
+    if rendered is None:
+        return jsonify({"error": "prometheus_client не установлен"}), 503
+    body, content_type = rendered
+    return Response(body, content_type=content_type)
+
+
+@app.route("/Profiles/<profile_id>")
+def get_profile(profile_id):
+    """Скачать дамп профилировщика (только для оператора)
+    ---
+    tags:
+      - Service
+    parameters:
+      - name: profile_id
+        in: path
+        required: true
+        type: string
+        description: Значение заголовка X-Profile-Id профилированного ответа
+      - name: X-LeadForce-Profile
+        in: header
+        required: true
+        type: string
+        description: Секрет оператора (LEADFORCE_PROFILE_SECRET)
+    responses:
+      200:
+        description: Файл .pstats
+      403:
+        description: Неверный секрет или профилирование выключено
+      404:
+        description: Дамп не найден
+    """
+    if not profiling_authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({"error": "Доступ запрещён"}), 403
+    path = profile_path(profile_id)
+    if path is None:
+        return jsonify({"error": "Дамп не найден"}), 404
+    return send_file(path, download_name=profile_id, mimetype="application/octet-stream", as_attachment=True)
+
+
 @app.route("/favicon.ico")
 def favicon():
     """Возвращает пустой ответ для favicon."""
@@ -997,6 +1388,7 @@ def get_pdf():
       - $ref: '#/parameters/bill_date'
       - $ref: '#/parameters/invoiceDate'
       - $ref: '#/parameters/deal'
+      - $ref: '#/parameters/template'
       - $ref: '#/parameters/service'
       - $ref: '#/parameters/city'
       - $ref: '#/parameters/lead_sum'
@@ -1026,21 +1418,18 @@ def get_pdf():
             schema:
               type: string
               format: binary
+      304:
+        description: Документ не изменился (совпал If-None-Match)
+      400:
+        description: Некорректные параметры сделки или неизвестный шаблон
+      429:
+        description: Конвертер PDF перегружен — повторить запрос через Retry-After секунд
       500:
         description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
     """
-    try:
-        replacements, payment_details, qr_width_mm = prepare_generation_inputs()
-        _, pdf_path, _ = build_doc(replacements, payment_details, qr_width_mm)
-        return send_file(
-            pdf_path,
-            download_name="document.pdf",
-            mimetype="application/pdf",
-            as_attachment=True,
-        )
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+    return _document_response("pdf")
 
 @app.route("/Document/GetDocx")
 def get_docx():
@@ -1056,6 +1445,7 @@ def get_docx():
       - $ref: '#/parameters/bill_date'
       - $ref: '#/parameters/invoiceDate'
       - $ref: '#/parameters/deal'
+      - $ref: '#/parameters/template'
       - $ref: '#/parameters/service'
       - $ref: '#/parameters/city'
       - $ref: '#/parameters/lead_sum'
@@ -1085,21 +1475,16 @@ def get_docx():
             schema:
               type: string
               format: binary
+      304:
+        description: Документ не изменился (совпал If-None-Match)
+      400:
+        description: Некорректные параметры сделки или неизвестный шаблон
       500:
         description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
     """
-    try:
-        replacements, payment_details, qr_width_mm = prepare_generation_inputs()
-        docx_path, _, _ = build_doc(replacements, payment_details, qr_width_mm)
-        return send_file(
-            docx_path,
-            download_name="document.docx",
-            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            as_attachment=True,
-        )
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+    return _document_response("docx")
 
 @app.route("/Document/GetPdfZip")
 def get_pdf_zip():
@@ -1115,6 +1500,7 @@ def get_pdf_zip():
       - $ref: '#/parameters/bill_date'
       - $ref: '#/parameters/invoiceDate'
       - $ref: '#/parameters/deal'
+      - $ref: '#/parameters/template'
       - $ref: '#/parameters/service'
       - $ref: '#/parameters/city'
       - $ref: '#/parameters/lead_sum'
@@ -1144,17 +1530,18 @@ def get_pdf_zip():
             schema:
               type: string
               format: binary
+      304:
+        description: Документ не изменился (совпал If-None-Match)
+      400:
+        description: Некорректные параметры сделки или неизвестный шаблон
+      429:
+        description: Конвертер PDF перегружен — повторить запрос через Retry-After секунд
       500:
         description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
     """
-    try:
-        replacements, payment_details, qr_width_mm = prepare_generation_inputs()
-        _, pdf_path, _ = build_doc(replacements, payment_details, qr_width_mm)
-        zip_buffer = zip_single_file(pdf_path, "document.pdf")
-        return send_file(zip_buffer, download_name="document_pdf.zip", mimetype="application/zip", as_attachment=True)
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+    return _document_response("zip_pdf")
 
 @app.route("/Document/GetDocxZip")
 def get_docx_zip():
@@ -1170,6 +1557,7 @@ def get_docx_zip():
       - $ref: '#/parameters/bill_date'
       - $ref: '#/parameters/invoiceDate'
       - $ref: '#/parameters/deal'
+      - $ref: '#/parameters/template'
       - $ref: '#/parameters/service'
       - $ref: '#/parameters/city'
       - $ref: '#/parameters/lead_sum'
@@ -1199,17 +1587,16 @@ def get_docx_zip():
             schema:
               type: string
               format: binary
+      304:
+        description: Документ не изменился (совпал If-None-Match)
+      400:
+        description: Некорректные параметры сделки или неизвестный шаблон
       500:
         description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
     """
-    try:
-        replacements, payment_details, qr_width_mm = prepare_generation_inputs()
-        docx_path, _, _ = build_doc(replacements, payment_details, qr_width_mm)
-        zip_buffer = zip_single_file(docx_path, "document.docx")
-        return send_file(zip_buffer, download_name="document_docx.zip", mimetype="application/zip", as_attachment=True)
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+    return _document_response("zip_docx")
 
 @app.route("/Document/GetAllZip")
 def get_all_zip():
@@ -1225,6 +1612,7 @@ def get_all_zip():
       - $ref: '#/parameters/bill_date'
       - $ref: '#/parameters/invoiceDate'
       - $ref: '#/parameters/deal'
+      - $ref: '#/parameters/template'
       - $ref: '#/parameters/service'
       - $ref: '#/parameters/city'
       - $ref: '#/parameters/lead_sum'
@@ -1254,22 +1642,369 @@ def get_all_zip():
             schema:
               type: string
               format: binary
+      304:
+        description: Документ не изменился (совпал If-None-Match)
+      400:
+        description: Некорректные параметры сделки или неизвестный шаблон
+      429:
+        description: Конвертер PDF перегружен — повторить запрос через Retry-After секунд
+      500:
+        description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
+    """
+    return _document_response("zip_all")
+
+
+@app.route("/Document/GetPdf", methods=["POST"])
+def post_pdf():
+    """Получить PDF по параметрам сделки в JSON
+    ---
+    tags:
+      - Documents
+    consumes:
+      - application/json
+    produces:
+      - application/pdf
+    parameters:
+      - $ref: '#/parameters/deal_body'
+    responses:
+      200:
+        description: PDF файл с заполненными данными
+      400:
+        description: Тело не JSON-объект, некорректные параметры сделки или неизвестный шаблон
+      429:
+        description: Конвертер PDF перегружен — повторить запрос через Retry-After секунд
+      500:
+        description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
+    """
+    return _document_response("pdf")
+
+
+@app.route("/Document/GetDocx", methods=["POST"])
+def post_docx():
+    """Получить DOCX по параметрам сделки в JSON
+    ---
+    tags:
+      - Documents
+    consumes:
+      - application/json
+    produces:
+      - application/vnd.openxmlformats-officedocument.wordprocessingml.document
+    parameters:
+      - $ref: '#/parameters/deal_body'
+    responses:
+      200:
+        description: DOCX файл с заполненными данными
+      400:
+        description: Тело не JSON-объект, некорректные параметры сделки или неизвестный шаблон
       500:
         description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
     """
+    return _document_response("docx")
+
+
+@app.route("/Document/GetPdfZip", methods=["POST"])
+def post_pdf_zip():
+    """Получить ZIP с PDF по параметрам сделки в JSON
+    ---
+    tags:
+      - Documents
+    consumes:
+      - application/json
+    produces:
+      - application/zip
+    parameters:
+      - $ref: '#/parameters/deal_body'
+    responses:
+      200:
+        description: ZIP архив с PDF
+      400:
+        description: Тело не JSON-объект, некорректные параметры сделки или неизвестный шаблон
+      429:
+        description: Конвертер PDF перегружен — повторить запрос через Retry-After секунд
+      500:
+        description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
+    """
+    return _document_response("zip_pdf")
+
+
+@app.route("/Document/GetDocxZip", methods=["POST"])
+def post_docx_zip():
+    """Получить ZIP с DOCX по параметрам сделки в JSON
+    ---
+    tags:
+      - Documents
+    consumes:
+      - application/json
+    produces:
+      - application/zip
+    parameters:
+      - $ref: '#/parameters/deal_body'
+    responses:
+      200:
+        description: ZIP архив с DOCX
+      400:
+        description: Тело не JSON-объект, некорректные параметры сделки или неизвестный шаблон
+      500:
+        description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
+    """
+    return _document_response("zip_docx")
+
+
+@app.route("/Document/GetAllZip", methods=["POST"])
+def post_all_zip():
+    """Получить ZIP с DOCX, PDF и QR по параметрам сделки в JSON
+    ---
+    tags:
+      - Documents
+    consumes:
+      - application/json
+    produces:
+      - application/zip
+    parameters:
+      - $ref: '#/parameters/deal_body'
+    responses:
+      200:
+        description: ZIP архив с документами и QR
+      400:
+        description: Тело не JSON-объект, некорректные параметры сделки или неизвестный шаблон
+      429:
+        description: Конвертер PDF перегружен — повторить запрос через Retry-After секунд
+      500:
+        description: Ошибка генерации документа
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
+    """
+    return _document_response("zip_all")
+
+
+@app.route("/Document/Batch", methods=["POST"])
+def get_batch_zip():
+    """Сгенерировать документы для пакета сделок одним запросом
+    ---
+    tags:
+      - Documents
+    consumes:
+      - application/json
+    produces:
+      - application/zip
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: >
+          Массив объектов с параметрами сделок — те же поля, что и query-параметры
+          остальных маршрутов (deal, price, service, name, qr_* и т. д.)
+        schema:
+          type: array
+          items:
+            type: object
+            additionalProperties:
+              type: string
+      - name: callback_url
+        in: query
+        description: >
+          Для пакета, выполняемого фоновым заданием, — адрес, на который будет
+          отправлен POST с архивом
+        schema:
+          type: string
+    responses:
+      200:
+        description: >
+          ZIP архив с папкой на каждую сделку (document.docx, document.pdf,
+          payment_qr.png) и manifest.json со статусом и ошибками каждого элемента
+        content:
+          application/zip:
+            schema:
+              type: string
+              format: binary
+      202:
+        description: >
+          Пакет больше LEADFORCE_BATCH_SYNC_MAX_ITEMS сделок поставлен в фоновую
+          очередь; архив — по ссылке result_url, когда задание выполнится
+      400:
+        description: Тело запроса не является непустым JSON-массивом или callback_url недопустим
+      429:
+        description: Конвертер PDF перегружен — повторить запрос через Retry-After секунд
+      500:
+        description: Ошибка генерации пакета
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
+    """
+    items = request.get_json(silent=True)
+    error = batch_items_error(items)
+    if error is not None:
+        return error
+    accepted = submit_batch_job(items)
+    if accepted is not None:
+        return accepted
+
     try:
-        replacements, payment_details, qr_width_mm = prepare_generation_inputs()
-        docx_path, pdf_path, qr_path = build_doc(replacements, payment_details, qr_width_mm)
-        file_mappings = [
-            (docx_path, "document.docx"),
-            (pdf_path, "document.pdf"),
-            (qr_path, "payment_qr.png")
-        ]
-        zip_buffer = zip_files(file_mappings)
-        return send_file(zip_buffer, download_name="documents_full.zip", mimetype="application/zip", as_attachment=True)
+        with request_deadline():
+            file_mappings = build_batch_archive(items, request_timings())
+            ensure_stage_budget(STAGE_ZIP)
+        return zip_response(file_mappings, "documents_batch.zip", "batch")
     except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        return document_error_response(e)
+
+
+@app.route("/Jobs", methods=["POST"])
+def create_job():
+    """Поставить генерацию документа в фоновую очередь
+    ---
+    tags:
+      - Jobs
+    consumes:
+      - application/json
+    parameters:
+      - name: format
+        in: query
+        description: Формат результата
+        schema:
+          type: string
+          enum: [pdf, docx, zip_pdf, zip_docx, zip_all]
+          default: pdf
+      - name: callback_url
+        in: query
+        description: Адрес, на который будет отправлен POST с результатом
+        schema:
+          type: string
+      - name: body
+        in: body
+        required: false
+        description: Параметры сделки объектом JSON (дополняют query-параметры)
+        schema:
+          type: object
+          additionalProperties:
+            type: string
+      - $ref: '#/parameters/price'
+      - $ref: '#/parameters/price_text'
+      - $ref: '#/parameters/bill_date'
+      - $ref: '#/parameters/invoiceDate'
+      - $ref: '#/parameters/deal'
+      - $ref: '#/parameters/template'
+      - $ref: '#/parameters/service'
+      - $ref: '#/parameters/city'
+      - $ref: '#/parameters/lead_sum'
+      - $ref: '#/parameters/lead_cost'
+      - $ref: '#/parameters/revenue'
+      - $ref: '#/parameters/email'
+      - $ref: '#/parameters/phone'
+      - $ref: '#/parameters/name'
+      - $ref: '#/parameters/inn'
+      - $ref: '#/parameters/companyName'
+      - $ref: '#/parameters/qr_sum'
+      - $ref: '#/parameters/qr_purpose'
+      - $ref: '#/parameters/qr_width_mm'
+      - $ref: '#/parameters/qr_name'
+      - $ref: '#/parameters/qr_personal_account'
+      - $ref: '#/parameters/qr_bank_name'
+      - $ref: '#/parameters/qr_bic'
+      - $ref: '#/parameters/qr_correspondent_account'
+      - $ref: '#/parameters/qr_inn'
+      - $ref: '#/parameters/qr_kpp'
+      - $ref: '#/parameters/qr_payer_address'
+    responses:
+      202:
+        description: Задание принято; в ответе идентификатор и ссылки на статус и результат
+      400:
+        description: Некорректный формат, callback_url или тело запроса
+    """
+    try:
+        params = request_params()
+        # Проверка до постановки в очередь: некорректное задание не должно ждать воркера.
+        GenerationRequest.from_params(params)
+    except RequestValidationError as e:
+        return validation_error_response(e)
+
+    output_format = params.setdefault("format", "pdf")
+    if not isinstance(output_format, str) or output_format not in DOCUMENT_FORMATS:
+        return jsonify({"error": f"Неизвестный формат: {output_format}"}), 400
+
+    callback_url = str(params.pop("callback_url", "") or "").strip()
+    if callback_url:
+        error = validate_callback_url(callback_url)
+        if error:
+            return jsonify({"error": error}), 400
+
+    state = get_job_queue(run_document_job).submit(params, callback_url)
+    return job_accepted_response(state)
+
+
+@app.route("/Jobs/<job_id>")
+def get_job(job_id):
+    """Статус фонового задания
+    ---
+    tags:
+      - Jobs
+    parameters:
+      - name: job_id
+        in: path
+        required: true
+        schema:
+          type: string
+    responses:
+      200:
+        description: Статус задания, длительности этапов и состояние доставки callback
+      404:
+        description: Задание не найдено
+    """
+    state = get_job_store().load(job_id)
+    if state is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+    if state["status"] in (JOB_QUEUED, JOB_RUNNING) and not job_owner_alive(state):
+        # Процесс, выполнявший задание, завершился: задание ставится заново здесь.
+        state = get_job_queue(run_document_job).recover(job_id) or state
+    return jsonify(public_job_state(state))
+
+
+@app.route("/Jobs/<job_id>/result")
+def get_job_result(job_id):
+    """Результат фонового задания
+    ---
+    tags:
+      - Jobs
+    parameters:
+      - name: job_id
+        in: path
+        required: true
+        schema:
+          type: string
+    responses:
+      200:
+        description: Файл результата (PDF, DOCX или ZIP — по формату задания)
+      404:
+        description: Задание не найдено
+      409:
+        description: Задание ещё выполняется
+      500:
+        description: Задание завершилось ошибкой
+    """
+    store = get_job_store()
+    state = store.load(job_id)
+    if state is None:
+        return jsonify({"error": "Задание не найдено"}), 404
+    if state["status"] == JOB_FAILED:
+        return jsonify({"error": state.get("error"), "status": state["status"]}), 500
+    if state["status"] != JOB_DONE:
+        return jsonify({"error": "Задание ещё не выполнено", "status": state["status"]}), 409
+
+    result = state["result"]
+    return send_file(
+        os.path.abspath(store.result_path(job_id)),
+        download_name=result["filename"],
+        mimetype=result["mimetype"],
+        as_attachment=True,
+    )
 
 
 @app.route("/Document/GetPaymentQr")
@@ -1319,44 +2054,119 @@ def get_payment_qr():
             schema:
               type: string
               format: binary
+      304:
+        description: QR-код не изменился (совпал If-None-Match)
       400:
-        description: QR-код не сформирован
+        description: QR-код не сформирован или некорректные параметры
       500:
         description: Ошибка генерации QR-кода
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
     """
-    try:
-        replacements = get_replacements()
-        payment_details = get_payment_details(request.args, replacements)
-        try:
-            qr_payload, qr_path = generate_payment_qr_image(payment_details, str(uuid.uuid4()))
-        except RuntimeError as dependency_error:
-            return jsonify({"error": str(dependency_error)}), 500
-
-        if not qr_payload or not qr_path or not os.path.exists(qr_path):
-            return jsonify({"error": "Не удалось сформировать QR-код"}), 400
-
-        with open(qr_path, "rb") as qr_file:
-            buffer = BytesIO(qr_file.read())
-        buffer.seek(0)
-
-        response = send_file(
-            buffer,
-            download_name="payment_qr.png",
-            mimetype="image/png",
-            as_attachment=True,
-        )
-        payload_b64 = base64.b64encode(qr_payload.encode("utf-8")).decode("ascii")
-        response.headers["X-Payment-QR-Payload-Base64"] = payload_b64
+    return payment_qr_response()
+
 
+@app.route("/Document/GetPaymentQr", methods=["POST"])
+def post_payment_qr():
+    """Получить PNG с банковским QR-кодом по параметрам сделки в JSON
+    ---
+    tags:
+      - QR
+    consumes:
+      - application/json
+    produces:
+      - image/png
+    parameters:
+      - $ref: '#/parameters/deal_body'
+    responses:
+      200:
+        description: PNG файл с QR-кодом (payload — в заголовке X-Payment-QR-Payload-Base64)
+      400:
+        description: QR-код не сформирован или некорректные параметры
+      500:
+        description: Ошибка генерации QR-кода
+      504:
+        description: Этап генерации не уложился в бюджет времени запроса (этап — в поле stage)
+    """
+    return payment_qr_response()
+
+
+def payment_qr_response():
+    """Отдаёт PNG с QR-кодом по параметрам запроса; ETag и 304 — как у документов."""
+
+    with request_deadline():
         try:
-            os.remove(qr_path)
-        except OSError:
-            pass
+            inputs = GenerationRequest.from_params(request_params())
+            payment_details = inputs.payment_details()
+            etag = None
+            if inputs.reproducible:
+                etag = response_etag("qr", CACHE_FORMAT_VERSION, payment_details, QR_RENDER_DPI)
+                cached_response = not_modified(etag)
+                if cached_response is not None:
+                    return cached_response
+            try:
+                with _stage(request_timings(), STAGE_QR):
+                    qr_payload, qr_png = run_cpu_stage(STAGE_QR, payment_details)
+            except StageTimeout:
+                raise
+            except RuntimeError as dependency_error:
+                return jsonify({"error": str(dependency_error)}), 500
+
+            if not qr_payload or not qr_png:
+                return jsonify({"error": "Не удалось сформировать QR-код"}), 400
+
+            response = send_file(
+                BytesIO(qr_png),
+                download_name="payment_qr.png",
+                mimetype="image/png",
+                as_attachment=True,
+            )
+            payload_b64 = base64.b64encode(qr_payload.encode("utf-8")).decode("ascii")
+            response.headers["X-Payment-QR-Payload-Base64"] = payload_b64
+            return with_cache_headers(response, etag)
+        except StageTimeout as e:
+            return deadline_response(e)
+        except RequestValidationError as e:
+            return validation_error_response(e)
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"error": str(e)}), 500
 
-        return response
-    except Exception as e:
+
+def warm_up() -> None:
+    """Заранее загружает то, что иначе грузится на первом запросе воркера.
+
+    В режиме ``preload_app`` gunicorn вызывает её в мастере до fork
+    (см. ``gunicorn.conf.py``): скомпилированные шаблоны, ленивые импорты,
+    шрифты и базовый PDF быстрого пути (ширина QR по умолчанию) и готовая
+    Swagger-спецификация достаются воркерам общими страницами памяти
+    (copy-on-write). Кэши на диске и пул LibreOffice здесь не трогаются — они
+    принадлежат воркерам; базовый PDF собирает разовый процесс soffice.
+    """
+
+    get_template_registry().preload()
+    GenerationRequest.from_params({"price": "1.01", "deal": "warmup"}).replacements()
+    preload_fonts()
+
+    template = get_template_registry().get()
+    try:
+        qr_png = render_qr_png_uncached(FAST_PDF_BASE_QR_PAYLOAD, DEFAULT_QR_WIDTH_MM, QR_RENDER_DPI)
+        insert_qr_code_into_document(template.render({}), qr_png, DEFAULT_QR_WIDTH_MM)
+    except Exception:
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+
+    # Базовый PDF быстрого пути для ширины QR по умолчанию: иначе его собирает
+    # первый запрос PDF внутри своего бюджета и слота конвертации.
+    engine = get_fast_pdf_engine(template.version, functools.partial(_fast_pdf_base, template))
+    if engine is not None:
+        try:
+            engine.layout(DEFAULT_QR_WIDTH_MM, functools.partial(_fast_pdf_base, template, use_pool=False))
+        except Exception:
+            traceback.print_exc()
+
+    if swagger is not None:
+        with app.app_context():
+            swagger.get_apispecs("swagger")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+"""Общий для воркеров gunicorn кэш готовых артефактов (DOCX, PDF, QR) на диске.
+
+Ключ записи — стабильный хэш нормализованных входных данных генерации, поэтому
+повторный запрос той же сделки с теми же параметрами отдаётся без генерации.
+Записи хранятся файлами ``<key>.<kind>`` в общем каталоге, объём ограничивается
+бюджетом в байтах с вытеснением давно не читавшихся записей (LRU по mtime).
+Счётчики попаданий/промахов и текущий объём лежат в небольшом файле статистики
+и обновляются под ``flock``, так что их видят все процессы.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+CACHE_DIR = os.environ.get("LEADFORCE_CACHE_DIR", "./output/cache")
+CACHE_MAX_BYTES = int(os.environ.get("LEADFORCE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# После вытеснения объём опускается ниже бюджета с запасом, чтобы не чистить
+# каталог на каждой записи.
+CACHE_EVICT_TARGET_RATIO = 0.9
+
+_STATS_FORMAT = "<qqq"  # hits, misses, bytes
+_STATS_SIZE = struct.calcsize(_STATS_FORMAT)
+
+
+def make_cache_key(*parts) -> str:
+    """Возвращает sha256 от канонического JSON-представления частей ключа."""
+
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """Каталог с артефактами, адресуемыми по хэшу входных данных."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._stats_path = os.path.join(root, ".stats")
+        self._lock_path = os.path.join(root, ".lock")
+        self._thread_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """Эксклюзивная блокировка кэша между потоками и процессами."""
+
+        with self._thread_lock:
+            with open(self._lock_path, "a+b") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update_stats(self, hits: int = 0, misses: int = 0, size_delta: int = 0,
+                      size_value: Optional[int] = None) -> tuple:
+        """Атомарно изменяет счётчики в файле статистики и возвращает новые значения."""
+
+        with self._locked():
+            fd = os.open(self._stats_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                raw = os.pread(fd, _STATS_SIZE, 0)
+                values = list(struct.unpack(_STATS_FORMAT, raw)) if len(raw) == _STATS_SIZE else [0, 0, 0]
+                values[0] += hits
+                values[1] += misses
+                values[2] = size_value if size_value is not None else max(values[2] + size_delta, 0)
+                os.pwrite(fd, struct.pack(_STATS_FORMAT, *values), 0)
+                return tuple(values)
+            finally:
+                os.close(fd)
+
+    def _path(self, key: str, kind: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.{kind}")
+
+    def get(self, key: str, kinds) -> Optional[dict]:
+        """Возвращает ``{kind: bytes}`` для всех ``kinds`` или None, если чего-то нет."""
+
+        result = {}
+        now = time.time()
+        try:
+            for kind in kinds:
+                path = self._path(key, kind)
+                with open(path, "rb") as cached:
+                    result[kind] = cached.read()
+                os.utime(path, (now, now))
+        except OSError:
+            self._update_stats(misses=1)
+            return None
+
+        self._update_stats(hits=1)
+        return result
+
+    def read_optional(self, key: str, kind: str) -> Optional[bytes]:
+        """Читает вспомогательную запись без учёта в статистике."""
+
+        try:
+            with open(self._path(key, kind), "rb") as cached:
+                return cached.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, artifacts: dict) -> None:
+        """Сохраняет артефакты атомарно (через временный файл и rename)."""
+
+        directory = os.path.join(self.root, key[:2])
+        os.makedirs(directory, exist_ok=True)
+        written = 0
+        for kind, data in artifacts.items():
+            if data is None:
+                continue
+            path = self._path(key, kind)
+            fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    tmp_file.write(data)
+                # Перезапись ключа меняет объём кэша только на разницу размеров.
+                try:
+                    replaced = os.stat(path).st_size
+                except FileNotFoundError:
+                    replaced = 0
+                os.replace(tmp_path, path)
+            except OSError:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+            written += len(data) - replaced
+
+        _, _, total = self._update_stats(size_delta=written)
+        if total > self.max_bytes:
+            self.evict()
+
+    def _scan(self) -> list:
+        """Возвращает список ``(mtime, size, path)`` всех записей кэша."""
+
+        entries = []
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.startswith(".tmp_"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self) -> None:
+        """Удаляет давно не читавшиеся записи, пока объём не уложится в бюджет."""
+
+        try:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * CACHE_EVICT_TARGET_RATIO)
+            if total > self.max_bytes:
+                for _, size, path in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        continue
+            self._update_stats(size_value=total)
+        except OSError:
+            traceback.print_exc()
+
+    def stats(self) -> dict:
+        """Возвращает счётчики кэша, общие для всех процессов."""
+
+        hits, misses, size = self._update_stats()
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_cache: Optional[ArtifactCache] = None
+
+
+def get_artifact_cache() -> Optional[ArtifactCache]:
+    """Возвращает кэш процесса или None, если кэш выключен (нулевой бюджет)."""
+
+    global _cache
+
+    if CACHE_MAX_BYTES <= 0:
+        return None
+    if _cache is None:
+        _cache = ArtifactCache(CACHE_DIR, CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,414 @@
+"""ASGI-вход сервиса: ``uvicorn asgi:application``.
+
+В WSGI-режиме (``app:app`` под gunicorn) каждый запрос занимает воркер целиком,
+хотя большую часть времени тот просто ждёт LibreOffice. Здесь маршруты
+документов — асинхронные обработчики в цикле событий:
+
+* разбор параметров, QR, заполнение шаблона, сборка архива и чтение кэша
+  выполняются в пуле потоков (``LEADFORCE_ASGI_CPU_THREADS``);
+* конвертация ожидается, не занимая поток: слот общего семафора
+  (``conversion_slots.py``) ждётся через ``asyncio.sleep``, разовый ``soffice``
+  запускается как асинхронный подпроцесс, а вызовы пула LibreOffice идут в
+  отдельном небольшом пуле потоков.
+
+Поэтому один процесс держит сотни запросов в работе, а сколько конвертаций идёт
+на самом деле, по-прежнему решают слоты конвертации. Запросы обрабатывает то же
+Flask-приложение: контекст запроса открывается в задаче asyncio (он живёт в
+contextvars и виден в пуле потоков), хуки ``before_request``/``after_request``,
+ETag, коды ответов, бюджет запроса и метрики — общие с WSGI-режимом. Все прочие
+маршруты (Swagger, ``/Jobs``, ``/Stats``, ``/metrics``) выполняются как обычный
+WSGI-вызов Flask в пуле потоков.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import platform
+import subprocess
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from io import BytesIO
+from typing import Optional
+
+from flask import request
+
+import app as service
+from app import (
+    ARTIFACT_PDF,
+    DOCUMENT_FORMATS,
+    STAGE_CONVERT,
+    STAGE_ZIP,
+    DocumentPlan,
+    GeneratedDocuments,
+    _stage,
+    batch_items_error,
+    batch_pending_entries,
+    build_doc,
+    converter_timeout_error,
+    document_error_response,
+    document_file_response,
+    finish_batch_archive,
+    generation_cache_key,
+    kill_converter_group,
+    load_cached_documents,
+    normalize_pdfs,
+    plan_document_request,
+    prepare_batch_entries,
+    read_converted_pdfs,
+    request_timings,
+    soffice_command,
+    start_job_queue,
+    store_cached_documents,
+    submit_batch_job,
+    write_convert_inputs,
+    zip_response,
+)
+from artifact_cache import get_artifact_cache
+from conversion_slots import CONVERT_SLOTS, ConversionBusyError, get_conversion_slots
+from converter import SOFFICE_POOL_SIZE, get_soffice_pool
+from deadlines import StageTimeout, conversion_timeout, ensure_stage_budget, request_deadline, stage_time_left
+from stage_pool import get_stage_pool
+from temp_store import get_temp_store
+
+ASGI_CPU_THREADS = int(os.environ.get("LEADFORCE_ASGI_CPU_THREADS", str(os.cpu_count() or 1)))
+
+# Ответ отдаётся кусками не меньше этого размера: один переход в пул потоков
+# на кусок, а не на каждый блок FileWrapper или запись архива.
+STREAM_BATCH_BYTES = 256 * 1024
+
+flask_app = service.app
+
+_executors: dict = {}
+
+
+def _executor(name: str, threads: int) -> ThreadPoolExecutor:
+    executor = _executors.get(name)
+    if executor is None:
+        executor = _executors[name] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"asgi-{name}")
+    return executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков с контекстом текущего запроса.
+
+    Контекст (запрос Flask, бюджет времени) копируется через contextvars.
+    """
+
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor("cpu", ASGI_CPU_THREADS), call)
+
+
+async def _run_on_pool(pool, documents: list, timeout: Optional[float]) -> list:
+    """Конвертирует на пуле LibreOffice: UNO-вызовы блокирующие, для них — свой пул потоков."""
+
+    # Потоков хватает на все слоты: ожидание слота их не занимает.
+    threads = max(CONVERT_SLOTS, SOFFICE_POOL_SIZE, 1)
+    call = functools.partial(pool.convert_many_bytes, documents, timeout)
+    results = await asyncio.get_running_loop().run_in_executor(_executor("convert", threads), call)
+    return normalize_pdfs(results)
+
+
+async def _run_converter_process(documents: list, slot, timeout: Optional[float]) -> list:
+    """Разовый ``soffice`` асинхронным подпроцессом; по таймауту убивается вся группа."""
+
+    with get_temp_store().scratch_dir("convert") as scratch:
+        jobs = await run_blocking(write_convert_inputs, scratch, documents)
+        args = soffice_command(scratch, jobs, slot)
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=subprocess.DEVNULL, start_new_session=True
+        )
+        try:
+            returncode = await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            kill_converter_group(process.pid)
+            await process.wait()
+            raise converter_timeout_error(timeout)
+        except asyncio.CancelledError:
+            # Клиент ушёл или сервер останавливается — soffice больше не нужен.
+            kill_converter_group(process.pid)
+            raise
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args)
+        return await run_blocking(read_converted_pdfs, jobs, [None] * len(jobs))
+
+
+async def convert_many_to_pdf_async(documents: list) -> list:
+    """Асинхронный ``app.convert_many_to_pdf``: тот же результат, ожидание без потока."""
+
+    if not documents:
+        return []
+    if platform.system() == "Windows":
+        return await run_blocking(service.convert_many_to_pdf, documents)
+
+    slots = get_conversion_slots()
+    async with slots.acquire_async(stage_time_left()) if slots is not None else nullcontext() as slot:
+        timeout = conversion_timeout()
+        if timeout is not None and timeout <= 0:
+            raise converter_timeout_error(0.0)
+        pool = get_soffice_pool()
+        if pool is not None:
+            return await _run_on_pool(pool, documents, timeout)
+        return await _run_converter_process(documents, slot, timeout)
+
+
+async def build_doc_cached_async(inputs, artifacts, timings: dict, template) -> GeneratedDocuments:
+    """Асинхронный ``app.build_doc_cached``: этапы в пуле потоков, конвертация — ожиданием."""
+
+    cache = get_artifact_cache() if inputs.reproducible else None
+    key = None
+    if cache is not None:
+        key = generation_cache_key(inputs, template)
+        documents = await run_blocking(load_cached_documents, cache, key, artifacts)
+        if documents is not None:
+            return documents
+
+    documents = await run_blocking(build_doc, inputs, artifacts, timings, template, defer_convert=True)
+    if ARTIFACT_PDF in artifacts and documents.pdf is None:
+        with _stage(timings, STAGE_CONVERT):
+            pdf = (await convert_many_to_pdf_async([documents.docx]))[0]
+        if isinstance(pdf, Exception):
+            raise pdf
+        documents = documents._replace(pdf=pdf)
+
+    if cache is not None:
+        await run_blocking(store_cached_documents, cache, key, documents)
+    return documents
+
+
+async def document_view(output_format: str):
+    """Асинхронный вариант ``app._document_response``."""
+
+    artifacts = DOCUMENT_FORMATS[output_format][0]
+    with request_deadline():
+        try:
+            plan = await run_blocking(plan_document_request, output_format)
+            if not isinstance(plan, DocumentPlan):
+                return plan
+            documents = await build_doc_cached_async(plan.inputs, artifacts, request_timings(), plan.template)
+            return await run_blocking(document_file_response, output_format, documents, plan.etag)
+        except Exception as e:
+            return document_error_response(e)
+
+
+async def batch_view():
+    """Асинхронный вариант ``app.get_batch_zip``."""
+
+    items = request.get_json(silent=True)
+    error = batch_items_error(items)
+    if error is not None:
+        return error
+    accepted = await run_blocking(submit_batch_job, items)
+    if accepted is not None:
+        return accepted
+
+    timings = request_timings()
+    try:
+        with request_deadline():
+            entries = await run_blocking(prepare_batch_entries, items, timings)
+            pending = batch_pending_entries(entries)
+            try:
+                with _stage(timings, STAGE_CONVERT):
+                    pdfs = await convert_many_to_pdf_async([e["documents"].docx for e in pending])
+            except (ConversionBusyError, StageTimeout):
+                raise
+            except Exception as convert_error:
+                traceback.print_exc()
+                pdfs = [convert_error] * len(pending)
+            file_mappings = await run_blocking(finish_batch_archive, entries, pending, pdfs)
+            ensure_stage_budget(STAGE_ZIP)
+        return zip_response(file_mappings, "documents_batch.zip", "batch")
+    except Exception as e:
+        return document_error_response(e)
+
+
+async def payment_qr_view():
+    """QR-код — только вычисления, весь обработчик выполняется в пуле потоков."""
+
+    return await run_blocking(service.payment_qr_response)
+
+
+_DOCUMENT_METHODS = ("GET", "HEAD", "POST")
+
+# Путь -> (методы, обработчик). Остальные пути и методы обслуживает WSGI-вызов Flask.
+ASYNC_ROUTES = {
+    "/Document/GetPdf": (_DOCUMENT_METHODS, functools.partial(document_view, "pdf")),
+    "/Document/GetDocx": (_DOCUMENT_METHODS, functools.partial(document_view, "docx")),
+    "/Document/GetPdfZip": (_DOCUMENT_METHODS, functools.partial(document_view, "zip_pdf")),
+    "/Document/GetDocxZip": (_DOCUMENT_METHODS, functools.partial(document_view, "zip_docx")),
+    "/Document/GetAllZip": (_DOCUMENT_METHODS, functools.partial(document_view, "zip_all")),
+    "/Document/Batch": (("POST",), batch_view),
+    "/Document/GetPaymentQr": (_DOCUMENT_METHODS, payment_qr_view),
+}
+
+
+def _wsgi_environ(scope: dict, body: bytes) -> dict:
+    """WSGI-окружение для HTTP-запроса ASGI (PEP 3333)."""
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    server = scope.get("server") or ("localhost", 80)
+    environ["SERVER_NAME"] = server[0]
+    environ["SERVER_PORT"] = str(server[1] or 0)
+    client = scope.get("client")
+    if client:
+        environ["REMOTE_ADDR"] = client[0]
+        environ["REMOTE_PORT"] = str(client[1])
+
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        value = raw_value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _read_body(receive) -> Optional[bytes]:
+    """Тело запроса целиком; None — клиент отключился раньше."""
+
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _dispatch(view):
+    """Как ``Flask.full_dispatch_request``, но с асинхронным обработчиком."""
+
+    try:
+        response = flask_app.preprocess_request()
+        if response is None:
+            response = await view()
+    except Exception as e:
+        response = flask_app.handle_user_exception(e)
+    return flask_app.finalize_request(response)
+
+
+async def _call_async_view(view, environ: dict, start_response):
+    """Обрабатывает запрос в контексте Flask, как ``Flask.wsgi_app``; возвращает тело ответа."""
+
+    context = flask_app.request_context(environ)
+    error = None
+    try:
+        try:
+            context.push()
+            response = await _dispatch(view)
+        except Exception as e:
+            error = e
+            response = flask_app.handle_exception(e)
+        return response(environ, start_response)
+    finally:
+        if error is not None and flask_app.should_ignore_error(error):
+            error = None
+        context.pop(error)
+
+
+def _read_chunks(iterator) -> tuple:
+    """Следующий кусок ответа не меньше ``STREAM_BATCH_BYTES`` и признак конца."""
+
+    parts = []
+    size = 0
+    for chunk in iterator:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_BATCH_BYTES:
+            return b"".join(parts), False
+    return b"".join(parts), True
+
+
+async def _send_wsgi_response(send, started: dict, body) -> None:
+    """Отправляет ответ WSGI (статус и заголовки из ``start_response``) в ASGI."""
+
+    try:
+        status = int(started["status"].split(" ", 1)[0])
+        headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in started["headers"]]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        iterator = iter(body)
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            chunk, finished = await loop.run_in_executor(_executor("cpu", ASGI_CPU_THREADS), _read_chunks, iterator)
+            await send({"type": "http.response.body", "body": chunk, "more_body": not finished})
+    finally:
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+
+
+def _call_wsgi(environ: dict, start_response):
+    return flask_app.wsgi_app(environ, start_response)
+
+
+async def _http(scope: dict, receive, send) -> None:
+    body = await _read_body(receive)
+    if body is None:
+        return
+    environ = _wsgi_environ(scope, body)
+    started: dict = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = status
+        started["headers"] = headers
+
+    route = ASYNC_ROUTES.get(scope["path"])
+    if route is not None and scope["method"] in route[0]:
+        response_body = await _call_async_view(route[1], environ, start_response)
+    else:
+        loop = asyncio.get_running_loop()
+        response_body = await loop.run_in_executor(
+            _executor("cpu", ASGI_CPU_THREADS), _call_wsgi, environ, start_response
+        )
+    await _send_wsgi_response(send, started, response_body)
+
+
+async def _lifespan(receive, send) -> None:
+    """Старт: прогрев, как в режиме preload gunicorn, пул CPU-этапов и очередь заданий; остановка: закрытие пулов потоков."""
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, service.warm_up)
+                # Пул CPU-этапов (если включён) прогревается до первого запроса.
+                await asyncio.get_running_loop().run_in_executor(None, get_stage_pool)
+                start_job_queue()
+            except Exception as e:
+                traceback.print_exc()
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for executor in _executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope: dict, receive, send) -> None:
+    """ASGI-приложение сервиса."""
+
+    if scope["type"] == "http":
+        await _http(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    else:
+        raise ValueError(f"Неподдерживаемый тип ASGI-соединения: {scope['type']}")
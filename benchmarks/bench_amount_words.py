@@ -0,0 +1,149 @@
+"""Сумма прописью: скорость ``amount_words`` против num2words и сверка результатов.
+
+Запуск из корня репозитория (нужен ``pip install num2words`` — в сервисе он
+больше не используется)::
+
+    python benchmarks/bench_amount_words.py --repeat 20000
+    python benchmarks/bench_amount_words.py --exhaustive 10000000 --processes 8
+
+Что делается:
+
+* замер одного вызова на наборе сумм: num2words (как раньше в ``get_replacements``),
+  ``amount_in_words`` без LRU и с LRU (повторная сумма);
+* сверка с num2words: целые числа ``0..--exhaustive`` (``number_in_words``
+  против ``num2words(n, lang="ru")``) и суммы с копейками словами против
+  ``num2words(..., to="currency", currency="RUB")`` для всех копеек 0..99 на
+  наборе рублей. Полный перебор до 10^7 на одном ядре занимает минуты, поэтому
+  диапазон делится между ``--processes`` процессами.
+
+Код выхода 1 — есть расхождения с num2words.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import amount_words  # noqa: E402
+
+try:
+    from num2words import num2words
+except ImportError:  # pragma: no cover - зависит от окружения
+    num2words = None
+
+AMOUNTS = ["29990.50", "1.01", "2.02", "21.21", "1500", "512000.30", "1234567.89", "100000000.99"]
+CURRENCY_RUBLES = (0, 1, 2, 5, 11, 12, 21, 22, 25, 101, 111, 1000, 2001, 21000, 1000000, 22000000)
+CHUNK = 100_000
+
+
+def _time_per_call(func, values: list, repeat: int) -> float:
+    """Медиана времени одного вызова в микросекундах по ``repeat`` проходам набора."""
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in values:
+            func(value)
+        samples.append((time.perf_counter() - started) / len(values) * 1e6)
+    return round(statistics.median(samples), 3)
+
+
+def _legacy(value: str) -> str:
+    """Прежняя реализация из ``get_replacements``."""
+
+    price_float = float(value)
+    rub = int(price_float)
+    kop = int(round((price_float - rub) * 100))
+    return f"{num2words(rub, lang='ru').capitalize()} рублей {kop:02d} копеек"
+
+
+def _uncached(value: str) -> str:
+    amount_words._amount_words.cache_clear()
+    return amount_words.amount_in_words(value)
+
+
+def _check_range(bounds: tuple) -> list:
+    """Расхождения ``number_in_words`` с num2words на ``[start, stop)`` (не больше 10 штук)."""
+
+    start, stop = bounds
+    mismatches = []
+    for number in range(start, stop):
+        expected = num2words(number, lang="ru")
+        actual = amount_words.number_in_words(number)
+        if actual != expected:
+            mismatches.append((number, expected, actual))
+            if len(mismatches) >= 10:
+                break
+    return mismatches
+
+
+def check_integers(limit: int, processes: int) -> list:
+    chunks = [(start, min(start + CHUNK, limit + 1)) for start in range(0, limit + 1, CHUNK)]
+    mismatches = []
+    with multiprocessing.Pool(processes) as pool:
+        for found in pool.imap_unordered(_check_range, chunks):
+            mismatches += found
+    return sorted(mismatches)[:10]
+
+
+def check_currency() -> list:
+    mismatches = []
+    for rubles in CURRENCY_RUBLES:
+        for kopecks in range(100):
+            value = f"{rubles}.{kopecks:02d}"
+            expected = num2words(value, lang="ru", to="currency", currency="RUB").replace(",", "")
+            actual = amount_words.amount_in_words(value, kopecks_in_words=True)
+            if actual[0].lower() + actual[1:] != expected:
+                mismatches.append((value, expected, actual))
+    return mismatches[:10]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="проходов набора сумм в замере")
+    parser.add_argument("--exhaustive", type=int, default=100_000,
+                        help="сверить целые числа 0..N с num2words (0 — не сверять)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты в JSON")
+    args = parser.parse_args()
+
+    if num2words is None:
+        print("Нужен num2words: pip install num2words", file=sys.stderr)
+        return 1
+
+    timings = {
+        "num2words_us": _time_per_call(_legacy, AMOUNTS, args.repeat),
+        "uncached_us": _time_per_call(_uncached, AMOUNTS, args.repeat),
+        "cached_us": _time_per_call(amount_words.amount_in_words, AMOUNTS, args.repeat),
+    }
+    timings["speedup_uncached"] = round(timings["num2words_us"] / timings["uncached_us"], 1)
+    timings["speedup_cached"] = round(timings["num2words_us"] / timings["cached_us"], 1)
+    print(f"num2words {timings['num2words_us']:8.2f} мкс  без LRU {timings['uncached_us']:6.2f} мкс "
+          f"(x{timings['speedup_uncached']})  с LRU {timings['cached_us']:6.2f} мкс (x{timings['speedup_cached']})")
+
+    mismatches = check_currency()
+    print(f"копейки словами: {len(CURRENCY_RUBLES) * 100} сумм, расхождений {len(mismatches)}")
+    if args.exhaustive:
+        started = time.perf_counter()
+        integer_mismatches = check_integers(args.exhaustive, args.processes)
+        print(f"целые 0..{args.exhaustive}: расхождений {len(integer_mismatches)} "
+              f"({time.perf_counter() - started:.1f} с, процессов {args.processes})")
+        mismatches += integer_mismatches
+    for value, expected, actual in mismatches:
+        print(f"  {value}: num2words «{expected}», у нас «{actual}»")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump({"benchmark": "amount_words", "repeat": args.repeat, "timings": timings,
+                       "exhaustive": args.exhaustive, "mismatches": len(mismatches)},
+                      output, ensure_ascii=False, indent=2)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""Микробенчмарки горячего пути генерации без LibreOffice.
+
+Запуск из корня репозитория::
+
+    python benchmarks/bench_generation.py --repeat 50 --json before.json
+    # ... изменения ...
+    python benchmarks/bench_generation.py --repeat 50 --json after.json --compare before.json
+
+По умолчанию используется синтетический шаблон (``synthetic_template.py``), чтобы
+результаты не зависели от боевого шаблона; ``--template`` подставляет любой
+другой. Конвертер PDF заменён заглушкой, возвращающей фиксированный PDF, а
+кэш артефактов и запись QR на диск выключены — замеряется только Python-код.
+Этапы ``*_cold`` каждый раз сбрасывают LRU-мемоизацию QR.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Кэши на диске исказили бы замер; переменные читаются при импорте app.
+os.environ.setdefault("LEADFORCE_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("LEADFORCE_QR_CACHE_SPILL", "0")
+
+import app  # noqa: E402
+import payment_qr  # noqa: E402
+from benchmarks.stubs import install_stub_converter  # noqa: E402
+from benchmarks.synthetic_template import SAMPLE_DEAL, build_synthetic_template  # noqa: E402
+from zip_stream import zip_bytes  # noqa: E402
+
+
+def _time_call(func, repeat: int, warmup: int) -> dict:
+    """Возвращает медиану, p95, минимум и среднее время вызова в миллисекундах."""
+
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[max(math.ceil(len(samples) * 0.95) - 1, 0)], 4),
+        "min_ms": round(samples[0], 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _cold(func):
+    """Оборачивает вызов сбросом мемоизации QR, чтобы замерить полный расчёт."""
+
+    def call():
+        app.render_payment_qr_png.cache_clear()
+        return func()
+
+    return call
+
+
+def _prepare_inputs(params: dict) -> tuple:
+    """Разбор параметров сделки и вывод плейсхолдеров и реквизитов QR."""
+
+    inputs = app.GenerationRequest.from_params(params)
+    return inputs.replacements(), inputs.payment_details()
+
+
+def build_cases(template_path: str) -> dict:
+    """Возвращает ``{имя этапа: функция без аргументов}`` в порядке конвейера."""
+
+    inputs = app.GenerationRequest.from_params(SAMPLE_DEAL)
+    replacements, payment_details, qr_width_mm = inputs.replacements(), inputs.payment_details(), inputs.qr_width_mm
+    template = app.get_template_registry().get()
+    qr_payload, qr_png = app.generate_payment_qr_image(payment_details)
+    scaled_qr = app.render_payment_qr_png(qr_payload, qr_width_mm)
+    filled = template.render(replacements)
+    documents = app.build_doc(inputs)
+
+    cases = {
+        "prepare_inputs": lambda: _prepare_inputs(SAMPLE_DEAL),
+        "compile_template": lambda: app.CompiledTemplate(template_path),
+        "qr_image_cold": _cold(lambda: app.generate_payment_qr_image(payment_details)),
+        "qr_image_memoized": lambda: app.generate_payment_qr_image(payment_details),
+        "fill_template": lambda: template.render(replacements),
+        "insert_qr_code_into_document": lambda: app.insert_qr_code_into_document(filled, scaled_qr, qr_width_mm),
+        "zip_all": lambda: zip_bytes(app.zip_members("zip_all", documents)),
+        "build_doc_cold": _cold(lambda: app.build_doc(inputs)),
+        "build_doc": lambda: app.build_doc(inputs),
+    }
+    if payment_qr.Image is not None:
+        cases["rescale_png_to_mm"] = lambda: payment_qr._rescale_png_to_mm(qr_png, qr_width_mm)
+    return cases
+
+
+def compare(results: dict, baseline_path: str) -> None:
+    """Печатает изменение медианы относительно сохранённого прогона."""
+
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    base_results = baseline.get("results", {})
+    base_revision = baseline.get("meta", {}).get("revision") or baseline_path
+    print(f"\nСравнение с {base_revision}:")
+    for name, current in results.items():
+        previous = base_results.get(name)
+        if previous is None:
+            print(f"  {name:<30} новый этап")
+            continue
+        change = (current["median_ms"] - previous["median_ms"]) / previous["median_ms"] * 100
+        print(f"  {name:<30} {previous['median_ms']:9.3f} -> {current['median_ms']:9.3f} ms  {change:+7.1f}%")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30, help="замеров на этап")
+    parser.add_argument("--warmup", type=int, default=3, help="прогревочных вызовов перед замером")
+    parser.add_argument("--template", help="DOCX-шаблон вместо синтетического")
+    parser.add_argument("--only", action="append", help="замерить только указанные этапы")
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    if payment_qr.qrcode is None:
+        print("Для бенчмарка нужен пакет qrcode", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix="leadforce_bench_") as workdir:
+        template_path = args.template or build_synthetic_template(os.path.join(workdir, "synthetic.docx"))
+        registry = app.get_template_registry()
+        registry.default = registry.register(template_path)
+        install_stub_converter(app)
+
+        results = {}
+        for name, func in build_cases(template_path).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = _time_call(func, args.repeat, args.warmup)
+            row = results[name]
+            print(f"{name:<30} median {row['median_ms']:9.3f} ms  p95 {row['p95_ms']:9.3f} ms")
+
+    report = {
+        "benchmark": "generation",
+        "meta": {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "template": args.template or "synthetic",
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Микробенчмарк растеризации QR: NumPy + 1-битный PNG против пути через Pillow.
+
+Запуск из корня репозитория::
+
+    python benchmarks/bench_qr.py --repeat 200 --json qr_results.json
+
+Для каждой ширины сравниваются время построения PNG, размер файла и совпадение
+пикселей. Мемоизация (``render_payment_qr_png``) в замер не входит.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payment_qr  # noqa: E402
+from generation_request import DEFAULT_QR_WIDTH_MM, MAX_QR_MM, MIN_QR_MM  # noqa: E402
+
+PAYLOAD = (
+    "ST00012|Name=ИП Абакумова Наталья Александровна|PersonalAcc=40802810200006322048"
+    "|BankName=АО «Тинькофф Банк»|BIC=044525974|CorrespAcc=30101810145250000974"
+    "|PayeeINN=720206359451|Sum=2999050|Purpose=Оплата по счету №219418"
+)
+
+
+def _time_call(func, repeat: int) -> dict:
+    """Возвращает медиану и p95 времени вызова в миллисекундах."""
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 4),
+    }
+
+
+def _same_pixels(first: bytes, second: bytes) -> bool:
+    """Сравнивает изображения попиксельно (в оттенках серого)."""
+
+    from PIL import Image
+
+    with Image.open(BytesIO(first)) as a, Image.open(BytesIO(second)) as b:
+        return a.size == b.size and a.convert("L").tobytes() == b.convert("L").tobytes()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=100, help="повторов на каждый вариант")
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты в JSON")
+    args = parser.parse_args()
+
+    if payment_qr.np is None or payment_qr.Image is None:
+        print("Для сравнения нужны и NumPy, и Pillow", file=sys.stderr)
+        return 1
+
+    results = []
+    for width_mm in (None, MIN_QR_MM, DEFAULT_QR_WIDTH_MM, MAX_QR_MM):
+        numpy_png = payment_qr._render_qr_png_numpy(PAYLOAD, width_mm, payment_qr.QR_RENDER_DPI)
+        pil_png = payment_qr._render_qr_png_pil(PAYLOAD, width_mm, payment_qr.QR_RENDER_DPI)
+        row = {
+            "width_mm": width_mm,
+            "numpy": _time_call(lambda: payment_qr._render_qr_png_numpy(PAYLOAD, width_mm, payment_qr.QR_RENDER_DPI), args.repeat),
+            "pillow": _time_call(lambda: payment_qr._render_qr_png_pil(PAYLOAD, width_mm, payment_qr.QR_RENDER_DPI), args.repeat),
+            "numpy_bytes": len(numpy_png),
+            "pillow_bytes": len(pil_png),
+            "same_pixels": _same_pixels(numpy_png, pil_png),
+            "byte_stable": numpy_png == payment_qr._render_qr_png_numpy(PAYLOAD, width_mm, payment_qr.QR_RENDER_DPI),
+        }
+        row["speedup"] = round(row["pillow"]["median_ms"] / row["numpy"]["median_ms"], 2)
+        results.append(row)
+        print(
+            f"width={width_mm!s:>5}  numpy {row['numpy']['median_ms']:8.3f} ms  "
+            f"pillow {row['pillow']['median_ms']:8.3f} ms  x{row['speedup']:<5}  "
+            f"{row['numpy_bytes']:>6} B vs {row['pillow_bytes']:>6} B  "
+            f"pixels={'ok' if row['same_pixels'] else 'DIFF'}"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump({"benchmark": "qr_raster", "repeat": args.repeat, "results": results}, output,
+                      ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
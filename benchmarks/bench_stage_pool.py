@@ -0,0 +1,151 @@
+"""Пропускная способность CPU-этапов (QR, заполнение, вставка QR) в потоках и в пуле процессов.
+
+Запуск из корня репозитория::
+
+    python benchmarks/bench_stage_pool.py --docs 200
+    python benchmarks/bench_stage_pool.py --sizes 1,2,4,8 --threads 16 --json stage_pool.json
+
+Синтетическая нагрузка: ``--threads`` потоков (как пул потоков ASGI-режима или
+``gthread``) собирают DOCX и QR по синтетическому шаблону для ``--docs``
+разных сделок — у каждой свой номер, поэтому мемоизация QR не помогает.
+Конвертации нет, кэш артефактов выключен.
+
+Каждый вариант замеряется в отдельном процессе, потому что пул включается
+переменными окружения при импорте:
+
+* ``threads`` — этапы в потоках одного процесса (``LEADFORCE_STAGE_POOL=0``),
+  они делят GIL, и пропускная способность от числа потоков не растёт;
+* ``pool N`` — этапы в пуле из N процессов (``LEADFORCE_STAGE_POOL_SIZE=N``).
+
+Отчёт: документов в секунду и ускорение относительно ``threads``. На N ядрах
+пул из N процессов должен давать почти N-кратный прирост, пока хватает потоков
+для загрузки пула; больше процессов, чем ядер, прироста не даёт.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Кэши на диске исказили бы замер; процессы пула наследуют эти переменные.
+os.environ.setdefault("LEADFORCE_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("LEADFORCE_QR_CACHE_SPILL", "0")
+
+from benchmarks.synthetic_template import SAMPLE_DEAL, build_synthetic_template  # noqa: E402
+
+
+def _default_sizes() -> str:
+    cores = os.cpu_count() or 1
+    sizes = []
+    size = 1
+    while size < cores:
+        sizes.append(size)
+        size *= 2
+    sizes.append(cores)
+    return ",".join(map(str, sizes))
+
+
+def run_measurement(template_path: str, docs: int, threads: int, warmup: int) -> dict:
+    """Замер в текущем процессе: документов в секунду при ``threads`` потоках."""
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    import app
+    from stage_pool import get_stage_pool
+
+    registry = app.get_template_registry()
+    registry.default = registry.register(template_path)
+    template = registry.get()
+    pool = get_stage_pool()
+
+    def build(index: int) -> int:
+        inputs = app.GenerationRequest.from_params({**SAMPLE_DEAL, "deal": f"bench-{index}"})
+        documents = app.build_doc(inputs, {app.ARTIFACT_DOCX, app.ARTIFACT_QR}, None, template)
+        return len(documents.docx)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(build, range(-warmup, 0)))
+        started = time.perf_counter()
+        sizes = list(executor.map(build, range(docs)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "processes": pool.size if pool is not None else 0,
+        "threads": threads,
+        "docs": docs,
+        "seconds": round(elapsed, 3),
+        "docs_per_s": round(docs / elapsed, 2),
+        "docx_bytes": sizes[0] if sizes else 0,
+    }
+
+
+def measure(template_path: str, pool_size: int, args) -> dict:
+    """Запускает замер в отдельном процессе: ``pool_size=0`` — без пула процессов."""
+
+    env = dict(os.environ)
+    env["LEADFORCE_STAGE_POOL"] = "1" if pool_size else "0"
+    env["LEADFORCE_STAGE_POOL_SIZE"] = str(pool_size)
+    command = [
+        sys.executable, os.path.abspath(__file__), "--measure", template_path,
+        "--docs", str(args.docs), "--threads", str(args.threads), "--warmup", str(args.warmup),
+    ]
+    output = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100, help="документов в замере")
+    parser.add_argument("--threads", type=int, default=max(4, 2 * (os.cpu_count() or 1)),
+                        help="потоков, одновременно собирающих документы")
+    parser.add_argument("--sizes", default=_default_sizes(), help="размеры пула через запятую")
+    parser.add_argument("--warmup", type=int, default=10, help="документов до начала замера")
+    parser.add_argument("--template", help="DOCX-шаблон вместо синтетического")
+    parser.add_argument("--json", dest="json_path", help="куда записать результаты в JSON")
+    parser.add_argument("--measure", metavar="TEMPLATE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(run_measurement(args.measure, args.docs, args.threads, args.warmup)))
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="leadforce_bench_") as workdir:
+        template_path = args.template or build_synthetic_template(os.path.join(workdir, "synthetic.docx"))
+        results["threads"] = measure(template_path, 0, args)
+        for size in sizes:
+            results[f"pool_{size}"] = measure(template_path, size, args)
+
+    baseline = results["threads"]["docs_per_s"]
+    print(f"ядер {os.cpu_count()}, потоков {args.threads}, документов {args.docs}")
+    for name, row in results.items():
+        row["speedup"] = round(row["docs_per_s"] / baseline, 2)
+        print(f"{name:<10} {row['docs_per_s']:8.1f} док/с  x{row['speedup']}")
+
+    if args.json_path:
+        report = {
+            "benchmark": "stage_pool",
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "template": args.template or "synthetic",
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "results": results,
+        }
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
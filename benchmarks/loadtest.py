@@ -0,0 +1,413 @@
+"""Нагрузочный и длительный (soak) прогон сервиса с заглушкой конвертера.
+
+Запуск из корня репозитория::
+
+    # в процессе, через Flask test client
+    python benchmarks/loadtest.py --concurrency 4 --duration 30
+
+    # через gunicorn с теми же хуками, что в продакшене
+    python benchmarks/loadtest.py --mode gunicorn --workers 3 --concurrency 8 --duration 60 \\
+        --mix GetPdf=5,GetAllZip=2,GetDocx=2,GetPaymentQr=1 --convert-ms 400 --json load.json
+
+    # soak: несколько часов трафика и проверка роста памяти воркеров
+    python benchmarks/loadtest.py --mode gunicorn --soak --duration 14400 --sample-interval 60
+
+По умолчанию PDF «конвертирует» заглушка с задержкой ``--convert-ms``;
+``--converter real`` оставляет LibreOffice (нужен ``soffice`` в PATH). Номер
+сделки уникален для каждого запроса, поэтому кэш артефактов не срабатывает;
+``--deal-pool N`` повторяет N сделок по кругу. Отчёт: пропускная способность,
+перцентили задержки по маршрутам и RSS каждого воркера во времени. В режиме
+``--soak`` по RSS после прогрева строится линейный тренд, и прогон завершается
+с кодом 1, если память какого-либо воркера растёт быстрее ``--max-growth-mb-per-hour``
+и прибавила за это время больше ``--min-growth-mb``.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic_template import SAMPLE_DEAL, build_synthetic_template  # noqa: E402
+
+ROUTES = {
+    "GetPdf": "/Document/GetPdf",
+    "GetDocx": "/Document/GetDocx",
+    "GetPdfZip": "/Document/GetPdfZip",
+    "GetDocxZip": "/Document/GetDocxZip",
+    "GetAllZip": "/Document/GetAllZip",
+    "GetPaymentQr": "/Document/GetPaymentQr",
+}
+DEFAULT_MIX = "GetPdf=5,GetAllZip=2,GetDocx=2,GetPaymentQr=1"
+
+# Доля прогона, которую анализ тренда памяти пропускает как прогрев.
+SOAK_WARMUP_FRACTION = 0.25
+
+
+def parse_mix(text: str) -> list:
+    """Разбирает ``GetPdf=5,GetDocx=1`` в список ``[(маршрут, вес), ...]``."""
+
+    mix = []
+    for item in text.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in ROUTES:
+            raise ValueError(f"Неизвестный маршрут {name!r}; доступны: {', '.join(ROUTES)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def deal_params(sequence: int, deal_pool: int) -> dict:
+    params = dict(SAMPLE_DEAL)
+    number = sequence % deal_pool if deal_pool else sequence
+    params["deal"] = str(500000 + number)
+    return params
+
+
+def rss_mb(pid: int) -> float:
+    """RSS процесса в МиБ по /proc (только Linux); 0, если процесса уже нет."""
+
+    try:
+        with open(f"/proc/{pid}/statm", "rb") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def child_pids(parent: int) -> list:
+    """PID прямых потомков процесса (воркеры gunicorn у мастера)."""
+
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as stat:
+                fields = stat.read().rsplit(b")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == parent:
+            children.append(int(entry))
+    return sorted(children)
+
+
+class InProcessTarget:
+    """Приложение в текущем процессе; каждый поток работает со своим test client."""
+
+    def __init__(self):
+        from benchmarks.loadtest_app import app
+
+        self.app = app
+        self._local = threading.local()
+
+    def worker_pids(self) -> list:
+        return [os.getpid()]
+
+    def get(self, path: str, params: dict) -> tuple:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.get(path, query_string=params)
+        return response.status_code, len(response.get_data())
+
+    def close(self) -> None:
+        pass
+
+
+class GunicornTarget:
+    """gunicorn в отдельном процессе с ``gunicorn.conf.py`` и ``loadtest_app``."""
+
+    def __init__(self, workers: int, env: dict, startup_timeout: float = 60.0):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn",
+                "--config", "gunicorn.conf.py",
+                "--workers", str(workers),
+                "--timeout", "120",
+                "--bind", f"127.0.0.1:{port}",
+                "benchmarks.loadtest_app:app",
+            ],
+            cwd=ROOT,
+            env=env,
+        )
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn завершился с кодом {self.process.returncode}")
+            try:
+                with urllib.request.urlopen(self.base_url + "/", timeout=2):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.close()
+        raise RuntimeError("gunicorn не ответил за отведённое время")
+
+    def worker_pids(self) -> list:
+        return child_pids(self.process.pid)
+
+    def get(self, path: str, params: dict) -> tuple:
+        url = f"{self.base_url}{path}?{urllib.parse.urlencode(params)}"
+        try:
+            with urllib.request.urlopen(url, timeout=180) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, len(error.read())
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class MemorySampler(threading.Thread):
+    """Периодически записывает RSS каждого воркера: ``{pid: [(секунда, МиБ), ...]}``."""
+
+    def __init__(self, target, interval: float):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.target = target
+        self.interval = interval
+        self.samples: dict = {}
+        self.started = time.monotonic()
+        self._stopped = threading.Event()
+
+    def sample(self) -> None:
+        elapsed = round(time.monotonic() - self.started, 1)
+        for pid in self.target.worker_pids():
+            value = rss_mb(pid)
+            if value:
+                self.samples.setdefault(pid, []).append((elapsed, round(value, 1)))
+
+    def run(self) -> None:
+        self.sample()
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def latency_summary(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": round(_percentile(values, 0.50) * 1000, 1),
+        "p90_ms": round(_percentile(values, 0.90) * 1000, 1),
+        "p99_ms": round(_percentile(values, 0.99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+    }
+
+
+def memory_trend(samples: list) -> dict:
+    """Наклон RSS в МиБ/час по методу наименьших квадратов после прогрева."""
+
+    if not samples:
+        return {"first_mb": 0.0, "last_mb": 0.0, "max_mb": 0.0, "steady_growth_mb": 0.0,
+                "slope_mb_per_hour": 0.0}
+    start = samples[-1][0] * SOAK_WARMUP_FRACTION
+    steady = [(t, v) for t, v in samples if t >= start] or samples
+    slope = 0.0
+    if len(steady) >= 3:
+        mean_t = statistics.fmean(t for t, _ in steady)
+        mean_v = statistics.fmean(v for _, v in steady)
+        variance = sum((t - mean_t) ** 2 for t, _ in steady)
+        if variance:
+            slope = sum((t - mean_t) * (v - mean_v) for t, v in steady) / variance * 3600
+    return {
+        "first_mb": samples[0][1],
+        "last_mb": samples[-1][1],
+        "max_mb": max(v for _, v in samples),
+        "steady_growth_mb": round(steady[-1][1] - steady[0][1], 1),
+        "slope_mb_per_hour": round(slope, 2),
+    }
+
+
+def run_load(target, mix: list, concurrency: int, duration: float, max_requests: int,
+             deal_pool: int, seed: int) -> tuple:
+    """Гоняет запросы из ``concurrency`` потоков и возвращает (результаты, длительность)."""
+
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+    deadline = time.monotonic() + duration if duration else None
+    results: list = []
+    results_lock = threading.Lock()
+
+    def worker(index: int) -> None:
+        rng = random.Random(seed + index)
+        local = []
+        while deadline is None or time.monotonic() < deadline:
+            with counter_lock:
+                sequence = next(counter)
+            if max_requests and sequence >= max_requests:
+                break
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status, size = target.get(ROUTES[name], deal_params(sequence, deal_pool))
+            except Exception as error:
+                status, size = 0, 0
+                print(f"{name}: {error}", file=sys.stderr)
+            local.append((name, status, time.perf_counter() - started, size))
+        with results_lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def build_report(results: list, elapsed: float, samples: dict, args) -> dict:
+    by_route: dict = {}
+    for name, status, latency, _ in results:
+        by_route.setdefault(name, {"latencies": [], "errors": 0})
+        by_route[name]["latencies"].append(latency)
+        if status != 200:
+            by_route[name]["errors"] += 1
+
+    workers = {str(pid): {**memory_trend(points), "samples": points} for pid, points in samples.items()}
+    flagged = [
+        pid for pid, info in workers.items()
+        if args.soak
+        and info["slope_mb_per_hour"] > args.max_growth_mb_per_hour
+        and info["steady_growth_mb"] > args.min_growth_mb
+    ]
+    return {
+        "mode": args.mode,
+        "converter": args.converter,
+        "convert_ms": args.convert_ms,
+        "concurrency": args.concurrency,
+        "workers": args.workers if args.mode == "gunicorn" else 1,
+        "duration_s": round(elapsed, 1),
+        "requests": len(results),
+        "errors": sum(1 for _, status, _, _ in results if status != 200),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "bytes": sum(size for _, _, _, size in results),
+        "latency": latency_summary([latency for _, _, latency, _ in results]),
+        "routes": {
+            name: {**latency_summary(info["latencies"]), "errors": info["errors"]}
+            for name, info in sorted(by_route.items())
+        },
+        "memory": workers,
+        "memory_growth_flagged": flagged,
+    }
+
+
+def print_report(report: dict) -> None:
+    latency = report["latency"]
+    print(
+        f"\n{report['requests']} запросов за {report['duration_s']} с: "
+        f"{report['throughput_rps']} rps, ошибок {report['errors']}; "
+        f"p50 {latency['p50_ms']} ms, p90 {latency['p90_ms']} ms, p99 {latency['p99_ms']} ms"
+    )
+    for name, info in report["routes"].items():
+        print(
+            f"  {name:<14} {info['count']:>7}  p50 {info['p50_ms']:8.1f}  p90 {info['p90_ms']:8.1f}  "
+            f"p99 {info['p99_ms']:8.1f}  max {info['max_ms']:8.1f} ms  ошибок {info['errors']}"
+        )
+    print("RSS воркеров (МиБ):")
+    for pid, info in report["memory"].items():
+        marker = "  РОСТ" if pid in report["memory_growth_flagged"] else ""
+        print(
+            f"  pid {pid:>7}  {info['first_mb']:7.1f} -> {info['last_mb']:7.1f}  "
+            f"max {info['max_mb']:7.1f}  тренд {info['slope_mb_per_hour']:+8.2f} МиБ/ч{marker}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("inprocess", "gunicorn"), default="inprocess")
+    parser.add_argument("--workers", type=int, default=3, help="воркеров gunicorn")
+    parser.add_argument("--concurrency", type=int, default=4, help="параллельных клиентов")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность прогона, секунд")
+    parser.add_argument("--requests", type=int, default=0, help="остановиться после N запросов")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса маршрутов, например GetPdf=5,GetDocx=1")
+    parser.add_argument("--converter", choices=("stub", "real"), default="stub")
+    parser.add_argument("--convert-ms", type=float, default=300.0, help="задержка заглушки конвертера")
+    parser.add_argument("--template", help="DOCX-шаблон вместо синтетического")
+    parser.add_argument("--deal-pool", type=int, default=0, help="повторять N сделок (попадания в кэш)")
+    parser.add_argument("--sample-interval", type=float, default=5.0, help="период замера RSS, секунд")
+    parser.add_argument("--soak", action="store_true", help="проверить рост памяти воркеров")
+    parser.add_argument("--max-growth-mb-per-hour", type=float, default=20.0,
+                        help="допустимый тренд RSS после прогрева")
+    parser.add_argument("--min-growth-mb", type=float, default=16.0,
+                        help="рост RSS после прогрева, ниже которого тренд считается шумом")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="куда записать отчёт в JSON")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if args.converter == "real" and shutil.which("soffice") is None:
+        print("Режим --converter real требует soffice в PATH", file=sys.stderr)
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix="leadforce_load_")
+    template = args.template or build_synthetic_template(os.path.join(workdir, "synthetic.docx"))
+    os.environ.update({
+        "LEADFORCE_LOADTEST_TEMPLATE": os.path.abspath(template),
+        "LEADFORCE_LOADTEST_CONVERTER": args.converter,
+        "LEADFORCE_LOADTEST_CONVERT_MS": str(args.convert_ms),
+    })
+
+    target = None
+    try:
+        if args.mode == "gunicorn":
+            target = GunicornTarget(args.workers, dict(os.environ))
+        else:
+            target = InProcessTarget()
+        sampler = MemorySampler(target, args.sample_interval)
+        sampler.start()
+        results, elapsed = run_load(
+            target, mix, args.concurrency, args.duration, args.requests, args.deal_pool, args.seed
+        )
+        sampler.stop()
+    finally:
+        if target is not None:
+            target.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = build_report(results, elapsed, sampler.samples, args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+    return 1 if report["memory_growth_flagged"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""WSGI-приложение для нагрузочных прогонов: ``app`` с заглушкой конвертера.
+
+Настраивается переменными окружения, которые выставляет ``loadtest.py``:
+
+* ``LEADFORCE_LOADTEST_CONVERTER`` — ``stub`` (по умолчанию) или ``real``;
+* ``LEADFORCE_LOADTEST_CONVERT_MS`` — задержка заглушки на один вызов;
+* ``LEADFORCE_LOADTEST_TEMPLATE`` — файл шаблона, который становится шаблоном
+  по умолчанию вместо ``Templates/LeadsForce_v0.docx``.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as leadforce_app  # noqa: E402
+from benchmarks.stubs import install_stub_converter  # noqa: E402
+
+if os.environ.get("LEADFORCE_LOADTEST_TEMPLATE"):
+    registry = leadforce_app.get_template_registry()
+    registry.default = registry.register(os.environ["LEADFORCE_LOADTEST_TEMPLATE"])
+
+if os.environ.get("LEADFORCE_LOADTEST_CONVERTER", "stub") == "stub":
+    install_stub_converter(
+        leadforce_app,
+        float(os.environ.get("LEADFORCE_LOADTEST_CONVERT_MS", "0")) / 1000,
+    )
+
+app = leadforce_app.app
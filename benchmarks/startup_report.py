@@ -0,0 +1,262 @@
+"""Отчёт о времени старта и памяти воркеров: импорты, прогрев, RSS/PSS под gunicorn.
+
+Запуск из корня репозитория::
+
+    python benchmarks/startup_report.py --json before.json
+    # ... изменения ...
+    python benchmarks/startup_report.py --json after.json --compare before.json --max-regression 20
+
+Что измеряется:
+
+* ``python -X importtime -c "import app"`` — самые дорогие прямые импорты ``app``;
+* время ``import app`` и ``app.warm_up()`` в чистом процессе и RSS после них
+  (медиана ``--repeat`` запусков);
+* gunicorn с ``--workers`` воркерами без preload и с ``LEADFORCE_PRELOAD_APP=1``:
+  время до первого ответа и RSS/PSS/USS каждого воркера (USS — собственные
+  страницы процесса, PSS — с долей общих). С preload общие страницы делятся
+  между воркерами, и PSS/USS воркера заметно меньше RSS.
+
+С ``--compare`` печатается изменение относительно прошлого отчёта; с
+``--max-regression`` прогон завершается кодом 1, если время импорта или USS
+воркера выросли больше чем на указанный процент. Замеры памяти по /proc —
+только для Linux.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.loadtest import GunicornTarget, child_pids  # noqa: E402
+
+# Запускается в отдельном процессе, чтобы импорт был действительно холодным.
+COLD_START_SNIPPET = """
+import json, os, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+rss_import = int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+app.warm_up()
+warmed = time.perf_counter()
+rss_warm = int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+print(json.dumps({
+    "import_s": imported - started,
+    "warm_up_s": warmed - imported,
+    "rss_import_mb": rss_import / 1048576,
+    "rss_warm_mb": rss_warm / 1048576,
+}))
+"""
+
+
+def _base_env() -> dict:
+    env = dict(os.environ)
+    # Кэши на диске не нужны для замера старта и не должны засорять ./output.
+    env.setdefault("LEADFORCE_CACHE_MAX_BYTES", "0")
+    env.setdefault("LEADFORCE_QR_CACHE_SPILL", "0")
+    env.setdefault("LEADFORCE_TEMP_SWEEP_INTERVAL_S", "0")
+    return env
+
+
+def import_profile(top: int) -> list:
+    """Самые дорогие прямые импорты ``app``: ``[(модуль, мс), ...]``."""
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, env=_base_env(), capture_output=True, text=True, check=True,
+    )
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # строка заголовка
+        # Отступ имени — глубина вложенности: два пробела на уровень.
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth <= 1:
+            children.append((name.strip(), int(cumulative) / 1000, depth))
+    # importtime печатает модуль после его зависимостей: прямые импорты app
+    # (глубина 1) стоят перед строкой самого app (глубина 0).
+    app_index = max(index for index, (name, _, depth) in enumerate(children) if name == "app" and depth == 0)
+    start = app_index
+    while start > 0 and children[start - 1][2] == 1:
+        start -= 1
+    direct = [(name, round(ms, 1)) for name, ms, _ in children[start:app_index]]
+    direct.sort(key=lambda item: item[1], reverse=True)
+    return [("app (всего)", round(children[app_index][1], 1))] + direct[:top]
+
+
+def cold_start(repeat: int) -> dict:
+    """Медианы времени импорта и прогрева и RSS по ``repeat`` холодным запускам."""
+
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", COLD_START_SNIPPET],
+            cwd=ROOT, env=_base_env(), capture_output=True, text=True, check=True,
+        )
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}
+
+
+def memory_mb(pid: int) -> dict:
+    """RSS, PSS и USS процесса в МиБ по /proc/<pid>/smaps_rollup."""
+
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as rollup:
+            for line in rollup:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                    values[key] = int(rest.split()[0]) / 1024
+    except OSError:
+        return {}
+    return {
+        "rss": round(values.get("Rss", 0.0), 1),
+        "pss": round(values.get("Pss", 0.0), 1),
+        "uss": round(values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def gunicorn_startup(workers: int, preload: bool, settle_s: float) -> dict:
+    """Время до первого ответа и память мастера и воркеров gunicorn."""
+
+    env = _base_env()
+    env["LEADFORCE_PRELOAD_APP"] = "1" if preload else "0"
+    started = time.monotonic()
+    target = GunicornTarget(workers, env)
+    ready_s = time.monotonic() - started
+    try:
+        deadline = time.monotonic() + 30
+        while len(target.worker_pids()) < workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+        # Каждому воркеру — один запрос, чтобы посчитать память после первого обращения.
+        for _ in range(workers * 2):
+            target.get("/", {})
+        time.sleep(settle_s)
+        workers_memory = [memory_mb(pid) for pid in child_pids(target.process.pid)]
+        workers_memory = [item for item in workers_memory if item]
+        master = memory_mb(target.process.pid)
+    finally:
+        target.close()
+
+    def median(key: str) -> float:
+        return round(statistics.median(item[key] for item in workers_memory), 1) if workers_memory else 0.0
+
+    return {
+        "ready_s": round(ready_s, 3),
+        "master": master,
+        "worker_rss_mb": median("rss"),
+        "worker_pss_mb": median("pss"),
+        "worker_uss_mb": median("uss"),
+        "total_pss_mb": round(sum(item["pss"] for item in workers_memory) + master.get("pss", 0.0), 1),
+    }
+
+
+def _flatten(report: dict) -> dict:
+    """Числовые показатели отчёта как ``{"раздел.ключ": значение}`` для сравнения."""
+
+    flat = {f"cold_start.{key}": value for key, value in report["cold_start"].items()}
+    for mode, values in report.get("gunicorn", {}).items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                flat[f"gunicorn.{mode}.{key}"] = value
+    return flat
+
+
+# Показатели, рост которых больше --max-regression считается регрессией.
+REGRESSION_KEYS = ("cold_start.import_s", "gunicorn.preload.worker_uss_mb", "gunicorn.fork.worker_uss_mb")
+
+
+def compare(report: dict, baseline_path: str, max_regression: float) -> bool:
+    """Печатает изменения относительно прошлого отчёта; True — есть регрессия."""
+
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    current, previous = _flatten(report), _flatten(baseline)
+    base_revision = baseline.get("meta", {}).get("revision") or baseline_path
+    print(f"\nСравнение с {base_revision}:")
+    regressed = False
+    for key, value in current.items():
+        before = previous.get(key)
+        if not before:
+            continue
+        change = (value - before) / before * 100
+        flag = ""
+        if max_regression and key in REGRESSION_KEYS and change > max_regression:
+            flag = "  РЕГРЕССИЯ"
+            regressed = True
+        print(f"  {key:<36} {before:10.3f} -> {value:10.3f}  {change:+7.1f}%{flag}")
+    return regressed
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="холодных запусков для медианы")
+    parser.add_argument("--top", type=int, default=12, help="сколько импортов показать")
+    parser.add_argument("--workers", type=int, default=3, help="воркеров gunicorn")
+    parser.add_argument("--settle", type=float, default=1.0, help="пауза перед замером памяти, с")
+    parser.add_argument("--skip-gunicorn", action="store_true", help="не запускать gunicorn")
+    parser.add_argument("--json", dest="json_path", help="куда записать отчёт в JSON")
+    parser.add_argument("--compare", help="JSON прошлого отчёта для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.0,
+                        help="допустимый рост времени импорта и USS воркера, %% (0 — не проверять)")
+    args = parser.parse_args()
+
+    print("Самые дорогие импорты (накопительно, мс):")
+    imports = import_profile(args.top)
+    for name, ms in imports:
+        print(f"  {name:<30} {ms:8.1f}")
+
+    cold = cold_start(args.repeat)
+    print(f"\nimport app {cold['import_s'] * 1000:.0f} мс, warm_up {cold['warm_up_s'] * 1000:.0f} мс, "
+          f"RSS {cold['rss_import_mb']:.1f} -> {cold['rss_warm_mb']:.1f} МиБ")
+
+    report = {
+        "benchmark": "startup",
+        "meta": {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": args.workers,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "imports_ms": dict(imports),
+        "cold_start": cold,
+    }
+
+    if not args.skip_gunicorn:
+        report["gunicorn"] = {}
+        for mode, preload in (("fork", False), ("preload", True)):
+            values = gunicorn_startup(args.workers, preload, args.settle)
+            report["gunicorn"][mode] = values
+            print(f"gunicorn {mode:<8} готов за {values['ready_s']:.2f} с; воркер RSS "
+                  f"{values['worker_rss_mb']:.1f} PSS {values['worker_pss_mb']:.1f} "
+                  f"USS {values['worker_uss_mb']:.1f} МиБ; всего PSS {values['total_pss_mb']:.1f} МиБ")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+    if args.compare and compare(report, args.compare, args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
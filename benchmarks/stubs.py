@@ -0,0 +1,28 @@
+"""Заглушка конвертера PDF для бенчмарков и нагрузочных прогонов.
+
+Подменяет ``convert_to_pdf`` и ``convert_many_to_pdf`` в модуле ``app``: вместо
+LibreOffice возвращается фиксированный PDF после заданной паузы, имитирующей
+время конвертации. Остальной путь генерации остаётся настоящим.
+"""
+
+import time
+
+STUB_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def install_stub_converter(app_module, latency_s: float = 0.0) -> None:
+    """Заменяет конвертацию в ``app_module`` заглушкой с задержкой ``latency_s`` на вызов."""
+
+    def convert_many_to_pdf(documents: list) -> list:
+        if latency_s > 0:
+            time.sleep(latency_s)
+        return [STUB_PDF for _ in documents]
+
+    def convert_to_pdf(docx_bytes: bytes) -> bytes:
+        return convert_many_to_pdf([docx_bytes])[0]
+
+    app_module.convert_many_to_pdf = convert_many_to_pdf
+    app_module.convert_to_pdf = convert_to_pdf
@@ -0,0 +1,104 @@
+"""Синтетический DOCX-шаблон для бенчмарков, повторяющий трудные места боевого.
+
+Шаблон строится python-docx при каждом запуске, поэтому в репозитории не
+хранится бинарный файл. В нём есть:
+
+* плейсхолдеры в теле, таблицах, вложенной таблице, верхнем и нижнем колонтитулах;
+* плейсхолдеры, разрезанные Word на два и три run'а с разным форматированием;
+* ячейка ``{{QR_CODE}}`` под картинку с банковским QR;
+* объём текста и строк таблицы, сопоставимый с реальным счётом.
+
+Запуск как скрипта сохраняет шаблон по указанному пути::
+
+    python benchmarks/synthetic_template.py /tmp/synthetic.docx
+"""
+
+import sys
+
+from docx import Document
+from docx.shared import Mm, Pt
+
+ITEM_ROWS = 12
+FILLER_PARAGRAPHS = 20
+
+# Параметры сделки, которыми бенчмарки заполняют шаблон (как query string CRM).
+SAMPLE_DEAL = {
+    "deal": "219418",
+    "price": "29990.50",
+    "service": "Продажа оборудования",
+    "city": "Москва",
+    "name": "Альбина",
+    "phone": "+79160000000",
+    "email": "client@example.com",
+    "inn": "7701234567",
+    "companyName": "ООО «Ромашка»",
+    "lead_sum": "10",
+    "lead_cost": "2999.05",
+    "revenue": "150000",
+}
+
+
+def _add_split_runs(paragraph, *parts, bold_index=None):
+    """Добавляет текст несколькими run'ами — так Word хранит отредактированный текст."""
+
+    for index, part in enumerate(parts):
+        run = paragraph.add_run(part)
+        if index == bold_index:
+            run.bold = True
+
+
+def build_synthetic_template(path: str) -> str:
+    """Создаёт шаблон по пути ``path`` и возвращает этот путь."""
+
+    document = Document()
+    section = document.sections[0]
+
+    header = section.header.paragraphs[0]
+    _add_split_runs(header, "ООО «ЛидФорс» · Счёт № {{", "ID", "}} от {{INVOICE_DATE}}", bold_index=1)
+    footer = section.footer.paragraphs[0]
+    _add_split_runs(footer, "Сделка {{DE", "AL}} · {{CITY}} · {{EMAIL}}")
+
+    title = document.add_paragraph()
+    _add_split_runs(title, "Счёт на оплату № {{ID}} от ", "{{INVOICE", "_DATE}}", bold_index=1)
+    title.runs[0].font.size = Pt(14)
+
+    document.add_paragraph("Покупатель: {{CUSTOMER}}")
+    buyer = document.add_paragraph()
+    _add_split_runs(buyer, "ИНН {{CUSTOMER_", "INN}}, ", "{{CUSTOMER_COMPANY", "NAME}}")
+    document.add_paragraph("Контакт: {{CUSTOMER_NAME}}, {{CUSTOMER_PHONE}}, {{CUSTOMER_EMAIL}}")
+
+    items = document.add_table(rows=ITEM_ROWS + 1, cols=4)
+    for column, caption in enumerate(("Наименование", "Кол-во", "Цена", "Сумма")):
+        items.cell(0, column).text = caption
+    for row in range(1, ITEM_ROWS + 1):
+        items.cell(row, 0).text = "{{PRODUCT}}" if row == 1 else f"Позиция {row}: {{{{SERVICE}}}}"
+        items.cell(row, 1).text = "{{LEAD_SUM}}"
+        items.cell(row, 2).text = "{{LEAD_COST}}"
+        _add_split_runs(items.cell(row, 3).paragraphs[0], "{{S", "U", "M}}", bold_index=1)
+
+    totals = document.add_table(rows=2, cols=2)
+    totals.cell(0, 0).text = "Итого к оплате: {{PRICE}} руб."
+    nested = totals.cell(0, 1).add_table(rows=2, cols=1)
+    nested.cell(0, 0).text = "Сумма прописью: {{AMOUNT_IN_WORDS}}"
+    _add_split_runs(nested.cell(1, 0).paragraphs[0], "Выручка {{REV", "ENUE}}")
+    totals.cell(1, 0).text = "{{QR_CODE}}"
+    totals.cell(1, 1).text = "{{PAYMENT_QR_PAYLOAD}}"
+    totals.columns[0].width = Mm(60)
+
+    for index in range(FILLER_PARAGRAPHS):
+        document.add_paragraph(
+            f"{index + 1}. Условия оказания услуг по сделке {{{{DEAL}}}}: оплата счёта означает "
+            "согласие с офертой, услуги оказываются в течение срока действия тарифа, "
+            "акт выполненных работ направляется на {{EMAIL}}."
+        )
+    document.add_paragraph("Телефон для связи: {{PHONE}}, {{NAME}}, ИНН {{INN}}, {{COMPANYNAME}}")
+
+    document.save(path)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Использование: python benchmarks/synthetic_template.py <путь.docx>", file=sys.stderr)
+        sys.exit(2)
+    print(build_synthetic_template(sys.argv[1]))
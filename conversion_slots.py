@@ -0,0 +1,250 @@
+"""Общий для всех воркеров семафор конвертаций DOCX -> PDF с ограниченной очередью.
+
+Конвертация LibreOffice — самый тяжёлый этап, и воркеры gunicorn запускают её
+независимо друг от друга. Чтобы одновременно шло не больше
+``LEADFORCE_CONVERT_SLOTS`` конвертаций на весь сервис, каждая занимает слот —
+файл ``slot_<n>.lock`` в общем каталоге ``LEADFORCE_CONVERT_SLOTS_DIR``,
+заблокированный через ``flock``. Блокировка снимается ядром и при падении
+процесса, поэтому «зависших» слотов не бывает.
+
+У каждого слота свой профиль LibreOffice (``profile_<n>``): он создаётся при
+первой конвертации в слоте и дальше переиспользуется. Слот в каждый момент
+занят одним процессом, так что одновременные ``soffice`` не делят профиль и не
+упираются в его блокировку.
+
+Если свободного слота нет, запрос встаёт в очередь — занимает один из
+``LEADFORCE_CONVERT_QUEUE_LIMIT`` файлов ``queue_<n>.lock`` — и ждёт слот не
+дольше ``LEADFORCE_CONVERT_WAIT_TIMEOUT_S``. Когда очередь заполнена или время
+ожидания вышло, бросается ``ConversionBusyError``: маршруты отвечают на неё 429
+с ``Retry-After``, а не держат запрос до таймаута gunicorn. Фоновые задания
+(``conversion_background``) ждут слот без очереди и без ограничения времени.
+
+Слот занимает ``acquire``, а в ASGI-режиме — ``acquire_async``: та же очередь и
+те же отказы, но ожидание идёт в цикле событий и не держит поток.
+"""
+
+import asyncio
+import contextvars
+import os
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+from metrics import count_convert_rejected, observe_convert_wait
+
+
+CONVERT_SLOTS = int(os.environ.get("LEADFORCE_CONVERT_SLOTS", str(os.cpu_count() or 2)))
+CONVERT_QUEUE_LIMIT = int(os.environ.get("LEADFORCE_CONVERT_QUEUE_LIMIT", "8"))
+CONVERT_WAIT_TIMEOUT_S = float(os.environ.get("LEADFORCE_CONVERT_WAIT_TIMEOUT_S", "60"))
+CONVERT_RETRY_AFTER_S = int(os.environ.get("LEADFORCE_CONVERT_RETRY_AFTER_S", "5"))
+CONVERT_SLOTS_DIR = os.environ.get(
+    "LEADFORCE_CONVERT_SLOTS_DIR",
+    os.path.join(tempfile.gettempdir(), "leadforce-convert-slots"),
+)
+
+# Как часто ожидающий запрос проверяет, не освободился ли слот.
+CONVERT_POLL_INTERVAL_S = 0.05
+
+_background = contextvars.ContextVar("leadforce_conversion_background", default=False)
+
+
+class ConversionBusyError(RuntimeError):
+    """Все слоты конвертации заняты, а очередь заполнена или ждать дольше нельзя."""
+
+    def __init__(self, message: str, retry_after: int = CONVERT_RETRY_AFTER_S):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class ConversionSlot(NamedTuple):
+    """Занятый слот: номер и каталог профиля LibreOffice этого слота."""
+
+    index: int
+    profile_dir: str
+
+    @property
+    def profile_url(self) -> str:
+        """Значение для ``-env:UserInstallation``."""
+
+        return Path(self.profile_dir).as_uri()
+
+
+@contextmanager
+def conversion_background():
+    """Помечает конвертации блока как фоновые: они ждут слот без очереди и таймаута."""
+
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+class ConversionSlots:
+    """Слоты конвертации и очередь ожидания на файловых блокировках."""
+
+    def __init__(self, size: int, queue_limit: int = CONVERT_QUEUE_LIMIT,
+                 directory: str = CONVERT_SLOTS_DIR):
+        self.size = size
+        self.queue_limit = max(0, queue_limit)
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _try_lock(self, name: str):
+        """Открывает и блокирует файл без ожидания; None — файл занят другим."""
+
+        lock_file = open(os.path.join(self.directory, name), "a+b")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _try_any(self, prefix: str, count: int) -> tuple:
+        """Пытается занять любой из файлов ``<prefix>_<n>.lock``: (номер, файл) или (None, None)."""
+
+        for index in range(count):
+            lock_file = self._try_lock(f"{prefix}_{index}.lock")
+            if lock_file is not None:
+                return index, lock_file
+        return None, None
+
+    @staticmethod
+    def _release(lock_file) -> None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    def _slot_steps(self, timeout: Optional[float]):
+        """Ожидание свободного слота по шагам: отдаёт паузы между попытками.
+
+        Возвращает (через ``StopIteration.value``) пару (номер, файл) или
+        (None, None), если время ожидания вышло. Пауза — забота вызывающего:
+        так одна логика служит и потокам (``time.sleep``), и asyncio.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            index, lock_file = self._try_any("slot", self.size)
+            if lock_file is not None:
+                return index, lock_file
+            if deadline is not None and time.monotonic() >= deadline:
+                return None, None
+            yield CONVERT_POLL_INTERVAL_S
+
+    def _acquire_steps(self, max_wait: Optional[float]):
+        """Захват слота с очередью по шагам (см. ``_slot_steps``); возвращает (номер, файл)."""
+
+        index, slot_file = self._try_any("slot", self.size)
+        if slot_file is not None:
+            return index, slot_file
+        if _background.get():
+            return (yield from self._slot_steps(None))
+
+        _, ticket = self._try_any("queue", self.queue_limit)
+        if ticket is None:
+            count_convert_rejected("queue_full")
+            raise ConversionBusyError("Очередь на конвертацию PDF заполнена, повторите запрос позже")
+        try:
+            wait = CONVERT_WAIT_TIMEOUT_S if max_wait is None else min(CONVERT_WAIT_TIMEOUT_S, max_wait)
+            index, slot_file = yield from self._slot_steps(wait)
+        finally:
+            self._release(ticket)
+        if slot_file is None:
+            count_convert_rejected("wait_timeout")
+            raise ConversionBusyError("Не дождались свободного слота конвертации PDF, повторите запрос позже")
+        return index, slot_file
+
+    @contextmanager
+    def _holding(self, index: int, slot_file, started: float):
+        """Отдаёт занятый слот на время блока и освобождает его после."""
+
+        observe_convert_wait(time.perf_counter() - started)
+        profile_dir = os.path.join(self.directory, f"profile_{index}")
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            yield ConversionSlot(index, profile_dir)
+        finally:
+            self._release(slot_file)
+
+    @contextmanager
+    def acquire(self, max_wait: Optional[float] = None):
+        """Занимает слот на время блока и отдаёт ``ConversionSlot``.
+
+        Бросает ``ConversionBusyError``, если очередь заполнена или слот не
+        освободился за ``LEADFORCE_CONVERT_WAIT_TIMEOUT_S`` (и за ``max_wait``
+        секунд, если он задан, — например, остаток бюджета запроса).
+        """
+
+        started = time.perf_counter()
+        steps = self._acquire_steps(max_wait)
+        try:
+            while True:
+                time.sleep(next(steps))
+        except StopIteration as done:
+            index, slot_file = done.value
+        with self._holding(index, slot_file, started) as slot:
+            yield slot
+
+    @asynccontextmanager
+    async def acquire_async(self, max_wait: Optional[float] = None):
+        """То же, что ``acquire``, но ожидание не занимает поток (для ASGI-режима)."""
+
+        started = time.perf_counter()
+        steps = self._acquire_steps(max_wait)
+        try:
+            while True:
+                await asyncio.sleep(next(steps))
+        except StopIteration as done:
+            index, slot_file = done.value
+        finally:
+            # Отменённое ожидание закрывает генератор — место в очереди освобождается.
+            steps.close()
+        with self._holding(index, slot_file, started) as slot:
+            yield slot
+
+    def _count_busy(self, prefix: str, count: int) -> int:
+        busy = 0
+        for index in range(count):
+            lock_file = self._try_lock(f"{prefix}_{index}.lock")
+            if lock_file is None:
+                busy += 1
+            else:
+                self._release(lock_file)
+        return busy
+
+    def stats(self) -> dict:
+        """Занятые слоты и длина очереди по всем воркерам (мгновенный снимок)."""
+
+        return {
+            "slots": self.size,
+            "busy": self._count_busy("slot", self.size),
+            "queue_limit": self.queue_limit,
+            "waiting": self._count_busy("queue", self.queue_limit),
+            "wait_timeout_s": CONVERT_WAIT_TIMEOUT_S,
+        }
+
+
+_slots: Optional[ConversionSlots] = None
+_slots_lock = threading.Lock()
+
+
+def get_conversion_slots() -> Optional[ConversionSlots]:
+    """Возвращает слоты конвертации или None, если ограничение выключено (``LEADFORCE_CONVERT_SLOTS=0``) или нет ``fcntl``."""
+
+    global _slots
+
+    if fcntl is None or CONVERT_SLOTS <= 0:
+        return None
+    with _slots_lock:
+        if _slots is None:
+            _slots = ConversionSlots(CONVERT_SLOTS)
+        return _slots
@@ -0,0 +1,398 @@
+"""Пул долгоживущих экземпляров LibreOffice для конвертации DOCX -> PDF.
+
+Каждый экземпляр запускается один раз в headless-режиме с UNO-слушателем на
+локальном сокете (``--accept=pipe,...``) и обслуживает много конвертаций подряд,
+поэтому запрос не платит за холодный старт soffice. Пул перезапускает упавшие
+экземпляры и периодически пересоздаёт их по числу конвертаций и объёму RSS.
+
+Для работы нужен Python-модуль ``uno`` (пакет ``python3-uno`` в Ubuntu, venv
+должен видеть системные site-packages). Если модуль недоступен, ``get_soffice_pool``
+возвращает None и приложение конвертирует документы прежним способом.
+"""
+
+import atexit
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Optional
+
+try:
+    import uno  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - зависит от окружения
+    uno = None  # type: ignore[assignment]
+
+from deadlines import StageTimeout
+from metrics import count_converter_kill, count_stage_timeout
+from temp_store import get_temp_store, register_temp_area
+
+
+SOFFICE_BINARY = os.environ.get("LEADFORCE_SOFFICE_BINARY", "soffice")
+SOFFICE_POOL_SIZE = int(os.environ.get("LEADFORCE_SOFFICE_POOL_SIZE", "2"))
+SOFFICE_MAX_CONVERSIONS = int(os.environ.get("LEADFORCE_SOFFICE_MAX_CONVERSIONS", "200"))
+SOFFICE_MAX_RSS_MB = int(os.environ.get("LEADFORCE_SOFFICE_MAX_RSS_MB", "1024"))
+SOFFICE_START_TIMEOUT_S = float(os.environ.get("LEADFORCE_SOFFICE_START_TIMEOUT_S", "60"))
+SOFFICE_WATCHDOG_INTERVAL_S = float(os.environ.get("LEADFORCE_SOFFICE_WATCHDOG_INTERVAL_S", "5"))
+SOFFICE_ACQUIRE_TIMEOUT_S = float(os.environ.get("LEADFORCE_SOFFICE_ACQUIRE_TIMEOUT_S", "90"))
+SOFFICE_WORK_DIR = os.environ.get(
+    "LEADFORCE_SOFFICE_WORK_DIR",
+    os.path.join(tempfile.gettempdir(), "leadforce-soffice"),
+)
+# Временные DOCX/PDF конвертера живут доли секунды, поэтому по умолчанию — tmpfs.
+CONVERT_TMP_DIR = os.environ.get(
+    "LEADFORCE_CONVERT_TMP_DIR",
+    "/dev/shm/leadforce" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "leadforce"),
+)
+
+register_temp_area("convert", CONVERT_TMP_DIR, pid_scoped=True)
+# Профиль живёт вместе с экземпляром; после падения воркера его убирает уборка.
+register_temp_area("soffice_profiles", SOFFICE_WORK_DIR, ttl_s=None, pid_scoped=True)
+
+# Без uno пул молча выключается, и каждая конвертация запускает soffice заново —
+# на сервере это почти всегда venv без --system-site-packages.
+if uno is None and SOFFICE_POOL_SIZE > 0 and os.name != "nt":
+    print(
+        "ВНИМАНИЕ: модуль uno недоступен, пул LibreOffice выключен — PDF конвертируется "
+        "разовым запуском soffice. Установите python3-uno и создайте venv с --system-site-packages."
+    )
+
+
+def _make_property(name: str, value: Any):
+    """Создаёт UNO-структуру PropertyValue."""
+
+    prop = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def _process_tree_rss_bytes(pid: int) -> int:
+    """Суммирует RSS процесса и всех его потомков по данным /proc (только Linux)."""
+
+    total = 0
+    pending = [pid]
+    seen = set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            with open(f"/proc/{current}/status", "r", encoding="ascii", errors="ignore") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+        task_dir = f"/proc/{current}/task"
+        try:
+            tasks = os.listdir(task_dir)
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                with open(os.path.join(task_dir, task, "children"), "r", encoding="ascii") as children:
+                    pending.extend(int(child) for child in children.read().split())
+            except OSError:
+                continue
+    return total
+
+
+class SofficeInstance:
+    """Один headless-процесс LibreOffice со своим профилем и UNO-сокетом."""
+
+    def __init__(self, index: int, work_dir: str):
+        self.index = index
+        self.pipe_name = f"leadforce_{os.getpid()}_{index}_{uuid.uuid4().hex[:8]}"
+        self.profile_dir = os.path.join(work_dir, f"profile_{os.getpid()}_{index}")
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop: Any = None
+        self.conversions = 0
+
+    def start(self) -> None:
+        """Запускает soffice и дожидается готовности UNO-слушателя."""
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.process = subprocess.Popen(
+            [
+                SOFFICE_BINARY,
+                "--headless",
+                "--invisible",
+                "--nologo",
+                "--nodefault",
+                "--norestore",
+                "--nolockcheck",
+                f"-env:UserInstallation={uno.systemPathToFileUrl(self.profile_dir)}",
+                f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        url = f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+        deadline = time.monotonic() + SOFFICE_START_TIMEOUT_S
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(
+                    f"LibreOffice завершился при запуске с кодом {self.process.returncode}"
+                )
+            try:
+                context = resolver.resolve(url)
+                break
+            except Exception:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("LibreOffice не открыл UNO-сокет за отведённое время")
+                time.sleep(0.25)
+
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+        self.conversions = 0
+
+    def is_alive(self) -> bool:
+        """Проверяет, что процесс soffice ещё работает."""
+
+        return self.process is not None and self.process.poll() is None
+
+    def rss_bytes(self) -> int:
+        """Возвращает суммарный RSS процесса soffice вместе с soffice.bin."""
+
+        if self.process is None or not self.is_alive():
+            return 0
+        return _process_tree_rss_bytes(self.process.pid)
+
+    def needs_recycle(self) -> bool:
+        """Сообщает, что экземпляр пора пересоздать по лимитам пула."""
+
+        if SOFFICE_MAX_CONVERSIONS > 0 and self.conversions >= SOFFICE_MAX_CONVERSIONS:
+            return True
+        if SOFFICE_MAX_RSS_MB > 0 and self.rss_bytes() > SOFFICE_MAX_RSS_MB * 1024 * 1024:
+            return True
+        return False
+
+    def convert(self, input_path: str, output_path: str) -> None:
+        """Открывает DOCX в запущенном LibreOffice и сохраняет его как PDF."""
+
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(input_path)),
+            "_blank",
+            0,
+            (_make_property("Hidden", True), _make_property("ReadOnly", True)),
+        )
+        if document is None:
+            raise RuntimeError("LibreOffice не смог открыть документ")
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                (_make_property("FilterName", "writer_pdf_Export"),),
+            )
+        finally:
+            try:
+                document.close(True)
+            except Exception:
+                traceback.print_exc()
+        self.conversions += 1
+
+    def stop(self) -> None:
+        """Завершает процесс soffice вместе со всей группой процессов."""
+
+        process = self.process
+        self.process = None
+        self.desktop = None
+        if process is None:
+            return
+        if process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                process.wait()
+
+
+class SofficePool:
+    """Пул экземпляров LibreOffice с автоперезапуском и ротацией."""
+
+    def __init__(self, size: int, work_dir: str = SOFFICE_WORK_DIR):
+        self.size = size
+        self.work_dir = work_dir
+        self._instances = [SofficeInstance(index, work_dir) for index in range(size)]
+        self._idle: "queue.Queue[SofficeInstance]" = queue.Queue()
+        self._closed = False
+        for instance in self._instances:
+            self._idle.put(instance)
+        self._watchdog = threading.Thread(
+            target=self._watch, name="soffice-pool-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def _restart(self, instance: SofficeInstance) -> None:
+        """Перезапускает экземпляр, сбрасывая счётчик конвертаций."""
+
+        instance.stop()
+        instance.start()
+
+    def _watch(self) -> None:
+        """Фоновая проверка: поднимает упавшие простаивающие экземпляры."""
+
+        while not self._closed:
+            time.sleep(SOFFICE_WATCHDOG_INTERVAL_S)
+            checked = []
+            try:
+                while True:
+                    instance = self._idle.get_nowait()
+                    checked.append(instance)
+                    if instance.process is not None and not instance.is_alive():
+                        try:
+                            self._restart(instance)
+                        except Exception:
+                            traceback.print_exc()
+                            instance.stop()
+            except queue.Empty:
+                pass
+            finally:
+                for instance in checked:
+                    self._idle.put(instance)
+
+    def _convert_on(self, instance: SofficeInstance, input_path: str, output_path: str,
+                    killed: threading.Event) -> None:
+        """Конвертирует файл на экземпляре, один раз перезапуская его при падении.
+
+        ``killed`` — экземпляр убит по таймауту: тогда перезапуска и повтора нет.
+        """
+
+        if not instance.is_alive():
+            self._restart(instance)
+        try:
+            instance.convert(input_path, output_path)
+        except Exception:
+            if instance.is_alive() or killed.is_set():
+                raise
+            # Экземпляр упал посреди конвертации — пробуем один раз на свежем.
+            traceback.print_exc()
+            self._restart(instance)
+            instance.convert(input_path, output_path)
+
+    def convert_files(self, jobs: list, timeout: Optional[float] = None) -> list:
+        """Конвертирует пары ``(docx, pdf)`` подряд на одном свободном экземпляре.
+
+        Возвращает список той же длины: None для успешных файлов и исключение для
+        тех, что сконвертировать не удалось, — ошибка одного файла не прерывает пакет.
+        Если весь вызов не уложился в ``timeout`` секунд, экземпляр убивается
+        вместе с группой процессов (при следующей конвертации он поднимется
+        заново) и бросается ``StageTimeout``.
+        """
+
+        try:
+            instance = self._idle.get(timeout=SOFFICE_ACQUIRE_TIMEOUT_S)
+        except queue.Empty:
+            raise RuntimeError("Нет свободного экземпляра LibreOffice для конвертации")
+
+        killed = threading.Event()
+
+        def kill() -> None:
+            killed.set()
+            count_converter_kill("pool")
+            instance.stop()
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(max(timeout, 0.0), kill)
+            timer.daemon = True
+            timer.start()
+
+        errors: list = []
+        try:
+            for input_path, output_path in jobs:
+                if killed.is_set():
+                    break
+                try:
+                    self._convert_on(instance, input_path, output_path, killed)
+                    errors.append(None)
+                except Exception as error:
+                    errors.append(error)
+            if timer is not None:
+                timer.cancel()
+            if killed.is_set() and (len(errors) < len(jobs) or any(errors)):
+                count_stage_timeout("convert")
+                raise StageTimeout("convert", timeout)
+            if instance.is_alive() and instance.needs_recycle():
+                instance.stop()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._idle.put(instance)
+        return errors
+
+    def convert_many_bytes(self, documents: list, timeout: Optional[float] = None) -> list:
+        """Конвертирует несколько DOCX (байты) и возвращает байты PDF или исключения.
+
+        ``timeout`` — на весь вызов, см. ``convert_files``.
+        """
+
+        with get_temp_store().scratch_dir("convert") as scratch:
+            jobs = []
+            for index, docx_bytes in enumerate(documents):
+                input_path = os.path.join(scratch, f"document_{index}.docx")
+                with open(input_path, "wb") as docx_file:
+                    docx_file.write(docx_bytes)
+                jobs.append((input_path, os.path.join(scratch, f"document_{index}.pdf")))
+
+            results: list = []
+            for (_, output_path), error in zip(jobs, self.convert_files(jobs, timeout)):
+                if error is not None:
+                    results.append(error)
+                    continue
+                with open(output_path, "rb") as pdf_file:
+                    results.append(pdf_file.read())
+            return results
+
+    def close(self) -> None:
+        """Останавливает все экземпляры пула."""
+
+        self._closed = True
+        for instance in self._instances:
+            instance.stop()
+            shutil.rmtree(instance.profile_dir, ignore_errors=True)
+
+
+_pool: Optional[SofficePool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_soffice_pool() -> Optional[SofficePool]:
+    """Возвращает пул текущего процесса или None, если пул выключен или недоступен.
+
+    Пул создаётся лениво при первой конвертации, то есть уже после fork в каждом
+    воркере gunicorn: процессы LibreOffice и потоки не наследуются между воркерами.
+    """
+
+    global _pool, _pool_pid
+
+    if uno is None or SOFFICE_POOL_SIZE <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = SofficePool(SOFFICE_POOL_SIZE)
+            _pool_pid = os.getpid()
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,128 @@
+"""Бюджет времени запроса и его доли по этапам генерации.
+
+Синхронный запрос всё равно обрывается жёстким таймаутом gunicorn (120 с), и
+тогда клиент получает разорванное соединение, а зависший LibreOffice остаётся
+работать. Поэтому у каждого запроса к документам есть собственный бюджет
+``LEADFORCE_REQUEST_DEADLINE_S`` (меньше таймаута gunicorn), а каждому этапу
+достаётся не больше своей доли бюджета (``LEADFORCE_STAGE_BUDGET``) и не больше,
+чем осталось до конца запроса.
+
+Этапы в процессе Python (QR, заполнение, сборка архива) прервать нельзя —
+превышение проверяется по их завершении. Конвертация получает остаток доли как
+таймаут (``stage_time_left``): по его истечении конвертер убивает группу
+процессов soffice. В обоих случаях бросается ``StageTimeout`` с именем этапа,
+а маршруты отвечают на неё 504.
+
+Бюджет живёт в contextvar: ``request_deadline`` открывает его на время
+обработки запроса, ``stage_deadline`` — на время этапа (его использует ``_stage``
+в ``app.py``). Вне запроса (фоновые задания, прогрев) бюджета нет, а
+конвертация ограничена только ``LEADFORCE_CONVERT_TIMEOUT_S``.
+"""
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from metrics import count_stage_timeout
+
+REQUEST_DEADLINE_S = float(os.environ.get("LEADFORCE_REQUEST_DEADLINE_S", "100"))
+# Верхняя граница одной конвертации, в том числе вне запроса; 0 — без ограничения.
+CONVERT_TIMEOUT_S = float(os.environ.get("LEADFORCE_CONVERT_TIMEOUT_S", "90"))
+
+
+def parse_stage_budget(value: str) -> dict:
+    """Разбирает ``"qr=0.1,convert=0.8"`` в ``{этап: доля бюджета}``."""
+
+    shares = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        stage, _, share = item.partition("=")
+        shares[stage.strip()] = float(share)
+    return shares
+
+
+# Доли не обязаны давать в сумме 1: это потолок этапа, а общий остаток бюджета
+# ограничивает все этапы вместе. Этапы без доли ограничены только остатком.
+STAGE_BUDGET = parse_stage_budget(os.environ.get(
+    "LEADFORCE_STAGE_BUDGET",
+    "qr=0.1,fill=0.2,qr_insert=0.1,pdf_stamp=0.2,convert=0.8,zip=0.2",
+))
+
+_request_expires = contextvars.ContextVar("leadforce_request_expires", default=None)
+_stage_expires = contextvars.ContextVar("leadforce_stage_expires", default=None)
+
+
+class StageTimeout(RuntimeError):
+    """Этап ``stage`` не уложился в свою долю бюджета запроса (``limit_s`` секунд)."""
+
+    def __init__(self, stage: str, limit_s: float):
+        self.stage = stage
+        self.limit_s = limit_s
+        super().__init__(f"Этап {stage} не уложился в отведённые {limit_s:.1f} с")
+
+
+@contextmanager
+def request_deadline(budget_s: float = REQUEST_DEADLINE_S):
+    """Открывает бюджет запроса на время блока; ``budget_s <= 0`` — без бюджета."""
+
+    token = _request_expires.set(time.monotonic() + budget_s if budget_s > 0 else None)
+    try:
+        yield
+    finally:
+        _request_expires.reset(token)
+
+
+def _stage_limit(stage: str) -> Optional[float]:
+    """Сколько секунд может занять этап сейчас; None — бюджета нет."""
+
+    expires = _request_expires.get()
+    if expires is None:
+        return None
+    remaining = expires - time.monotonic()
+    share = STAGE_BUDGET.get(stage)
+    if share is None:
+        return remaining
+    return min(remaining, REQUEST_DEADLINE_S * share)
+
+
+def ensure_stage_budget(stage: str) -> None:
+    """Бросает ``StageTimeout``, если этапу ``stage`` уже не осталось времени."""
+
+    limit = _stage_limit(stage)
+    if limit is not None and limit <= 0:
+        count_stage_timeout(stage)
+        raise StageTimeout(stage, 0.0)
+
+
+@contextmanager
+def stage_deadline(stage: str):
+    """Отмеряет этапу его долю бюджета и проверяет её по завершении блока."""
+
+    limit = _stage_limit(stage)
+    if limit is not None and limit <= 0:
+        count_stage_timeout(stage)
+        raise StageTimeout(stage, 0.0)
+    started = time.monotonic()
+    token = _stage_expires.set(started + limit if limit is not None else None)
+    try:
+        yield
+    finally:
+        _stage_expires.reset(token)
+    if limit is not None and time.monotonic() - started > limit:
+        count_stage_timeout(stage)
+        raise StageTimeout(stage, limit)
+
+
+def stage_time_left() -> Optional[float]:
+    """Остаток доли текущего этапа в секундах; None — этап не ограничен."""
+
+    expires = _stage_expires.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def conversion_timeout() -> Optional[float]:
+    """Таймаут конвертации: остаток доли этапа, но не больше ``LEADFORCE_CONVERT_TIMEOUT_S``."""
+
+    limits = [limit for limit in (stage_time_left(), CONVERT_TIMEOUT_S or None) if limit is not None]
+    return min(limits) if limits else None
@@ -0,0 +1,153 @@
+"""Предкомпилированный DOCX-шаблон с заполнением плейсхолдеров в один проход.
+
+Шаблон разбирается один раз: в каждой части документа (тело, колонтитулы,
+вложенные таблицы и надписи) плейсхолдеры ``{{KEY}}``, которые Word разрезал на
+несколько run'ов, собираются в первый run, после чего XML части сериализуется и
+делится на статические фрагменты и ключи. Заполнение сводится к одному
+``"".join`` на часть — без повторного разбора XML и без python-docx.
+"""
+
+import hashlib
+import re
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+PLACEHOLDER_RE = re.compile(r"\{\{([A-Za-z0-9_]+)\}\}")
+TEMPLATE_PART_RE = re.compile(r"^word/(document|header\d*|footer\d*)\.xml$")
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+W_P = f"{{{W_NS}}}p"
+W_T = f"{{{W_NS}}}t"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+
+def _own_text_nodes(paragraph) -> list:
+    """Возвращает ``<w:t>`` параграфа без текстов вложенных параграфов (надписей)."""
+
+    nodes = []
+    for node in paragraph.iter(W_T):
+        parent = node.getparent()
+        while parent is not None and parent.tag != W_P:
+            parent = parent.getparent()
+        if parent is paragraph:
+            nodes.append(node)
+    return nodes
+
+
+def _merge_split_placeholders(paragraph) -> bool:
+    """Собирает разрезанные по run'ам плейсхолдеры в первый run и сообщает об изменениях.
+
+    Форматирование остальных run'ов сохраняется: из них удаляются только символы,
+    принадлежащие плейсхолдеру.
+    """
+
+    nodes = _own_text_nodes(paragraph)
+    if len(nodes) < 2:
+        return False
+
+    spans = []
+    offset = 0
+    for node in nodes:
+        length = len(node.text or "")
+        spans.append((offset, offset + length))
+        offset += length
+
+    full_text = "".join(node.text or "" for node in nodes)
+    changed = False
+
+    for match in reversed(list(PLACEHOLDER_RE.finditer(full_text))):
+        start, end = match.span()
+        covered = [i for i, (s, e) in enumerate(spans) if s < end and e > start]
+        if len(covered) < 2:
+            continue
+
+        first, last = covered[0], covered[-1]
+        first_node = nodes[first]
+        first_start = spans[first][0]
+        text = first_node.text or ""
+        first_node.text = text[:start - first_start] + match.group(0)
+        first_node.set(XML_SPACE, "preserve")
+
+        for index in covered[1:-1]:
+            nodes[index].text = ""
+
+        last_node = nodes[last]
+        last_text = last_node.text or ""
+        last_node.text = last_text[end - spans[last][0]:]
+        last_node.set(XML_SPACE, "preserve")
+        changed = True
+
+    return changed
+
+
+def _compile_part(data: bytes) -> list:
+    """Превращает XML части в список ``[статика, ключ, статика, ключ, ..., статика]``."""
+
+    xml = data.decode("utf-8")
+    if "{{" not in xml:
+        return [xml]
+
+    root = etree.fromstring(data)
+    changed = False
+    for paragraph in root.iter(W_P):
+        changed = _merge_split_placeholders(paragraph) or changed
+    if changed:
+        xml = etree.tostring(
+            root, xml_declaration=True, encoding="UTF-8", standalone=True
+        ).decode("utf-8")
+
+    return PLACEHOLDER_RE.split(xml)
+
+
+class CompiledTemplate:
+    """DOCX-шаблон, разобранный один раз и готовый к многократному заполнению."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as template_file:
+            raw = template_file.read()
+
+        self.path = path
+        self.version = hashlib.sha256(raw).hexdigest()
+        self.placeholders: set = set()
+        self._entries: list = []
+
+        with zipfile.ZipFile(BytesIO(raw), "r") as zin:
+            for info in zin.infolist():
+                data = zin.read(info.filename)
+                if TEMPLATE_PART_RE.match(info.filename):
+                    segments = _compile_part(data)
+                    self.placeholders.update(segments[1::2])
+                    self._entries.append((info, None, segments))
+                else:
+                    self._entries.append((info, data, None))
+
+    @staticmethod
+    def _fill(segments: list, replacements: dict) -> bytes:
+        """Склеивает статические фрагменты части с экранированными значениями."""
+
+        parts = list(segments)
+        for index in range(1, len(parts), 2):
+            key = parts[index]
+            if key in replacements:
+                parts[index] = escape(str(replacements[key] or ""))
+            else:
+                parts[index] = f"{{{{{key}}}}}"
+        return "".join(parts).encode("utf-8")
+
+    def render(self, replacements: dict) -> bytes:
+        """Возвращает байты DOCX с подставленными значениями.
+
+        Плейсхолдеры без значения в ``replacements`` (например, ``{{QR_CODE}}``)
+        остаются в документе как есть — цельным текстом в одном run'е.
+        """
+
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zout:
+            for info, data, segments in self._entries:
+                if segments is not None:
+                    data = self._fill(segments, replacements)
+                zout.writestr(info, data)
+        return buffer.getvalue()
@@ -0,0 +1,503 @@
+"""Быстрый путь PDF: значения штампуются поверх заранее свёрстанного шаблона.
+
+Шаблон один раз конвертируется в «базовый» PDF — с плейсхолдерами как есть и
+временным QR-кодом нужной ширины, — и по тексту страниц запоминается, где лежит
+каждая строка с плейсхолдерами, сколько свободного места справа и снизу и какая
+картинка является QR. На запрос PDF собирается без LibreOffice: хвост строки от
+первого плейсхолдера стирается (redaction) и пишется заново с подставленными
+значениями, длинные значения переносятся по словам с учётом метрик шрифта, а
+картинка QR заменяется новой.
+
+Движок отказывается (возвращает None, и приложение конвертирует DOCX обычным
+путём), если плейсхолдер в базовом PDF разорван между строками или фрагментами
+с разным начертанием, если значение не помещается в свободное место или
+LibreOffice перенёс бы соседние слова абзаца иначе, если нужного шрифта нет на
+диске или PyMuPDF не установлен. Строки с плейсхолдерами
+должны быть выровнены по левому краю.
+"""
+
+import os
+import re
+import struct
+import threading
+import traceback
+from typing import Callable, NamedTuple, Optional
+
+from conversion_slots import ConversionBusyError
+from deadlines import StageTimeout
+from docx_template import PLACEHOLDER_RE
+
+FAST_PDF_ENABLED = os.environ.get("LEADFORCE_FAST_PDF", "0") == "1"
+
+# PyMuPDF тяжёлый (~0.1 с импорта и мегабайты RSS), поэтому грузится только
+# при включённом быстром пути.
+fitz = None
+if FAST_PDF_ENABLED:
+    try:
+        import pymupdf as fitz  # type: ignore[import-not-found,no-redef]
+    except ImportError:  # pragma: no cover - зависит от окружения
+        try:
+            import fitz  # type: ignore[import-not-found,no-redef]
+        except ImportError:
+            fitz = None
+FAST_PDF_FONT = os.environ.get(
+    "LEADFORCE_FAST_PDF_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+FAST_PDF_BOLD_FONT = os.environ.get(
+    "LEADFORCE_FAST_PDF_BOLD_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+)
+
+# Отступ от соседнего текста и линий таблицы, чтобы значение их не касалось.
+FREE_SPACE_PADDING_PT = 1.0
+# Доля высоты строки, на которую сужается область стирания сверху и снизу,
+# чтобы не задеть соседние строки.
+REDACT_INSET_RATIO = 0.15
+# Ширина пробела в долях кегля — только для распознавания переносов в базовом PDF.
+SPACE_WIDTH_EM = 0.3
+# Линии толще этого считаются не рамками таблиц, а заливкой.
+RULE_MAX_THICKNESS_PT = 2.0
+BOLD_FLAG = 16
+LINE_BREAK_RE = re.compile(r"[\r\n\t]")
+# Кроме пробела, LibreOffice (ICU) разрешает перенос после «|» — им разделены поля payload QR.
+WORD_PART_RE = re.compile(r"[^|]*\|+|[^|]+")
+
+
+class TemplateNotSupported(Exception):
+    """Базовый PDF нельзя использовать для штамповки."""
+
+
+class StampSpan(NamedTuple):
+    text: str
+    size: float
+    color: int
+    bold: bool
+
+
+class StampLine(NamedTuple):
+    """Строка базового PDF, хвост которой (с первого плейсхолдера) пишется заново."""
+
+    page: int
+    start_x: float
+    left_x: float  # левый край строки — с него начинаются строки переноса
+    baseline_y: float
+    top: float
+    bottom: float
+    line_height: float
+    right_limit: float
+    bottom_limit: float
+    spans: tuple
+    # Свободный хвост предыдущей строки того же абзаца, если плейсхолдер начинает
+    # строку переноса: (x, базовая линия, ширина). Короткое значение LibreOffice
+    # поднял бы туда.
+    above: Optional[tuple] = None
+    # Ширина первого слова следующей строки того же абзаца (0 — её нет): если оно
+    # влезает после значения, LibreOffice поднял бы его, и раскладка другая.
+    next_word_width: float = 0.0
+
+
+class BaseLayout(NamedTuple):
+    pdf: bytes
+    lines: tuple
+    qr: Optional[tuple]  # (номер страницы, xref картинки)
+
+
+def png_dimensions(png: bytes) -> tuple:
+    """Ширина и высота PNG в пикселях из заголовка IHDR."""
+
+    return struct.unpack(">II", png[16:24])
+
+
+def _line_spans_from_placeholder(line: dict) -> Optional[tuple]:
+    """Возвращает (x начала, фрагменты с первого плейсхолдера) или None без плейсхолдеров.
+
+    Бросает TemplateNotSupported, если плейсхолдер разрезан между фрагментами.
+    """
+
+    start_x = None
+    spans = []
+    for span in line["spans"]:
+        chars = span["chars"]
+        text = "".join(char["c"] for char in chars)
+        if text.count("{{") != len(PLACEHOLDER_RE.findall(text)) or text.count("}}") != text.count("{{"):
+            raise TemplateNotSupported(f"Плейсхолдер разорван в строке: {text!r}")
+        bold = bool(span["flags"] & BOLD_FLAG)
+        if start_x is None:
+            position = text.find("{{")
+            if position < 0:
+                continue
+            start_x = chars[position]["bbox"][0]
+            text = text[position:]
+        spans.append(StampSpan(text, span["size"], span["color"], bold))
+    if start_x is None:
+        return None
+    return start_x, tuple(spans)
+
+
+def _free_space(page_rect, bbox, start_x: float, others: list, rules: list) -> tuple:
+    """Правая и нижняя граница свободного места для строки ``bbox``."""
+
+    x0, y0, x1, y1 = bbox
+    left_margin = min([other[0] for other in others] + [x0])
+    top_margin = min([other[1] for other in others] + [y0])
+    right = page_rect.width - left_margin
+    bottom = page_rect.height - top_margin
+
+    for ox0, oy0, ox1, oy1 in others:
+        if (ox0, oy0, ox1, oy1) == tuple(bbox):
+            continue
+        if oy0 < y1 and oy1 > y0 and ox0 >= x1 - 0.5:
+            right = min(right, ox0)
+    for rx0, ry0, rx1, ry1 in rules:
+        vertical = rx1 - rx0 <= RULE_MAX_THICKNESS_PT
+        if vertical and ry0 <= y0 + 0.5 and ry1 >= y1 - 0.5 and rx0 >= start_x:
+            right = min(right, rx0)
+
+    for ox0, oy0, ox1, oy1 in others:
+        if (ox0, oy0, ox1, oy1) == tuple(bbox):
+            continue
+        if oy0 >= y1 - 0.5 and ox0 < right and ox1 > start_x:
+            bottom = min(bottom, oy0)
+    for rx0, ry0, rx1, ry1 in rules:
+        horizontal = ry1 - ry0 <= RULE_MAX_THICKNESS_PT
+        if horizontal and ry0 >= y1 - 0.5 and rx0 < right and rx1 > start_x:
+            bottom = min(bottom, ry0)
+
+    return right - FREE_SPACE_PADDING_PT, bottom - FREE_SPACE_PADDING_PT
+
+
+def _page_rules(page) -> list:
+    """Отрезки линий страницы (рамки таблиц, подчёркивания) как тонкие прямоугольники."""
+
+    rules = []
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                start, end = item[1], item[2]
+                rules.append((min(start.x, end.x), min(start.y, end.y), max(start.x, end.x), max(start.y, end.y)))
+            elif item[0] == "re":
+                x0, y0, x1, y1 = item[1]
+                if x1 - x0 <= RULE_MAX_THICKNESS_PT or y1 - y0 <= RULE_MAX_THICKNESS_PT:
+                    rules.append((x0, y0, x1, y1))
+                else:
+                    rules.extend(((x0, y0, x1, y0), (x0, y1, x1, y1), (x0, y0, x0, y1), (x1, y0, x1, y1)))
+    return rules
+
+
+def _is_wrap(upper: dict, lower: dict, upper_room: float) -> bool:
+    """Похожа ли ``lower`` на перенос абзаца ``upper``: стоит сразу под ней, с того
+    же левого края или левее, и её первое слово не влезло в хвост ``upper``."""
+
+    ux0, uy0, _, uy1 = upper["bbox"]
+    lx0, ly0 = lower["bbox"][:2]
+    if not (-0.5 <= ly0 - uy1 <= (uy1 - uy0) * 0.5 and lx0 <= ux0 + 0.5):
+        return False
+    space = upper["spans"][-1]["size"] * SPACE_WIDTH_EM
+    return upper_room < space + _first_word_width(lower)
+
+
+def _first_word_width(line: dict) -> float:
+    """Ширина первого слова строки по координатам символов."""
+
+    chars = [char for span in line["spans"] for char in span["chars"]]
+    end = None
+    for char in chars:
+        if char["c"].isspace():
+            if end is not None:
+                break
+            continue
+        end = char["bbox"][2]
+    return end - chars[0]["bbox"][0] if end is not None else 0.0
+
+
+def analyze_base_pdf(pdf: bytes, qr_png: Optional[bytes] = None) -> BaseLayout:
+    """Находит строки с плейсхолдерами и картинку QR в базовом PDF."""
+
+    qr_size = png_dimensions(qr_png) if qr_png else None
+    lines = []
+    qr = None
+    with fitz.open("pdf", pdf) as document:
+        for page_index, page in enumerate(document):
+            raw = page.get_text("rawdict")
+            blocks = [block["lines"] for block in raw["blocks"] if block["type"] == 0]
+            images = page.get_image_info(xrefs=True)
+            others = [tuple(line["bbox"]) for block in blocks for line in block]
+            others += [tuple(image["bbox"]) for image in images]
+            rules = _page_rules(page)
+
+            for block, index, line in ((block, index, line) for block in blocks for index, line in enumerate(block)):
+                found = _line_spans_from_placeholder(line)
+                if found is None:
+                    continue
+                start_x, spans = found
+                x0, y0, x1, y1 = line["bbox"]
+                right, bottom = _free_space(page.rect, line["bbox"], start_x, others, rules)
+                above = None
+                if index > 0 and start_x - x0 < 0.5:
+                    previous = block[index - 1]
+                    px1 = previous["bbox"][2]
+                    room = _free_space(page.rect, previous["bbox"], px1, others, rules)[0] - px1
+                    if _is_wrap(previous, line, room):
+                        above = (px1, previous["spans"][-1]["origin"][1], max(room, 0.0))
+                next_word_width = 0.0
+                if index + 1 < len(block) and _is_wrap(line, block[index + 1], right - x1):
+                    next_word_width = _first_word_width(block[index + 1])
+                lines.append(StampLine(
+                    page=page_index,
+                    start_x=start_x,
+                    left_x=x0,
+                    baseline_y=line["spans"][0]["origin"][1],
+                    top=y0,
+                    bottom=y1,
+                    line_height=y1 - y0,
+                    right_limit=right,
+                    bottom_limit=bottom,
+                    spans=spans,
+                    above=above,
+                    next_word_width=next_word_width,
+                ))
+
+            for image in images:
+                if qr is None and qr_size and (image["width"], image["height"]) == qr_size:
+                    qr = (page_index, image["xref"])
+
+    if qr_png and qr is None:
+        raise TemplateNotSupported("Картинка QR не найдена в базовом PDF")
+    return BaseLayout(pdf, tuple(lines), qr)
+
+
+def _substitute(text: str, values: dict) -> str:
+    def value(match):
+        key = match.group(1)
+        if key not in values:
+            return match.group(0)
+        # Перевод строки внутри w:t Word и LibreOffice показывают пробелом.
+        return LINE_BREAK_RE.sub(" ", str(values[key] or ""))
+
+    return PLACEHOLDER_RE.sub(value, text)
+
+
+def _wrap_words(text: str, font, size: float, first_width: float, width: float,
+                first_may_be_empty: bool = False) -> Optional[list]:
+    """Переносит текст по словам; None, если отдельное слово не помещается в строку.
+
+    С ``first_may_be_empty`` первая строка может остаться пустой, если в неё
+    не влезает даже первое слово.
+    """
+
+    rows = []
+    current = ""
+    limit = first_width
+    for word in text.split(" "):
+        for index, part in enumerate(WORD_PART_RE.findall(word) or [""]):
+            separator = " " if index == 0 and current else ""
+            candidate = f"{current}{separator}{part}"
+            if font.text_length(candidate, fontsize=size) <= limit:
+                current = candidate
+                continue
+            if not current and not (first_may_be_empty and not rows and limit == first_width):
+                return None
+            rows.append(current)
+            current = part
+            limit = width
+            if font.text_length(current, fontsize=size) > limit:
+                return None
+    rows.append(current)
+    return rows
+
+
+_fonts: dict = {}
+
+
+def load_font(path: str):
+    """Шрифт PyMuPDF для метрик, разобранный один раз на процесс."""
+
+    font = _fonts.get(path)
+    if font is None:
+        if not os.path.isfile(path):
+            raise TemplateNotSupported(f"Нет файла шрифта {path}")
+        font = _fonts[path] = fitz.Font(fontfile=path)
+    return font
+
+
+def preload_fonts() -> None:
+    """Разбирает шрифты штамповки заранее (в мастере gunicorn при preload_app)."""
+
+    if not FAST_PDF_ENABLED or fitz is None:
+        return
+    for path in (FAST_PDF_FONT, FAST_PDF_BOLD_FONT):
+        try:
+            load_font(path)
+        except TemplateNotSupported as error:
+            print(f"Быстрый PDF: {error}")
+
+
+class FastPdfEngine:
+    """Штамповка значений в базовый PDF одного шаблона.
+
+    ``build_base(width_mm)`` возвращает (базовый PDF, PNG временного QR) и
+    вызывается один раз на каждую ширину QR: от неё зависит вёрстка ячейки.
+    """
+
+    def __init__(self, template_version: str, build_base: Callable[[float], tuple]):
+        self.template_version = template_version
+        self._build_base = build_base
+        self._layouts: dict = {}
+        self._building: dict = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _font(bold: bool):
+        return load_font(FAST_PDF_BOLD_FONT if bold else FAST_PDF_FONT)
+
+    def layout(self, qr_width_mm: float,
+               build_base: Optional[Callable[[float], tuple]] = None) -> Optional[BaseLayout]:
+        """Базовый PDF и разметка для ширины QR; None, если шаблон не подходит.
+
+        ``build_base`` заменяет сборщик движка для этой ширины — так ``warm_up``
+        собирает базовый PDF без пула LibreOffice. Каждая ширина собирается под
+        своей блокировкой: запросы с уже готовыми ширинами сборку не ждут.
+        """
+
+        key = round(float(qr_width_mm), 2)
+        with self._lock:
+            if key in self._layouts:
+                return self._layouts[key]
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                if key in self._layouts:
+                    return self._layouts[key]
+            try:
+                pdf, qr_png = (build_base or self._build_base)(key)
+                layout = analyze_base_pdf(pdf, qr_png)
+                self._font(False)
+                self._font(True)
+            except TemplateNotSupported as error:
+                print(f"Быстрый PDF недоступен для шаблона: {error}")
+                layout = None
+            except (ConversionBusyError, StageTimeout):
+                # Слоты заняты или бюджет запроса вышел — базовый PDF соберётся в другой раз.
+                raise
+            except Exception:
+                traceback.print_exc()
+                layout = None
+            with self._lock:
+                self._layouts[key] = layout
+            return layout
+
+    def _write_line(self, page, placed: list) -> None:
+        for x, y, spans in placed:
+            for span in spans:
+                if not span.text:
+                    continue
+                font_path = FAST_PDF_BOLD_FONT if span.bold else FAST_PDF_FONT
+                color = tuple(((span.color >> shift) & 0xFF) / 255 for shift in (16, 8, 0))
+                page.insert_text(
+                    (x, y), span.text, fontsize=span.size, color=color,
+                    fontname="LFBold" if span.bold else "LFRegular", fontfile=font_path,
+                )
+                x += self._font(span.bold).text_length(span.text, fontsize=span.size)
+
+    def render(self, values: dict, qr_png: Optional[bytes], qr_width_mm: float) -> Optional[bytes]:
+        """Возвращает байты PDF или None, если запрос нужно отдать обычной конвертации."""
+
+        layout = self.layout(qr_width_mm)
+        if layout is None or (layout.qr is not None and not qr_png):
+            return None
+
+        with fitz.open("pdf", layout.pdf) as document:
+            pending = []
+            for line in layout.lines:
+                page = document[line.page]
+                spans = [span._replace(text=_substitute(span.text, values)) for span in line.spans]
+                if all(new.text == old.text for new, old in zip(spans, line.spans)):
+                    continue
+                placed = self._place(line, spans)
+                if placed is None:
+                    return None
+                inset = line.line_height * REDACT_INSET_RATIO
+                page.add_redact_annot(
+                    fitz.Rect(line.start_x, line.top + inset, line.right_limit, line.bottom - inset)
+                )
+                pending.append((line, placed))
+
+            for page in document:
+                page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE, graphics=fitz.PDF_REDACT_LINE_ART_NONE)
+            for line, placed in pending:
+                self._write_line(document[line.page], placed)
+
+            if layout.qr is not None:
+                page_index, xref = layout.qr
+                document[page_index].replace_image(xref, stream=qr_png)
+
+            document.subset_fonts()
+            return document.tobytes(garbage=3, deflate=True, no_new_id=True)
+
+    def _place(self, line: StampLine, spans: list) -> Optional[list]:
+        """Раскладывает фрагменты по строкам: ``[(x, базовая линия, фрагменты), ...]`` или None.
+
+        None и тогда, когда LibreOffice перенёс бы слова иначе, чем позволяет
+        место в базовом PDF: значение целиком поднялось бы на предыдущую строку
+        или первое слово следующей строки поднялось бы в освободившееся место.
+        """
+
+        first = spans[0]
+        font = self._font(first.bold)
+        space = font.text_length(" ", fontsize=first.size)
+        first_width = line.right_limit - line.start_x
+        wrap_width = line.right_limit - line.left_x
+
+        if len({(span.size, span.color, span.bold) for span in spans}) > 1:
+            if line.above:
+                head = WORD_PART_RE.findall(first.text.lstrip(" ").split(" ")[0]) or [""]
+                if font.text_length(head[0], fontsize=first.size) + space <= line.above[2]:
+                    return None
+            used = sum(self._font(span.bold).text_length(span.text, fontsize=span.size) for span in spans)
+            if used > first_width:
+                return None
+            placed = [(line.start_x, line.baseline_y, spans)]
+            last_width = first_width
+        else:
+            text = "".join(span.text for span in spans)
+            if line.above:
+                rows = _wrap_words(text, font, first.size, line.above[2] - space, first_width, True)
+                # Всё значение на предыдущей строке — текущая опустела бы.
+                if rows is None or len(rows) < 2:
+                    return None
+                head, rows = rows[0], rows[1:]
+            else:
+                rows = _wrap_words(text, font, first.size, first_width, wrap_width)
+                head = ""
+                if rows is None:
+                    return None
+            if len(rows) > 1 and line.bottom + (len(rows) - 1) * line.line_height > line.bottom_limit:
+                return None
+            placed = []
+            if head:
+                x, baseline, _ = line.above
+                placed.append((x + space, baseline, [first._replace(text=head)]))
+            for index, row in enumerate(rows):
+                x = line.start_x if index == 0 else line.left_x
+                placed.append((x, line.baseline_y + index * line.line_height, [first._replace(text=row)]))
+            used = font.text_length(rows[-1], fontsize=first.size)
+            last_width = first_width if len(rows) == 1 else wrap_width
+
+        if line.next_word_width and used + space + line.next_word_width <= last_width:
+            return None
+        return placed
+
+
+_engines: dict = {}
+_engines_lock = threading.Lock()
+
+
+def get_fast_pdf_engine(template_version: str, build_base: Callable[[float], tuple]) -> Optional[FastPdfEngine]:
+    """Движок для версии шаблона или None, если быстрый путь выключен или PyMuPDF нет."""
+
+    if not FAST_PDF_ENABLED or fitz is None:
+        return None
+    with _engines_lock:
+        engine = _engines.get(template_version)
+        if engine is None:
+            engine = _engines[template_version] = FastPdfEngine(template_version, build_base)
+        return engine
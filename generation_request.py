@@ -0,0 +1,277 @@
+"""Параметры генерации документа: разбор, проверка и нормализация за один проход.
+
+``GenerationRequest`` собирается из query string или JSON-объекта один раз на
+запрос (``from_params``) и дальше передаётся в генерацию целиком: из него
+выводятся значения плейсхолдеров (``replacements``), реквизиты QR
+(``payment_details``) и ширина QR. Ошибки во входных данных собираются в
+``RequestValidationError`` до начала генерации — маршруты отвечают на них 400.
+
+Модель неизменяемая и уже нормализована: значения обрезаны по краям, сумма
+приведена к виду с точкой, дата счёта вычислена, ширина QR ограничена
+допустимым диапазоном. Поэтому ``canonical()`` годится как ключ кэша и
+дедупликации: одинаковые по смыслу запросы дают одинаковый ключ.
+"""
+
+import uuid
+from dataclasses import astuple, dataclass
+from datetime import datetime
+from typing import Mapping, Optional
+
+from amount_words import KOPECKS_IN_WORDS, amount_in_words, parse_kopecks
+
+DEFAULT_QR_WIDTH_MM = 36  # 35–40 мм — рабочий диапазон для СБП
+MIN_QR_MM = 20
+MAX_QR_MM = 45
+
+# Ограничение длины одного значения: плейсхолдер длиннее страницы — это ошибка клиента.
+MAX_VALUE_LENGTH = 4000
+
+DEFAULT_PAYMENT_DETAILS = {
+    "Name": "ИП Абакумова Наталья Александровна",
+    "PersonalAcc": "40802810200006322048",
+    "BankName": "АО «Тинькофф Банк»",
+    "BIC": "044525974",
+    "CorrespAcc": "30101810145250000974",
+    "PayeeINN": "720206359451",
+    "Purpose": "Оплата по счету №{{ID}}"
+}
+
+QR_QUERY_MAP = {
+    "qr_name": "Name",
+    "qr_personal_account": "PersonalAcc",
+    "qr_bank_name": "BankName",
+    "qr_bic": "BIC",
+    "qr_correspondent_account": "CorrespAcc",
+    "qr_inn": "PayeeINN",
+    "qr_kpp": "PayeeKPP",
+    "qr_payer_address": "PayerAddress"
+}
+
+MONTHS_RU = {
+    '01': 'января', '02': 'февраля', '03': 'марта',
+    '04': 'апреля', '05': 'мая', '06': 'июня',
+    '07': 'июля', '08': 'августа', '09': 'сентября',
+    '10': 'октября', '11': 'ноября', '12': 'декабря'
+}
+
+# Текстовые параметры сделки (реквизиты qr_* из QR_QUERY_MAP разбираются отдельно).
+TEXT_PARAMS = frozenset({
+    "deal", "bill_date", "invoiceDate", "price", "price_text", "template", "service", "city",
+    "lead_sum", "lead_cost", "revenue", "email", "phone", "name", "inn", "companyName",
+    "qr_sum", "qr_purpose", "qr_width_mm",
+})
+
+# Имена параметров запроса, которые отличаются от имён полей модели.
+PARAM_ALIASES = {"companyName": "company_name"}
+
+
+class RequestValidationError(ValueError):
+    """Некорректные параметры запроса; ``errors`` — ``{параметр: описание}``."""
+
+    def __init__(self, errors: dict):
+        self.errors = errors
+        super().__init__("; ".join(f"{name}: {message}" for name, message in errors.items()))
+
+
+def format_invoice_date(date_str):
+    """Форматирует дату счёта в человекочитаемый вид или возвращает исходную строку."""
+
+    try:
+        day, month, year = date_str.strip().split('.')
+        return f"{int(day)} {MONTHS_RU[month]} {year} г."
+    except Exception:
+        return date_str
+
+
+def _text(value, name: str, errors: dict) -> str:
+    """Значение параметра строкой без пробелов по краям; числа из JSON допускаются."""
+
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        errors[name] = "ожидается строка или число"
+        return ""
+    text = str(value).strip()
+    if len(text) > MAX_VALUE_LENGTH:
+        errors[name] = f"длиннее {MAX_VALUE_LENGTH} символов"
+        return ""
+    return text
+
+
+@dataclass(frozen=True, slots=True)
+class GenerationRequest:
+    """Нормализованные параметры одной сделки."""
+
+    invoice_id: str
+    deal: Optional[str]  # None — параметр deal не передан, номер счёта случайный
+    invoice_date: str
+    price: str
+    price_text: str
+    template: str
+    service: str
+    city: str
+    lead_sum: str
+    lead_cost: str
+    revenue: str
+    email: str
+    phone: str
+    name: str
+    inn: str
+    company_name: str
+    qr_sum: str
+    qr_purpose: str
+    qr_width_mm: float
+    qr_overrides: tuple  # ((ключ payload, значение), ...) из параметров qr_*
+
+    @classmethod
+    def from_params(cls, params: Mapping) -> "GenerationRequest":
+        """Разбирает параметры сделки (query string или JSON-объект).
+
+        Неизвестные параметры игнорируются. Бросает ``RequestValidationError``
+        со всеми найденными ошибками сразу.
+        """
+
+        errors: dict = {}
+        values = {}
+        overrides = {}
+        for key, raw in params.items():
+            if key in QR_QUERY_MAP:
+                text = _text(raw, key, errors)
+                if text:
+                    overrides[QR_QUERY_MAP[key]] = text
+            elif key in TEXT_PARAMS:
+                values[PARAM_ALIASES.get(key, key)] = _text(raw, key, errors)
+
+        price = values.get("price", "").replace(",", ".")
+        if price:
+            try:
+                parse_kopecks(price)
+            except ValueError:
+                errors["price"] = "ожидается сумма числом, например 12345.67"
+
+        qr_sum = values.get("qr_sum", "")
+        if qr_sum and not qr_sum.isdigit():
+            errors["qr_sum"] = "ожидается целое число копеек"
+
+        qr_width_mm = float(DEFAULT_QR_WIDTH_MM)
+        raw_width = values.get("qr_width_mm", "")
+        if raw_width:
+            try:
+                qr_width_mm = float(raw_width.replace(",", "."))
+            except ValueError:
+                errors["qr_width_mm"] = "ожидается число миллиметров"
+            else:
+                if qr_width_mm != qr_width_mm:  # NaN
+                    errors["qr_width_mm"] = "ожидается число миллиметров"
+        qr_width_mm = round(max(MIN_QR_MM, min(qr_width_mm, MAX_QR_MM)), 2)
+
+        if errors:
+            raise RequestValidationError(errors)
+
+        # bill_date из CRM приходит с временем ("дд.мм.гггг чч:мм"), берётся только дата.
+        bill_date = values.get("bill_date", "")
+        invoice_date = bill_date.split()[0] if " " in bill_date else ""
+        invoice_date = invoice_date or values.get("invoiceDate", "") or datetime.today().strftime('%d.%m.%Y')
+
+        deal = values.get("deal") if "deal" in params else None
+        return cls(
+            invoice_id=deal if deal is not None else str(uuid.uuid4())[:8],
+            deal=deal,
+            invoice_date=invoice_date,
+            price=price,
+            price_text=values.get("price_text", ""),
+            template=values.get("template", ""),
+            service=values.get("service", ""),
+            city=values.get("city", ""),
+            lead_sum=values.get("lead_sum", ""),
+            lead_cost=values.get("lead_cost", ""),
+            revenue=values.get("revenue", ""),
+            email=values.get("email", ""),
+            phone=values.get("phone", ""),
+            name=values.get("name", ""),
+            inn=values.get("inn", ""),
+            company_name=values.get("company_name", ""),
+            qr_sum=qr_sum,
+            qr_purpose=values.get("qr_purpose", ""),
+            qr_width_mm=qr_width_mm,
+            qr_overrides=tuple(sorted(overrides.items())),
+        )
+
+    @property
+    def reproducible(self) -> bool:
+        """Без ``deal`` номер счёта — случайный UUID: такой результат не кэшируется."""
+
+        return self.deal is not None
+
+    def canonical(self) -> tuple:
+        """Нормализованная форма для ключей кэша, ETag и дедупликации.
+
+        Вместе с полями входит режим записи копеек: он меняет текст суммы прописью.
+        """
+
+        return astuple(self) + (KOPECKS_IN_WORDS,)
+
+    def replacements(self) -> dict:
+        """Значения плейсхолдеров шаблона."""
+
+        try:
+            amount_words = self.price_text or amount_in_words(self.price)
+        except ValueError:
+            amount_words = ""
+
+        customer_parts = [self.name, self.phone, self.email, self.inn, self.company_name]
+        customer = ", \n".join(filter(None, customer_parts))
+        product = f"Система привлечения клиентов / {self.service}" if self.service else "Система привлеения клиентов"
+
+        return {
+            "ID": self.invoice_id,
+            "INVOICE_DATE": format_invoice_date(self.invoice_date),
+            "CUSTOMER": customer,
+            "PRODUCT": product,
+            "SUM": self.price,
+            "AMOUNT_IN_WORDS": amount_words,
+            "DEAL": self.deal or "",
+            "SERVICE": self.service,
+            "CITY": self.city,
+            "LEAD_SUM": self.lead_sum,
+            "LEAD_COST": self.lead_cost,
+            "REVENUE": self.revenue,
+            "PRICE": self.price,
+            "EMAIL": self.email,
+            "PHONE": self.phone,
+            "NAME": self.name,
+            "INN": self.inn,
+            "COMPANYNAME": self.company_name,
+
+            "CUSTOMER_NAME": self.name,
+            "CUSTOMER_EMAIL": self.email,
+            "CUSTOMER_PHONE": self.phone,
+            "CUSTOMER_INN": self.inn,
+            "CUSTOMER_COMPANYNAME": self.company_name,
+
+            "PAYMENT_QR_BASE64": "",
+            "PAYMENT_QR_PAYLOAD": ""
+        }
+
+    def payment_details(self) -> dict:
+        """Реквизиты для QR-платежа: значения по умолчанию, дополненные параметрами ``qr_*``."""
+
+        details = DEFAULT_PAYMENT_DETAILS.copy()
+        details.update(self.qr_overrides)
+
+        if self.qr_sum:
+            details["Sum"] = self.qr_sum
+        elif self.price:
+            details["Sum"] = str(parse_kopecks(self.price))
+
+        if self.qr_purpose:
+            details["Purpose"] = self.qr_purpose
+        else:
+            purpose = details.get("Purpose", "")
+            if purpose and "{{ID}}" in purpose:
+                details["Purpose"] = purpose.replace("{{ID}}", self.invoice_id)
+            elif not purpose and self.invoice_id:
+                details["Purpose"] = f"Оплата по счету №{self.invoice_id}"
+
+        return details
+
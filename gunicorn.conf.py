@@ -0,0 +1,112 @@
+"""Конфигурация gunicorn для LeadForce.
+
+Параметры запуска (воркеры, сокет, логи) задаются в ``deploy/leadforce.service``;
+здесь — то, что требует хуков мастер-процесса. Метрики Prometheus пишутся
+воркерами в общий каталог ``PROMETHEUS_MULTIPROC_DIR``. Каталог создаётся и
+очищается от файлов прошлого запуска при загрузке этого файла — раньше, чем
+gunicorn в режиме ``preload_app`` импортирует приложение, — а файлы gauge
+завершившихся воркеров мастер убирает в ``child_exit``.
+
+С ``LEADFORCE_PRELOAD_APP=1`` приложение импортируется и прогревается
+(``app.warm_up``) один раз в мастере, а воркеры получают его готовым через
+fork: старт и перезапуск воркера не платят за импорт, а общие страницы памяти
+не копируются. Сборщик мусора в мастере выключен до fork, и перед fork все
+объекты замораживаются (``gc.freeze``), чтобы обход GC в воркерах не трогал
+счётчики ссылок на общих страницах. Код приложения при этом обновляется только
+полным перезапуском сервиса, а не ``HUP``.
+
+Пул процессов для CPU-этапов (``LEADFORCE_STAGE_POOL=1``, ``stage_pool.py``)
+поднимается в каждом воркере после его инициализации, до первого запроса, и
+делит ядра машины с пулами остальных воркеров (``LEADFORCE_SERVICE_WORKERS``).
+Sync-воркерам пул не нужен: они обрабатывают один запрос за раз.
+"""
+
+import gc
+import glob
+import os
+import tempfile
+
+# Переменная должна быть задана до импорта prometheus_client в воркерах.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "leadforce-metrics"),
+)
+
+
+def prepare_metrics_dir(path: str) -> None:
+    """Создаёт каталог метрик и удаляет ``*.db`` прошлого запуска сервиса.
+
+    Вызывается при загрузке конфигурации: с ``preload_app`` gunicorn
+    импортирует приложение в ``Arbiter.setup()``, до хука ``on_starting``, и
+    ``metrics.py`` сразу открывает в каталоге файлы мастера. Конфигурация
+    перечитывается и по ``HUP``, и в новом мастере после ``USR2``, когда файлы
+    живых процессов уже открыты, — поэтому очистка выполняется один раз на
+    запуск сервиса (метка в окружении наследуется мастером и воркерами).
+    """
+
+    os.makedirs(path, exist_ok=True)
+    if os.environ.get("LEADFORCE_METRICS_DIR_READY") == path:
+        return
+    for stale in glob.glob(os.path.join(path, "*.db")):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+    os.environ["LEADFORCE_METRICS_DIR_READY"] = path
+
+
+prepare_metrics_dir(PROMETHEUS_MULTIPROC_DIR)
+
+# Импорт здесь, а не в child_exit: хук вызывается из обработчика SIGCHLD, и
+# импорт, прерванный следующим сигналом, оставил бы модуль недогруженным.
+try:
+    from prometheus_client import multiprocess  # type: ignore[import-not-found]
+except ImportError:
+    multiprocess = None  # type: ignore[assignment]
+
+preload_app = os.environ.get("LEADFORCE_PRELOAD_APP", "0") == "1"
+
+if preload_app:
+    gc.disable()
+
+
+def on_starting(server):
+    # Воркеры наследуют окружение мастера: по нему пул CPU-этапов делит ядра.
+    os.environ["LEADFORCE_SERVICE_WORKERS"] = str(server.cfg.workers)
+
+    if server.cfg.preload_app:
+        import app
+
+        app.warm_up()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        gc.enable()
+
+
+def post_worker_init(worker):
+    # Очередь заданий поднимается сразу: она подбирает задания воркеров,
+    # завершившихся до этого (max_requests, падение, деплой).
+    import app
+
+    app.start_job_queue()
+
+    # Пул CPU-этапов (LEADFORCE_STAGE_POOL=1) принадлежит воркеру: поднимается
+    # и прогревается до первого запроса, а не на нём. Sync-воркер обрабатывает
+    # один запрос за раз — параллелить его этапы нечем, пул только занял бы ядра.
+    import stage_pool
+    from gunicorn.workers.sync import SyncWorker
+
+    if isinstance(worker, SyncWorker):
+        if stage_pool.STAGE_POOL_ENABLED:
+            worker.log.info("Пул CPU-этапов выключен для sync-воркера")
+        stage_pool.disable_stage_pool()
+        return
+    stage_pool.get_stage_pool()
+
+
+def child_exit(server, worker):
+    if multiprocess is not None:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,425 @@
+"""Фоновые задания генерации документов.
+
+``POST /Jobs`` сохраняет задание и сразу возвращает его идентификатор, а сама
+генерация выполняется пулом потоков процесса, принявшего запрос. Состояние и
+результат задания хранятся в общем каталоге (``LEADFORCE_JOBS_DIR``), поэтому
+``GET /Jobs/<id>`` и ``GET /Jobs/<id>/result`` работают на любом воркере gunicorn.
+Если задан ``callback_url``, готовый результат отправляется туда POST-запросом с
+повторными попытками.
+
+Задание выполняется в памяти процесса, поэтому в состоянии записан его
+владелец (хост, pid и очередь). Если процесс завершился (``max_requests``,
+падение, деплой), его задания так и остались бы в ``queued``/``running``:
+очередь нового процесса при старте и маршрут статуса находят такие задания и
+ставят их заново, а после ``LEADFORCE_JOB_MAX_ATTEMPTS`` запусков переводят в
+``failed``.
+
+``callback_url`` не может вести во внутреннюю сеть сервиса (SSRF): адреса хоста
+проверяются и при приёме задания, и перед каждой отправкой, переходы по
+редиректам не выполняются. Внутренние получатели разрешаются явно списком
+``LEADFORCE_JOB_CALLBACK_ALLOWED_HOSTS``.
+"""
+
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+from temp_store import register_temp_area
+
+JOBS_DIR = os.environ.get("LEADFORCE_JOBS_DIR", "./output/jobs")
+JOB_WORKERS = int(os.environ.get("LEADFORCE_JOB_WORKERS", "2"))
+JOB_CALLBACK_ATTEMPTS = int(os.environ.get("LEADFORCE_JOB_CALLBACK_ATTEMPTS", "5"))
+JOB_CALLBACK_BACKOFF_S = float(os.environ.get("LEADFORCE_JOB_CALLBACK_BACKOFF_S", "2"))
+JOB_CALLBACK_TIMEOUT_S = float(os.environ.get("LEADFORCE_JOB_CALLBACK_TIMEOUT_S", "30"))
+JOB_TTL_S = float(os.environ.get("LEADFORCE_JOB_TTL_S", "86400"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("LEADFORCE_JOB_MAX_ATTEMPTS", "2"))
+# Хосты callback, которым разрешены любые адреса; если список задан, другие хосты не принимаются.
+JOB_CALLBACK_ALLOWED_HOSTS = frozenset(
+    host.strip().lower()
+    for host in os.environ.get("LEADFORCE_JOB_CALLBACK_ALLOWED_HOSTS", "").split(",")
+    if host.strip()
+)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+RESULT_FILENAME = "result"
+STATE_FILENAME = "job.json"
+LOCK_FILENAME = "job.lock"
+
+# Задание вместе с результатом удаляется через JOB_TTL_S после последнего изменения.
+register_temp_area("jobs", JOBS_DIR, ttl_s=JOB_TTL_S)
+
+
+def validate_callback_url(url: str) -> Optional[str]:
+    """Возвращает текст ошибки, если на ``callback_url`` нельзя отправлять результат.
+
+    Адрес должен быть абсолютным http(s)-адресом. Хост из
+    ``LEADFORCE_JOB_CALLBACK_ALLOWED_HOSTS`` принимается как есть; если список
+    задан, остальные хосты отклоняются. Без списка все адреса хоста должны быть
+    публичными: loopback, частные сети, link-local (в том числе
+    169.254.169.254) и прочие служебные диапазоны отклоняются.
+    """
+
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return "callback_url должен быть абсолютным http(s)-адресом"
+
+    host = parsed.hostname.lower()
+    if host in JOB_CALLBACK_ALLOWED_HOSTS:
+        return None
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        return f"Хост {host} не входит в список разрешённых для callback_url"
+
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError):
+        return f"Не удалось определить адрес хоста {host} из callback_url"
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            return f"callback_url ведёт на внутренний адрес {address}"
+    return None
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Записывает файл через временный файл и rename, чтобы читатели не видели половину."""
+
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class JobStore:
+    """Задания в каталоге ``<root>/<id>/``: ``job.json`` с состоянием и файл результата."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self._dir(job_id), RESULT_FILENAME)
+
+    def create(self, params: dict, callback_url: str = "", owner: Optional[dict] = None) -> dict:
+        """Регистрирует новое задание в статусе ``queued`` за очередью ``owner``."""
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._dir(job_id))
+        state = {
+            "id": job_id,
+            "status": JOB_QUEUED,
+            "owner": owner,
+            "attempts": 0,
+            "format": params.get("format") or "pdf",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "timings_ms": {},
+            "error": None,
+            "result": None,
+            "callback": {"url": callback_url, "attempts": 0, "delivered": False, "error": None}
+            if callback_url else None,
+            "params": params,
+        }
+        self.save(state)
+        return state
+
+    def save(self, state: dict) -> None:
+        data = json.dumps(state, ensure_ascii=False).encode("utf-8")
+        _write_atomic(os.path.join(self._dir(state["id"]), STATE_FILENAME), data)
+
+    def load(self, job_id: str) -> Optional[dict]:
+        """Возвращает состояние задания или None, если такого задания нет."""
+
+        if not job_id or not all(ch in "0123456789abcdef" for ch in job_id):
+            return None
+        try:
+            with open(os.path.join(self._dir(job_id), STATE_FILENAME), "rb") as state_file:
+                return json.loads(state_file.read().decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id: str, **changes) -> dict:
+        state = self.load(job_id) or {"id": job_id}
+        state.update(changes)
+        self.save(state)
+        return state
+
+    def store_result(self, job_id: str, data: bytes) -> None:
+        _write_atomic(self.result_path(job_id), data)
+
+    def ids(self) -> list:
+        """Идентификаторы всех заданий в хранилище."""
+
+        try:
+            return [name for name in os.listdir(self.root) if os.path.isdir(self._dir(name))]
+        except OSError:
+            return []
+
+    @contextmanager
+    def locked(self, job_id: str):
+        """Блокировка задания между процессами на время блока (без ``fcntl`` — без блокировки)."""
+
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self._dir(job_id), LOCK_FILENAME), "a+b") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def job_owner_alive(state: dict) -> bool:
+    """Жив ли процесс, которому принадлежит незавершённое задание.
+
+    Процесс на другом хосте проверить нельзя — он считается живым. Если pid
+    достался текущему процессу, владелец жив только при совпадении очереди:
+    иначе pid переиспользован после завершения прежнего процесса.
+    """
+
+    owner = state.get("owner")
+    if not owner:
+        return False
+    if owner.get("host") != socket.gethostname():
+        return True
+    if owner.get("pid") == os.getpid():
+        return _queue is not None and _queue_pid == os.getpid() and owner.get("queue") == _queue.token
+    return _pid_alive(int(owner.get("pid") or 0))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Не переходит по редиректам: ответ 3xx — отказ получателя, а не новый адрес."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _post_callback(url: str, state: dict, body: bytes, content_type: str) -> None:
+    """Отправляет один POST на callback_url; исключение — сигнал для повтора."""
+
+    # Адрес проверяется заново: DNS-запись могла смениться после приёма задания.
+    error = validate_callback_url(url)
+    if error:
+        raise ValueError(error)
+
+    headers = {
+        "Content-Type": content_type,
+        "X-Job-Id": state["id"],
+        "X-Job-Status": state["status"],
+    }
+    result = state.get("result") or {}
+    if result.get("filename"):
+        headers["Content-Disposition"] = f'attachment; filename="{result["filename"]}"'
+    req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    with _callback_opener.open(req, timeout=JOB_CALLBACK_TIMEOUT_S) as response:
+        if response.status >= 300:
+            raise urllib.error.HTTPError(url, response.status, "callback rejected", response.headers, None)
+
+
+class JobQueue:
+    """Пул потоков, выполняющий задания и доставляющий результат на callback_url."""
+
+    def __init__(self, store: JobStore, runner: Callable, workers: int = JOB_WORKERS):
+        self.store = store
+        self.runner = runner
+        self.token = uuid.uuid4().hex
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="job")
+        self._callbacks = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-callback")
+
+    @property
+    def owner(self) -> dict:
+        return {"host": socket.gethostname(), "pid": os.getpid(), "queue": self.token}
+
+    def submit(self, params: dict, callback_url: str = "") -> dict:
+        """Сохраняет задание и ставит его в очередь, не дожидаясь выполнения."""
+
+        state = self.store.create(params, callback_url, self.owner)
+        self._executor.submit(self._run, state["id"])
+        return state
+
+    def recover(self, job_id: str) -> Optional[dict]:
+        """Подбирает незавершённое задание завершившегося процесса.
+
+        Задание ставится в эту очередь заново, а если оно уже запускалось
+        ``LEADFORCE_JOB_MAX_ATTEMPTS`` раз — переводится в ``failed`` (процесс
+        мог падать именно на нём). Возвращает новое состояние или None, если
+        задание подбирать не нужно: оно завершено или его владелец жив.
+        """
+
+        with self.store.locked(job_id):
+            state = self.store.load(job_id)
+            if state is None or state["status"] not in (JOB_QUEUED, JOB_RUNNING) or job_owner_alive(state):
+                return None
+            if state.get("attempts", 0) >= JOB_MAX_ATTEMPTS:
+                state = self.store.update(
+                    job_id,
+                    owner=self.owner,
+                    status=JOB_FAILED,
+                    finished_at=time.time(),
+                    error="Процесс, выполнявший задание, завершился",
+                )
+                if state.get("callback"):
+                    self._callbacks.submit(self._deliver, job_id)
+                return state
+            state = self.store.update(job_id, owner=self.owner, status=JOB_QUEUED)
+        self._executor.submit(self._run, job_id)
+        return state
+
+    def recover_all(self) -> int:
+        """Подбирает задания завершившихся процессов; возвращает их число."""
+
+        recovered = 0
+        for job_id in self.store.ids():
+            try:
+                if self.recover(job_id) is not None:
+                    recovered += 1
+            except Exception:
+                traceback.print_exc()
+        if recovered:
+            print(f"Подобрано заданий завершившихся процессов: {recovered}")
+        return recovered
+
+    def _run(self, job_id: str) -> None:
+        state = self.store.load(job_id)
+        if state is None:
+            return
+        state = self.store.update(
+            job_id, status=JOB_RUNNING, started_at=time.time(), attempts=state.get("attempts", 0) + 1
+        )
+
+        timings: dict = {}
+        try:
+            data, filename, mimetype = self.runner(state["params"], timings)
+            self.store.store_result(job_id, data)
+            state = self.store.update(
+                job_id,
+                status=JOB_DONE,
+                finished_at=time.time(),
+                timings_ms={name: round(seconds * 1000, 1) for name, seconds in timings.items()},
+                result={"filename": filename, "mimetype": mimetype, "size": len(data)},
+            )
+        except Exception as error:
+            traceback.print_exc()
+            state = self.store.update(
+                job_id,
+                status=JOB_FAILED,
+                finished_at=time.time(),
+                timings_ms={name: round(seconds * 1000, 1) for name, seconds in timings.items()},
+                error=str(error),
+            )
+
+        if state.get("callback"):
+            self._callbacks.submit(self._deliver, job_id)
+
+    def _deliver(self, job_id: str) -> None:
+        """POST результата (или JSON с ошибкой) на callback_url с экспоненциальной паузой."""
+
+        state = self.store.load(job_id)
+        if state is None or not state.get("callback"):
+            return
+        callback = state["callback"]
+
+        if state["status"] == JOB_DONE:
+            with open(self.store.result_path(job_id), "rb") as result_file:
+                body = result_file.read()
+            content_type = state["result"]["mimetype"]
+        else:
+            public = {key: state.get(key) for key in ("id", "status", "error", "timings_ms")}
+            body = json.dumps(public, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+
+        for attempt in range(1, JOB_CALLBACK_ATTEMPTS + 1):
+            callback["attempts"] = attempt
+            try:
+                _post_callback(callback["url"], state, body, content_type)
+                callback["delivered"] = True
+                callback["error"] = None
+                break
+            except Exception as error:
+                callback["error"] = str(error)
+                if attempt < JOB_CALLBACK_ATTEMPTS:
+                    time.sleep(JOB_CALLBACK_BACKOFF_S * 2 ** (attempt - 1))
+        self.store.update(job_id, callback=callback)
+
+
+# Поля задания, которые не отдаются клиенту: параметры сделки и владелец (хост и pid воркера).
+PRIVATE_JOB_FIELDS = frozenset({"params", "owner"})
+
+
+def public_job_state(state: dict) -> dict:
+    """Возвращает состояние задания без внутренних полей (параметров сделки и владельца)."""
+
+    return {key: value for key, value in state.items() if key not in PRIVATE_JOB_FIELDS}
+
+
+_queue: Optional[JobQueue] = None
+_queue_pid: Optional[int] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """Хранилище заданий — общий каталог, доступный всем процессам."""
+
+    return JobStore(JOBS_DIR)
+
+
+def get_job_queue(runner: Callable) -> JobQueue:
+    """Возвращает очередь заданий текущего процесса, создавая её после fork.
+
+    Новая очередь в фоне подбирает задания завершившихся процессов.
+    """
+
+    global _queue, _queue_pid
+
+    with _queue_lock:
+        if _queue is None or _queue_pid != os.getpid():
+            _queue = JobQueue(get_job_store(), runner)
+            _queue_pid = os.getpid()
+            _queue._executor.submit(_queue.recover_all)
+        return _queue
@@ -0,0 +1,146 @@
+"""Метрики Prometheus: длительность этапов генерации, запросы, ошибки, размеры ответов.
+
+Под gunicorn каждый воркер — отдельный процесс, поэтому метрики пишутся в
+multiprocess-режиме ``prometheus_client``: значения лежат в файлах каталога
+``PROMETHEUS_MULTIPROC_DIR`` (его задаёт ``gunicorn.conf.py``), а ``/metrics``
+на любом воркере суммирует их по всем процессам. Без этой переменной (локальный
+запуск) используется обычный реестр процесса. Если пакет ``prometheus_client``
+не установлен, функции модуля ничего не делают, а ``render_metrics`` возвращает None.
+"""
+
+import os
+from typing import Optional
+
+try:
+    from prometheus_client import (  # type: ignore[import-not-found]
+        CONTENT_TYPE_LATEST,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+except ImportError:  # pragma: no cover - зависит от окружения
+    Counter = None  # type: ignore[assignment]
+
+
+# Этапы длятся от миллисекунд (заполнение шаблона) до десятков секунд (холодный soffice).
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = tuple(1024 * 2 ** power for power in range(0, 15))  # 1 КиБ … 16 МиБ
+
+if Counter is not None:
+    STAGE_DURATION = Histogram(
+        "leadforce_stage_duration_seconds",
+        "Длительность этапа генерации документа",
+        ["stage"],
+        buckets=STAGE_BUCKETS,
+    )
+    STAGE_ERRORS = Counter(
+        "leadforce_stage_errors_total",
+        "Ошибки по этапам генерации документа",
+        ["stage"],
+    )
+    REQUESTS = Counter(
+        "leadforce_http_requests_total",
+        "HTTP-запросы по маршрутам и кодам ответа",
+        ["route", "method", "status"],
+    )
+    REQUEST_DURATION = Histogram(
+        "leadforce_http_request_duration_seconds",
+        "Время обработки HTTP-запроса до отдачи ответа",
+        ["route"],
+        buckets=REQUEST_BUCKETS,
+    )
+    IN_FLIGHT = Gauge(
+        "leadforce_http_requests_in_flight",
+        "Запросы, обрабатываемые прямо сейчас",
+        ["route"],
+        multiprocess_mode="livesum",
+    )
+    OUTPUT_SIZE = Histogram(
+        "leadforce_output_size_bytes",
+        "Размер отданного документа или архива",
+        ["format"],
+        buckets=SIZE_BUCKETS,
+    )
+    CONVERT_WAIT = Histogram(
+        "leadforce_convert_wait_seconds",
+        "Ожидание свободного слота конвертации PDF",
+        buckets=STAGE_BUCKETS,
+    )
+    CONVERT_REJECTED = Counter(
+        "leadforce_convert_rejected_total",
+        "Конвертации, отклонённые с 429: очередь заполнена или вышло время ожидания",
+        ["reason"],
+    )
+    STAGE_TIMEOUTS = Counter(
+        "leadforce_stage_timeouts_total",
+        "Этапы, не уложившиеся в свою долю бюджета запроса (ответ 504)",
+        ["stage"],
+    )
+    CONVERTER_KILLS = Counter(
+        "leadforce_converter_kills_total",
+        "Зависшие конвертеры, убитые по таймауту: pool — экземпляр пула, process — разовый soffice",
+        ["kind"],
+    )
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    if Counter is not None:
+        STAGE_DURATION.labels(stage).observe(seconds)
+
+
+def count_stage_error(stage: str) -> None:
+    if Counter is not None:
+        STAGE_ERRORS.labels(stage).inc()
+
+
+def request_started(route: str) -> None:
+    if Counter is not None:
+        IN_FLIGHT.labels(route).inc()
+
+
+def request_finished(route: str, method: str, status: int, seconds: float) -> None:
+    if Counter is not None:
+        IN_FLIGHT.labels(route).dec()
+        REQUESTS.labels(route, method, str(status)).inc()
+        REQUEST_DURATION.labels(route).observe(seconds)
+
+
+def observe_output_size(output_format: str, size: int) -> None:
+    if Counter is not None:
+        OUTPUT_SIZE.labels(output_format).observe(size)
+
+
+def observe_convert_wait(seconds: float) -> None:
+    if Counter is not None:
+        CONVERT_WAIT.observe(seconds)
+
+
+def count_convert_rejected(reason: str) -> None:
+    if Counter is not None:
+        CONVERT_REJECTED.labels(reason).inc()
+
+
+def count_stage_timeout(stage: str) -> None:
+    if Counter is not None:
+        STAGE_TIMEOUTS.labels(stage).inc()
+
+
+def count_converter_kill(kind: str) -> None:
+    if Counter is not None:
+        CONVERTER_KILLS.labels(kind).inc()
+
+
+def render_metrics() -> Optional[tuple]:
+    """Возвращает (тело, Content-Type) для ``/metrics`` или None без prometheus_client."""
+
+    if Counter is None:
+        return None
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,552 @@
+"""Банковский QR-код СБП: payload, PNG и вставка картинки в DOCX.
+
+Здесь только то, что нужно этапам ``qr`` и ``qr_insert``: модуль не зависит от
+Flask и остального сервиса, поэтому его импортируют и процессы пула CPU-этапов
+(``stage_pool.py``), не загружая ``app``.
+
+PNG строится сразу в итоговом размере (NumPy, 1-битный PNG с фиксированными
+полями) или, без NumPy, через qrcode/Pillow. Готовые PNG мемоизируются в
+процессе и складываются в общий кэш артефактов (``LEADFORCE_QR_CACHE_SPILL``).
+"""
+
+import os
+import struct
+import traceback
+import zlib
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, Optional, cast
+
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.shared import Mm, Pt
+try:
+    from docx.enum.table import WD_ROW_HEIGHT_RULE, WD_ALIGN_VERTICAL  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - handled at runtime
+    WD_ROW_HEIGHT_RULE = None  # type: ignore[assignment]
+    WD_ALIGN_VERTICAL = None  # type: ignore[assignment]
+
+from artifact_cache import get_artifact_cache, make_cache_key
+from reproducible import freeze_zip_timestamps
+
+try:
+    import qrcode  # type: ignore[import-not-found]
+    from qrcode.constants import ERROR_CORRECT_M  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - handled at runtime
+    qrcode = None  # type: ignore[assignment]
+    ERROR_CORRECT_M = None  # type: ignore[assignment]
+
+try:
+    from PIL import Image  # type: ignore[import-not-found]
+    try:
+        from PIL.Image import Resampling as PILResampling  # Pillow ≥ 9.1
+    except Exception:
+        PILResampling = None  # type: ignore[assignment]
+except ImportError:
+    Image = None  # type: ignore[assignment]
+    PILResampling = None  # type: ignore[assignment]
+
+try:
+    import numpy as np  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - handled at runtime
+    np = None  # type: ignore[assignment]
+
+# Явный тип для Pylance
+RESAMPLE_NEAREST: int
+if PILResampling is not None:
+    RESAMPLE_NEAREST = int(PILResampling.NEAREST)  # enum -> int
+elif Image is not None and hasattr(Image, "NEAREST"):
+    RESAMPLE_NEAREST = int(getattr(Image, "NEAREST"))
+else:
+    RESAMPLE_NEAREST = 0  # числовой фоллбэк; PIL понимает 0 как NEAREST
+# --- /Pillow compat ---        # старые версии
+
+QR_CODE_PLACEHOLDER = "{{QR_CODE}}"
+
+PAYMENT_QR_FIELDS_ORDER = [
+    "Name",
+    "PersonalAcc",
+    "BankName",
+    "BIC",
+    "CorrespAcc",
+    "PayeeINN",
+    "PayeeKPP",
+    "PayerAddress",
+    "Sum",
+    "Purpose",
+]
+
+
+# Дополнительный запас, который мы оставляем внутри ячейки таблицы при вставке QR.
+# На Linux LibreOffice при конвертации DOCX -> PDF заметно сильнее подрезает
+# изображения, если они вплотную подходят к границам ячейки, поэтому держим
+# небольшой фиксированный и относительный зазоры.
+QR_CELL_MARGIN_MM = 2
+QR_CELL_MARGIN_RATIO = 0.1
+
+# На Linux при конвертации в PDF LibreOffice иногда обрезает саму картинку даже при
+# соблюдении отступов в таблице, если у PNG слишком тонкая белая рамка. Поэтому мы
+# принудительно добавляем запас вокруг QR-кода при сохранении файла.
+QR_IMAGE_PADDING_PX = 0
+QR_IMAGE_PADDING_RATIO = 0.0
+
+
+def build_payment_qr_payload(details: dict) -> str:
+    """Формирует строку payload для СБП, учитывая фиксированный порядок полей."""
+
+    parts = ["ST00012"]
+    used_keys = set()
+
+    for field in PAYMENT_QR_FIELDS_ORDER:
+        value = (details.get(field) or "").strip()
+        if value:
+            parts.append(f"{field}={value}")
+            used_keys.add(field)
+
+    for key, value in details.items():
+        if key in used_keys:
+            continue
+        value = (value or "").strip()
+        if value:
+            parts.append(f"{key}={value}")
+
+    return "|".join(parts)
+
+
+def _require_qr_dependencies() -> Optional[str]:
+    """Возвращает строку с недостающими модулями для генерации QR или None."""
+
+    missing = []
+    if qrcode is None:
+        missing.append("qrcode")
+    if Image is None and np is None:
+        missing.append("Pillow")
+    if missing:
+        return ", ".join(missing)
+    return None
+
+
+QR_RENDER_DPI = 300
+QR_MEMO_SIZE = int(os.environ.get("LEADFORCE_QR_MEMO_SIZE", "256"))
+# Готовые PNG дополнительно складываются в общий кэш артефактов, чтобы QR,
+# построенный одним воркером, не пересчитывали остальные.
+QR_CACHE_SPILL = os.environ.get("LEADFORCE_QR_CACHE_SPILL", "1") != "0"
+
+
+QR_BOX_SIZE_PX = 10
+QR_BORDER_MODULES = 4
+
+
+def _make_qr(payload: str):
+    """Строит объект QR-кода с фиксированными уровнем коррекции и рамкой."""
+
+    qr_module = cast(Any, qrcode)
+    error_correction = cast(int, ERROR_CORRECT_M)
+    qr = qr_module.QRCode(
+        error_correction=error_correction, box_size=QR_BOX_SIZE_PX, border=QR_BORDER_MODULES
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """Упаковывает один chunk PNG вместе с длиной и CRC."""
+
+    return (
+        struct.pack(">I", len(data))
+        + chunk_type
+        + data
+        + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+    )
+
+
+def _encode_png_1bit(white, dpi: int) -> bytes:
+    """Кодирует булев массив (True — белый пиксель) в 1-битный grayscale PNG.
+
+    Все поля фиксированы, поэтому для одинаковой матрицы байты PNG совпадают.
+    """
+
+    height, width = white.shape
+    packed = np.packbits(white, axis=1)
+    rows = np.zeros((height, packed.shape[1] + 1), dtype=np.uint8)  # фильтр 0 в начале строки
+    rows[:, 1:] = packed
+    pixels_per_meter = int(round(dpi / 0.0254))
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)),
+        _png_chunk(b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1)),
+        _png_chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+def _render_qr_png_numpy(payload: str, width_mm: Optional[float], dpi: int) -> bytes:
+    """Растеризует матрицу модулей сразу в итоговый размер и кодирует один 1-битный PNG.
+
+    Без ширины изображение строится в исходном масштабе (10 px на модуль). С шириной
+    матрица масштабируется ближайшим соседом до ``width_mm`` при заданном dpi, а белая
+    рамка ``QR_IMAGE_PADDING_*`` входит в этот размер.
+    """
+
+    modules = np.asarray(_make_qr(payload).get_matrix(), dtype=bool)
+    size = modules.shape[0]
+
+    if width_mm is None:
+        target_px = size * QR_BOX_SIZE_PX
+        padding = 0
+    else:
+        target_px = max(64, int(round(width_mm / 25.4 * dpi)))
+        padding = max(int(target_px * QR_IMAGE_PADDING_RATIO), QR_IMAGE_PADDING_PX)
+    inner_px = max(target_px - 2 * padding, size)
+
+    # Выборка по центрам пикселей повторяет Image.resize(..., NEAREST).
+    index = ((2 * np.arange(inner_px) + 1) * size) // (2 * inner_px)
+    white = ~modules[np.ix_(index, index)]
+    if padding:
+        white = np.pad(white, padding, constant_values=True)
+    return _encode_png_1bit(white, dpi)
+
+
+def _render_qr_png_pil(payload: str, width_mm: Optional[float], dpi: int) -> bytes:
+    """Запасной путь без NumPy: PNG от qrcode/Pillow, затем масштабирование и рамка."""
+
+    qr_image = _make_qr(payload).make_image(fill_color="black", back_color="white")
+    pil_image = qr_image.get_image() if hasattr(qr_image, "get_image") else qr_image
+    if not hasattr(pil_image, "save"):
+        raise TypeError("Объект QR-кода не поддерживает сохранение в файл")
+    buffer = BytesIO()
+    pil_image.save(buffer, format="PNG", dpi=(dpi, dpi))
+    image = buffer.getvalue()
+
+    if width_mm is not None:
+        image = _rescale_png_to_mm(image, width_mm, dpi)
+        image = _ensure_qr_image_padding(image)
+    return image
+
+
+def render_qr_png_uncached(payload: str, width_mm: Optional[float], dpi: int) -> bytes:
+    """Строит PNG с QR-кодом; при заданной ширине — сразу в размере ``width_mm``."""
+
+    missing = _require_qr_dependencies()
+    if missing:
+        raise RuntimeError(
+            "Для генерации QR-кода необходимо установить зависимости: "
+            f"{missing}. Выполните 'pip install -r requirements.txt'."
+        )
+
+    if np is not None:
+        return _render_qr_png_numpy(payload, width_mm, dpi)
+    return _render_qr_png_pil(payload, width_mm, dpi)
+
+
+@lru_cache(maxsize=QR_MEMO_SIZE)
+def render_payment_qr_png(payload: str, width_mm: Optional[float] = None,
+                          dpi: int = QR_RENDER_DPI) -> bytes:
+    """Возвращает итоговый PNG QR-кода, запоминая результат по (payload, ширина, dpi).
+
+    ``width_mm=None`` — исходный размер (10 px на модуль), как в ``/Document/GetPaymentQr``.
+    Промах в памяти процесса сначала проверяется в общем кэше артефактов.
+    """
+
+    cache = get_artifact_cache() if QR_CACHE_SPILL else None
+    key = make_cache_key("qr", payload, width_mm, dpi)
+    if cache is not None:
+        cached = cache.read_optional(key, "png")
+        if cached:
+            return cached
+
+    image = render_qr_png_uncached(payload, width_mm, dpi)
+
+    if cache is not None:
+        try:
+            cache.put(key, {"png": image})
+        except OSError:
+            traceback.print_exc()
+    return image
+
+
+def generate_payment_qr_image(details: dict) -> tuple[str, bytes]:
+    """Генерирует PNG с QR-кодом и возвращает payload вместе с байтами изображения."""
+
+    payload = build_payment_qr_payload(details)
+    if len(payload) <= len("ST00012"):
+        return "", b""
+
+    return payload, render_payment_qr_png(payload)
+
+
+def _zero_paragraph_spacing(paragraph):
+    """Сбрасывает отступы и настройки переноса абзаца."""
+
+    pf = paragraph.paragraph_format
+    pf.space_before = Pt(0)
+    pf.space_after = Pt(0)
+    pf.line_spacing = 1.0
+    pf.keep_with_next = False
+    pf.keep_together = False
+
+def _set_cell_margins(cell, top=40, bottom=40, left=40, right=40):
+    """
+    Устанавливает внутренние поля ячейки таблицы в twips (1/20 pt).
+    40 twips ≈ 0.7 мм — хватает, чтобы LibreOffice не "съедал" верхние пиксели.
+    """
+    tcPr = cell._tc.get_or_add_tcPr()
+    tcMar = tcPr.find(qn('w:tcMar'))
+    if tcMar is None:
+        tcMar = OxmlElement('w:tcMar')
+        tcPr.append(tcMar)
+
+    def _ensure_side(name: str, val: int):
+        el = tcMar.find(qn(f'w:{name}'))
+        if el is None:
+            el = OxmlElement(f'w:{name}')
+            tcMar.append(el)
+        el.set(qn('w:w'), str(int(val)))
+        el.set(qn('w:type'), 'dxa')
+
+    for side, val in (('top', top), ('bottom', bottom), ('left', left), ('right', right),
+                      ('start', left), ('end', right)):
+        _ensure_side(side, val)
+
+def _replace_paragraph_with_image(paragraph, image: bytes, width_mm: float):
+    """Очищает параграф и вставляет изображение заданной ширины вместо текста."""
+
+    while paragraph.runs:
+        paragraph._element.remove(paragraph.runs[0]._r)
+    _zero_paragraph_spacing(paragraph)
+    run = paragraph.add_run()
+    run.add_picture(BytesIO(image), width=Mm(width_mm))
+
+
+def _replace_in_paragraphs(paragraphs, placeholder: str, image: bytes, width_mm: float) -> bool:
+    """Заменяет плейсхолдер на изображение и сообщает об успешной вставке."""
+
+    for paragraph in paragraphs:
+        if placeholder in paragraph.text:
+            paragraph.text = paragraph.text.replace(placeholder, "")
+            _replace_paragraph_with_image(paragraph, image, width_mm)
+            return True
+    return False
+
+
+def _ensure_qr_image_padding(image: bytes) -> bytes:
+    """Добавляет белую рамку вокруг QR-кода, чтобы избежать обрезания при экспорте."""
+    if Image is None:
+        return image
+
+    try:
+        with Image.open(BytesIO(image)) as img:
+            qr_image = img.convert("RGB")
+            min_side = min(qr_image.size)
+            padding = max(int(min_side * QR_IMAGE_PADDING_RATIO), QR_IMAGE_PADDING_PX)
+            if padding <= 0:
+                return image
+
+            new_size = (qr_image.width + padding * 2, qr_image.height + padding * 2)
+            padded = Image.new("RGB", new_size, "white")
+            padded.paste(qr_image, (padding, padding))
+            buffer = BytesIO()
+            padded.save(buffer, format="PNG")
+            return buffer.getvalue()
+    except Exception:
+        traceback.print_exc()
+        return image
+
+
+def _apply_qr_margin(limit_mm: float) -> float:
+    """Возвращает максимально допустимую ширину с учётом фиксированного и относительного зазоров."""
+    if not limit_mm:
+        return 0
+
+    margin = max(QR_CELL_MARGIN_MM, limit_mm * QR_CELL_MARGIN_RATIO)
+    return max(limit_mm - margin, 5)
+
+
+def _ensure_cell_can_fit_image(row, cell, image_width_mm: float) -> None:
+    """Настраивает параметры строки и ячейки таблицы, чтобы QR полностью уместился."""
+    try:
+        margin = max(QR_CELL_MARGIN_MM, image_width_mm * QR_CELL_MARGIN_RATIO)
+        required_height_mm = image_width_mm + 2 * margin 
+
+        if WD_ROW_HEIGHT_RULE is not None:
+            try:
+                row.height_rule = WD_ROW_HEIGHT_RULE.AT_LEAST
+            except Exception:
+                traceback.print_exc()
+
+        try:
+            current_height_mm = getattr(getattr(row, "height", None), "mm", None)
+        except Exception:
+            current_height_mm = None
+
+        if current_height_mm is None or current_height_mm < required_height_mm:
+            try:
+                row.height = Mm(required_height_mm)
+                if WD_ROW_HEIGHT_RULE is not None:
+                    row.height_rule = WD_ROW_HEIGHT_RULE.AT_LEAST
+            except Exception:
+                traceback.print_exc()
+
+        _set_cell_margins(cell, top=40, bottom=40, left=40, right=40)
+
+        if WD_ALIGN_VERTICAL is not None and cell is not None:
+            try:
+                cell.vertical_alignment = WD_ALIGN_VERTICAL.CENTER
+            except Exception:
+                traceback.print_exc()
+
+    except Exception:
+        traceback.print_exc()
+
+
+def _paragraph_has_placeholder(paragraph) -> bool:
+    """Возвращает True, если параграф содержит маркер вставки QR-кода."""
+
+    if QR_CODE_PLACEHOLDER in getattr(paragraph, "text", ""):
+        return True
+
+    try:
+        return QR_CODE_PLACEHOLDER in ''.join(run.text for run in getattr(paragraph, "runs", []))
+    except Exception:
+        return False
+
+
+def _clamp_width_to_cell(width_mm: float, row, cell) -> float:
+    """Ограничивает ширину изображения значением, допустимым для ячейки."""
+
+    limits = []
+
+    cell_width_attr = getattr(cell, "width", None)
+    cell_width_mm = getattr(cell_width_attr, "mm", None) if cell_width_attr else None
+    if cell_width_mm:
+        limits.append(_apply_qr_margin(cell_width_mm))
+
+    if not limits:
+        tc_pr = getattr(getattr(cell, "_tc", None), "tcPr", None)
+        tc_w = getattr(tc_pr, "tcW", None) if tc_pr is not None else None
+        width_twips = getattr(tc_w, "w", None) if tc_w is not None else None
+        try:
+            width_twips_int = int(width_twips) if width_twips is not None else None
+        except (TypeError, ValueError):
+            width_twips_int = None
+        if width_twips_int:
+            width_mm_from_twips = width_twips_int * 25.4 / 1440
+            limits.append(_apply_qr_margin(width_mm_from_twips))
+
+    if not limits:
+        return width_mm
+
+    safe_limit = min(limit for limit in limits if limit)
+    return min(width_mm, safe_limit)
+
+def _ensure_table_fixed_layout(cell) -> None:
+    """Включает фиксированную ширину колонок для таблицы, содержащей ячейку."""
+
+    tr = cell._tc.getparent()
+    tbl = tr.getparent()
+    tblPr = tbl.tblPr
+    if tblPr is None:
+        tblPr = OxmlElement('w:tblPr')
+        tbl.insert(0, tblPr)
+    tblLayout = tblPr.find(qn('w:tblLayout'))
+    if tblLayout is None:
+        tblLayout = OxmlElement('w:tblLayout')
+        tblPr.append(tblLayout)
+    tblLayout.set(qn('w:type'), 'fixed')
+
+def _ensure_gridcol_min_width(cell, min_width_mm: float) -> None:
+    """Задаёт минимальную ширину столбца через элементы <w:tblGrid>/<w:gridCol>."""
+
+    twips = int(round(min_width_mm * 1440 / 25.4))
+    tr = cell._tc.getparent()
+    tbl = tr.getparent()
+
+    columns = [tc for tc in tr.iterchildren() if tc.tag == qn('w:tc')]
+    col_idx = columns.index(cell._tc)
+
+    tblGrid = tbl.tblGrid
+    if tblGrid is None:
+        tblGrid = OxmlElement('w:tblGrid')
+        for _ in range(len(columns)):
+            tblGrid.append(OxmlElement('w:gridCol'))
+        insert_at = 1 if tbl.tblPr is not None else 0
+        tbl.insert(insert_at, tblGrid)
+
+    cols = [c for c in tblGrid.iterchildren() if c.tag == qn('w:gridCol')]
+    while len(cols) <= col_idx:
+        tblGrid.append(OxmlElement('w:gridCol'))
+        cols = [c for c in tblGrid.iterchildren() if c.tag == qn('w:gridCol')]
+
+    curr = cols[col_idx].get(qn('w:w'))
+    try:
+        curr_int = int(curr) if curr else 0
+    except ValueError:
+        curr_int = 0
+    if curr_int < twips:
+        cols[col_idx].set(qn('w:w'), str(twips))
+
+
+def _save_document_to_bytes(document) -> bytes:
+    """Сохраняет документ python-docx в память и возвращает байты DOCX.
+
+    python-docx пишет в архив текущее время; оно заменяется фиксированной датой,
+    чтобы одинаковые документы давали одинаковые байты.
+    """
+
+    buffer = BytesIO()
+    document.save(buffer)
+    return freeze_zip_timestamps(buffer.getvalue())
+
+
+def insert_qr_code_into_document(docx_bytes: bytes, qr_image: bytes, width_mm: float) -> bytes:
+    """Вставляет QR-код в документ, отдавая приоритет таблицам с плейсхолдером.
+
+    Возвращает байты изменённого DOCX или исходные байты, если маркер не найден.
+    """
+
+    document = Document(BytesIO(docx_bytes))
+
+    for table in document.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if any(_paragraph_has_placeholder(p) for p in cell.paragraphs):
+                    desired_mm = width_mm
+                    _ensure_table_fixed_layout(cell)
+                    _ensure_gridcol_min_width(cell, desired_mm)
+
+                    effective_width = _clamp_width_to_cell(desired_mm, row, cell)
+                    _ensure_cell_can_fit_image(row, cell, effective_width)
+
+                    if _replace_in_paragraphs(cell.paragraphs, QR_CODE_PLACEHOLDER, qr_image, effective_width):
+                        return _save_document_to_bytes(document)
+
+    if _replace_in_paragraphs(document.paragraphs, QR_CODE_PLACEHOLDER, qr_image, width_mm):
+        return _save_document_to_bytes(document)
+
+    return docx_bytes
+
+
+def _rescale_png_to_mm(image: bytes, width_mm: float, dpi: int = 300) -> bytes:
+    """Масштабирует квадратный PNG до указанной ширины в миллиметрах."""
+
+    if Image is None:
+        return image
+    try:
+        target_px = max(64, int(round(width_mm / 25.4 * dpi)))
+        with Image.open(BytesIO(image)) as img:
+            img = img.resize((target_px, target_px), resample=RESAMPLE_NEAREST)
+            buffer = BytesIO()
+            img.save(buffer, format="PNG", dpi=(dpi, dpi))
+            return buffer.getvalue()
+    except Exception:
+        traceback.print_exc()
+        return image
+
+
+def insert_payment_qr(docx_bytes: bytes, qr_payload: str, width_mm: float) -> bytes:
+    """Вставляет в DOCX QR с ``qr_payload`` шириной ``width_mm`` на место ``{{QR_CODE}}``."""
+
+    scaled_qr = render_payment_qr_png(qr_payload, width_mm)
+    return insert_qr_code_into_document(docx_bytes, scaled_qr, width_mm)
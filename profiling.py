@@ -0,0 +1,62 @@
+"""Профилирование отдельных запросов в продакшене через cProfile.
+
+Запрос профилируется, только если в заголовке ``X-LeadForce-Profile`` передан
+секрет из ``LEADFORCE_PROFILE_SECRET``; без заданного секрета профилирование
+выключено. Дамп ``.pstats`` сохраняется в ``LEADFORCE_PROFILE_DIR`` (каталог
+убирается хранилищем временных файлов по TTL), а его идентификатор возвращается
+в заголовке ``X-Profile-Id``.
+"""
+
+import cProfile
+import hmac
+import os
+import re
+import time
+import uuid
+from typing import Optional
+
+from temp_store import register_temp_area
+
+PROFILE_SECRET = os.environ.get("LEADFORCE_PROFILE_SECRET", "")
+PROFILE_DIR = os.environ.get("LEADFORCE_PROFILE_DIR", "./output/profiles")
+PROFILE_HEADER = "X-LeadForce-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+PROFILE_ID_RE = re.compile(r"^[\w-]+\.pstats$")
+PROFILE_LABEL_RE = re.compile(r"[^\w-]+")
+
+register_temp_area("profiles", PROFILE_DIR)
+
+
+def profiling_authorized(secret: Optional[str]) -> bool:
+    """Проверяет секрет оператора; сравнение не зависит по времени от совпавшего префикса."""
+
+    if not PROFILE_SECRET or not secret:
+        return False
+    return hmac.compare_digest(secret.encode("utf-8"), PROFILE_SECRET.encode("utf-8"))
+
+
+def start_profile() -> cProfile.Profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def save_profile(profiler: cProfile.Profile, label: str) -> str:
+    """Останавливает профилировщик, сохраняет дамп и возвращает его идентификатор."""
+
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_label = PROFILE_LABEL_RE.sub("_", label).strip("_") or "request"
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_label}_{uuid.uuid4().hex[:8]}.pstats"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, profile_id))
+    return profile_id
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    """Возвращает путь к сохранённому дампу или None для неизвестного идентификатора."""
+
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,106 @@
+"""Воспроизводимые байты артефактов: фиксированные даты в ZIP и PDF.
+
+Одинаковые входные данные должны давать одинаковые байты ответа — иначе ETag
+нельзя сделать сильным, а HTTP-кэши (nginx, CRM) не смогут переиспользовать
+ответы. Время попадает в артефакты в двух местах:
+
+* python-docx и ``zipfile`` пишут в заголовки ZIP текущее время — оно
+  заменяется на ``ZIP_EPOCH`` прямо в заголовках, без пересжатия;
+* LibreOffice и PyMuPDF пишут в PDF дату создания и случайный ``/ID`` —
+  даты заменяются на ``PDF_EPOCH``, а ``/ID`` выводится из содержимого файла.
+
+Все замены в PDF сохраняют длину строк, поэтому смещения в таблице xref
+остаются верными. Нормализуются только несжатые словари (Info, трейлер и
+XMP-метаданные без сжатия); то, что лежит в сжатых потоках, не трогается.
+"""
+
+import hashlib
+import re
+import struct
+import zipfile
+from io import BytesIO
+
+# Самая ранняя дата, которую допускает формат ZIP.
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+PDF_EPOCH = "19800101000000"
+
+_ZIP_DOS_TIME = (ZIP_EPOCH[3] << 11) | (ZIP_EPOCH[4] << 5) | (ZIP_EPOCH[5] // 2)
+_ZIP_DOS_DATE = ((ZIP_EPOCH[0] - 1980) << 9) | (ZIP_EPOCH[1] << 5) | ZIP_EPOCH[2]
+_ZIP_DOS_STAMP = struct.pack("<HH", _ZIP_DOS_TIME, _ZIP_DOS_DATE)
+
+# Смещения даты и времени модификации в локальном заголовке и в записи центрального каталога.
+_LOCAL_STAMP_OFFSET = 10
+_CENTRAL_STAMP_OFFSET = 12
+_CENTRAL_HEADER_SIZE = 46
+
+_PDF_DATE_RE = re.compile(rb"(/(?:CreationDate|ModDate)\s*\(D:)([^)]*)(\))")
+_XMP_DATE_RE = re.compile(rb"(<xmp:(?:CreateDate|ModifyDate|MetadataDate)>)([^<]*)(<)")
+_XMP_UUID_RE = re.compile(rb"(<xmpMM:(?:DocumentID|InstanceID)>uuid:)([0-9A-Fa-f-]+)(<)")
+_PDF_ID_RE = re.compile(rb"(/ID\s*\[\s*<)([0-9A-Fa-f]*)(>\s*<)([0-9A-Fa-f]*)(>\s*\])")
+_DIGIT_RE = re.compile(rb"\d")
+
+
+def freeze_zip_timestamps(data: bytes) -> bytes:
+    """Возвращает тот же ZIP-архив с датой ``ZIP_EPOCH`` у всех файлов.
+
+    Дата меняется в локальных заголовках и в центральном каталоге на месте:
+    содержимое и CRC файлов от неё не зависят, поэтому пересжимать ничего не нужно.
+    """
+
+    patched = bytearray(data)
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        infos = archive.infolist()
+        central_offset = archive.start_dir  # type: ignore[attr-defined]
+    for info in infos:
+        local = info.header_offset + _LOCAL_STAMP_OFFSET
+        patched[local:local + 4] = _ZIP_DOS_STAMP
+        patched[central_offset + _CENTRAL_STAMP_OFFSET:central_offset + _CENTRAL_STAMP_OFFSET + 4] = _ZIP_DOS_STAMP
+        name_length, extra_length, comment_length = struct.unpack_from("<HHH", patched, central_offset + 28)
+        central_offset += _CENTRAL_HEADER_SIZE + name_length + extra_length + comment_length
+    return bytes(patched)
+
+
+def _epoch_digits(value: bytes) -> bytes:
+    """Заменяет цифры даты на ``PDF_EPOCH`` (часовой пояс — на нули), сохраняя длину и формат."""
+
+    digits = iter(PDF_EPOCH.encode("ascii"))
+    return _DIGIT_RE.sub(lambda match: bytes([next(digits, ord("0"))]), value)
+
+
+def _hex_from_digest(digest: str, template: bytes) -> bytes:
+    """Шестнадцатеричная строка длины ``template`` из ``digest`` (дефисы UUID сохраняются)."""
+
+    source = iter((digest * (len(template) // len(digest) + 1)).encode("ascii"))
+    return bytes(char if char == ord("-") else next(source) for char in template)
+
+
+def normalize_pdf_metadata(pdf: bytes) -> bytes:
+    """Убирает из PDF время создания: фиксирует даты и выводит ``/ID`` из содержимого.
+
+    Длина файла и смещения объектов не меняются. ``/ID`` и UUID в XMP
+    становятся sha256 от файла с уже зафиксированными датами и обнулёнными
+    идентификаторами, то есть одинаковы у одинаковых документов.
+    """
+
+    pdf = _PDF_DATE_RE.sub(lambda m: m.group(1) + _epoch_digits(m.group(2)) + m.group(3), pdf)
+    pdf = _XMP_DATE_RE.sub(lambda m: m.group(1) + _epoch_digits(m.group(2)) + m.group(3), pdf)
+
+    def blank(match):
+        return b"".join(
+            group if index % 2 else _hex_from_digest("0", group)
+            for index, group in enumerate(match.groups(), start=1)
+        )
+
+    # Сначала идентификаторы обнуляются, чтобы хэш не зависел от их прежних значений.
+    pdf = _PDF_ID_RE.sub(blank, pdf)
+    pdf = _XMP_UUID_RE.sub(blank, pdf)
+    digest = hashlib.sha256(pdf).hexdigest().upper()
+
+    def derive(match):
+        return b"".join(
+            group if index % 2 else _hex_from_digest(digest, group)
+            for index, group in enumerate(match.groups(), start=1)
+        )
+
+    pdf = _PDF_ID_RE.sub(derive, pdf)
+    return _XMP_UUID_RE.sub(lambda m: m.group(1) + _hex_from_digest(digest.lower(), m.group(2)) + m.group(3), pdf)
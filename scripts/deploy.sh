@@ -97,6 +97,7 @@ ensure_service_user() {
 
 ensure_libreoffice() {
   if command -v soffice >/dev/null 2>&1; then
+    ensure_apt_packages python3-uno
     return
   fi
 
@@ -104,7 +105,7 @@ ensure_libreoffice() {
     log "Устанавливаем LibreOffice для PDF-конвертации"
     apt_update_once
     export DEBIAN_FRONTEND=noninteractive
-    apt-get install -y libreoffice
+    apt-get install -y libreoffice python3-uno
   else
     log "LibreOffice не найден. PDF-конвертация может быть недоступна." >&2
   fi
@@ -123,9 +124,14 @@ if [ -z "$SYSTEM_PYTHON" ]; then
   exit 1
 fi
 
+# Пулу LibreOffice нужен модуль uno из системного пакета python3-uno — без
+# системных site-packages venv его не видит, и конвертация идёт разовыми soffice.
 if [ ! -d "$VENV_DIR/bin" ]; then
   log "Создаём виртуальное окружение в $VENV_DIR"
-  "$SYSTEM_PYTHON" -m venv "$VENV_DIR"
+  "$SYSTEM_PYTHON" -m venv --system-site-packages "$VENV_DIR"
+elif grep -q '^include-system-site-packages = false' "$VENV_DIR/pyvenv.cfg"; then
+  log "Включаем системные site-packages в $VENV_DIR (модуль uno)"
+  sed -i 's/^include-system-site-packages = false/include-system-site-packages = true/' "$VENV_DIR/pyvenv.cfg"
 fi
 
 chown -R "$SERVICE_USER":"$SERVICE_GROUP" "$BASE_DIR"
@@ -0,0 +1,218 @@
+"""Пул процессов для CPU-этапов генерации: QR, заполнение шаблона, вставка QR.
+
+Эти этапы — чистый Python и lxml/python-docx и держат GIL, поэтому в потоках
+(ASGI-режим, ``gthread``) они выполняются по очереди, сколько бы ядер ни было.
+С ``LEADFORCE_STAGE_POOL=1`` каждый процесс сервиса держит пул процессов, и
+этапы ``qr``, ``fill`` и ``qr_insert`` выполняются в них параллельно.
+
+Размер пула задаётся на машину, а не на процесс сервиса: по умолчанию это
+число ядер, делённое на число процессов сервиса (``LEADFORCE_SERVICE_WORKERS``,
+его выставляет ``gunicorn.conf.py``), но не меньше одного. Так пулы всех
+воркеров вместе не занимают больше процессов, чем ядер.
+``LEADFORCE_STAGE_POOL_SIZE`` задаёт размер пула каждого процесса явно.
+
+С процессом пула обмениваются только байтами и строками: реквизиты QR, значения
+плейсхолдеров, путь и версия шаблона, DOCX и PNG. Функции этапов берутся из
+``payment_qr``, а шаблон процесс пула компилирует сам по пути и сверяет версию
+(sha256); ``app`` в процессах пула не импортируется. Если файл шаблона уже
+успел смениться и версии не сходятся, этап выполняется в вызывающем процессе
+со своей копией шаблона.
+
+Процессы пула запускаются через forkserver (fork из процесса с потоками
+небезопасен) и прогреваются при создании пула: компиляция шаблонов, первый QR
+и его вставка — первый запрос не платит за холодный старт. Пул создаётся
+лениво в каждом процессе сервиса, как и пул LibreOffice: в воркере gunicorn
+(см. ``gunicorn.conf.py``) или при старте ASGI-приложения. Sync-воркеры
+gunicorn обрабатывают один запрос за раз, и пул в них выключается
+(``disable_stage_pool``). Упавший процесс пула ломает весь
+``ProcessPoolExecutor`` — тогда пул пересоздаётся, а этап повторяется один раз.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from deadlines import StageTimeout, stage_time_left
+from docx_template import CompiledTemplate
+from metrics import count_stage_timeout
+
+STAGE_POOL_ENABLED = os.environ.get("LEADFORCE_STAGE_POOL", "0") == "1"
+# 0 — размер по числу ядер машины и процессов сервиса (см. ``stage_pool_size``).
+STAGE_POOL_SIZE = int(os.environ.get("LEADFORCE_STAGE_POOL_SIZE", "0"))
+
+STAGE_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Модули, которые нужны процессам пула; forkserver загружает их один раз.
+STAGE_POOL_MODULES = ["payment_qr", "template_registry", "generation_request"]
+
+
+def stage_pool_size() -> int:
+    """Процессов в пуле одного процесса сервиса.
+
+    Число процессов сервиса читается при вызове, а не при импорте: в режиме
+    ``preload_app`` модуль импортируется в мастере gunicorn раньше, чем хук
+    ``on_starting`` выставит ``LEADFORCE_SERVICE_WORKERS``.
+    """
+
+    if STAGE_POOL_SIZE > 0:
+        return STAGE_POOL_SIZE
+    workers = int(os.environ.get("LEADFORCE_SERVICE_WORKERS", "1"))
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+class TemplateChanged(RuntimeError):
+    """Файл шаблона в процессе пула не совпадает с версией вызывающего процесса."""
+
+
+# Шаблоны процесса пула по пути к файлу.
+_worker_templates: dict = {}
+
+
+def _init_worker() -> None:
+    """Прогревает процесс пула: шаблоны реестра, первый QR и его вставка."""
+
+    from generation_request import DEFAULT_QR_WIDTH_MM
+    from payment_qr import QR_RENDER_DPI, insert_qr_code_into_document, render_qr_png_uncached
+    from template_registry import get_template_registry
+
+    registry = get_template_registry()
+    registry.preload()
+    for name in registry.versions():
+        template = registry.get(name)
+        _worker_templates[template.path] = template
+
+    try:
+        qr_png = render_qr_png_uncached("ST00012|Name=LeadForce", DEFAULT_QR_WIDTH_MM, QR_RENDER_DPI)
+        insert_qr_code_into_document(registry.get().render({}), qr_png, DEFAULT_QR_WIDTH_MM)
+    except Exception:
+        traceback.print_exc()
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def _fill_template(path: str, version: str, replacements: dict) -> bytes:
+    """Заполняет шаблон ``path`` в процессе пула, если его версия — ``version``."""
+
+    template = _worker_templates.get(path)
+    if template is None or template.version != version:
+        template = _worker_templates[path] = CompiledTemplate(path)
+    if template.version != version:
+        raise TemplateChanged(f"Шаблон {path} изменился: {template.version[:12]} вместо {version[:12]}")
+    return template.render(replacements)
+
+
+class StagePool:
+    """Прогретые процессы для CPU-этапов генерации."""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context(STAGE_POOL_START_METHOD)
+        if STAGE_POOL_START_METHOD == "forkserver":
+            context.set_forkserver_preload(STAGE_POOL_MODULES)
+        executor = ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=context,
+            initializer=_init_worker,
+        )
+        # Процессы создаются по требованию: столько одновременных задач поднимают их все сразу.
+        for future in [executor.submit(_worker_pid) for _ in range(self.size)]:
+            future.result()
+        print(f"Пул CPU-этапов запущен: процессов {self.size}")
+        return executor
+
+    def _restart(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._start()
+            return self._executor
+
+    def _call(self, stage: str, func, *args):
+        """Выполняет ``func`` в процессе пула, не дольше остатка доли этапа ``stage``."""
+
+        executor = self._executor
+        for attempt in range(2):
+            timeout = stage_time_left()
+            future = executor.submit(func, *args)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # Процесс доделает этап вхолостую; ответ запросу — 504 сразу.
+                future.cancel()
+                count_stage_timeout(stage)
+                raise StageTimeout(stage, timeout or 0.0)
+            except BrokenProcessPool:
+                traceback.print_exc()
+                if attempt:
+                    raise
+                executor = self._restart(executor)
+
+    def run(self, stage: str, func, *args):
+        """Этап ``stage``: функция ``func`` из ``payment_qr`` с аргументами ``args`` (байты и строки).
+
+        Функция передаётся в процесс пула по имени модуля, поэтому её модуль не
+        должен тянуть за собой ``app``.
+        """
+
+        return self._call(stage, func, *args)
+
+    def fill(self, stage: str, template: CompiledTemplate, replacements: dict) -> bytes:
+        """Заполнение шаблона: в пул уходят только путь, версия и значения плейсхолдеров."""
+
+        try:
+            return self._call(stage, _fill_template, template.path, template.version, replacements)
+        except TemplateChanged:
+            return template.render(replacements)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[StagePool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+_pool_disabled = False
+
+
+def disable_stage_pool() -> None:
+    """Выключает пул в текущем процессе: этапы выполняются в нём самом.
+
+    Вызывается для sync-воркеров gunicorn: они обрабатывают один запрос за раз,
+    и параллелить этапы внутри процесса им нечего.
+    """
+
+    global _pool_disabled
+
+    _pool_disabled = True
+
+
+def get_stage_pool() -> Optional[StagePool]:
+    """Возвращает пул CPU-этапов текущего процесса или None, если он выключен.
+
+    Пул создаётся при первом обращении уже в процессе сервиса (после fork
+    воркера gunicorn) и сразу поднимает все свои процессы.
+    """
+
+    global _pool, _pool_pid
+
+    if not STAGE_POOL_ENABLED or _pool_disabled:
+        return None
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = StagePool(stage_pool_size())
+            _pool_pid = os.getpid()
+            atexit.register(_pool.close)
+        return _pool
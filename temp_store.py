@@ -0,0 +1,294 @@
+"""Учёт и уборка промежуточных файлов генерации.
+
+Каждый модуль, который пишет на диск временные данные, регистрирует свой
+каталог как область (``register_temp_area``): черновые каталоги конвертера,
+профили LibreOffice, задания ``/Jobs``, файлы старых версий сервиса в
+``./output``. Фоновый поток раз в ``LEADFORCE_TEMP_SWEEP_INTERVAL_S`` секунд
+удаляет из областей осиротевшие записи и записи старше TTL, а при превышении
+общего бюджета ``LEADFORCE_TEMP_MAX_BYTES`` — самые старые из остальных.
+Бюджет мягкий: новые записи он не ограничивает, а записи живых владельцев и
+записи моложе ``TEMP_EVICT_MIN_AGE_S`` по нему не вытесняются, поэтому объём
+может временно его превышать.
+
+Записи областей с ``pid_scoped=True`` содержат в имени PID процесса-владельца
+(``scratch_<pid>_…``, ``profile_<pid>_<n>``): пока владелец жив, запись не
+трогается, после его падения удаляется при ближайшей уборке.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+TEMP_TTL_S = float(os.environ.get("LEADFORCE_TEMP_TTL_S", "3600"))
+TEMP_MAX_BYTES = int(os.environ.get("LEADFORCE_TEMP_MAX_BYTES", str(1024 * 1024 * 1024)))
+TEMP_SWEEP_INTERVAL_S = float(os.environ.get("LEADFORCE_TEMP_SWEEP_INTERVAL_S", "300"))
+
+# Записи моложе этого возраста не вытесняются по бюджету: они, скорее всего,
+# принадлежат выполняющемуся сейчас запросу или заданию.
+TEMP_EVICT_MIN_AGE_S = 60.0
+
+SWEEP_LOCK_NAME = ".sweep.lock"
+OWNER_PID_RE = re.compile(r"_(\d+)_")
+
+
+class TempArea(NamedTuple):
+    """Каталог с промежуточными файлами одного компонента."""
+
+    name: str
+    path: str
+    ttl_s: Optional[float]
+    pid_scoped: bool = False
+    files_only: bool = False
+
+
+class TempEntry(NamedTuple):
+    area: str
+    path: str
+    size: int
+    files: int
+    mtime: float
+    owner_alive: bool
+
+
+_areas: dict = {}
+
+
+def register_temp_area(name: str, path: str, ttl_s: Optional[float] = TEMP_TTL_S,
+                       pid_scoped: bool = False, files_only: bool = False) -> None:
+    """Передаёт каталог под управление хранилища.
+
+    ``ttl_s=None`` — записи удаляются только после смерти владельца или по
+    бюджету; ``files_only`` — подкаталоги принадлежат другим компонентам.
+    """
+
+    _areas[name] = TempArea(name, path, ttl_s, pid_scoped, files_only)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _measure(path: str) -> tuple:
+    """Возвращает (байты, число файлов, последний mtime) файла или дерева каталогов."""
+
+    stat = os.lstat(path)
+    if not os.path.isdir(path) or os.path.islink(path):
+        return stat.st_size, 1, stat.st_mtime
+
+    size, files, mtime = 0, 0, stat.st_mtime
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                file_stat = os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+            size += file_stat.st_size
+            files += 1
+            mtime = max(mtime, file_stat.st_mtime)
+    return size, files, mtime
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class TempArtifactStore:
+    """Промежуточные файлы всех зарегистрированных областей с TTL и бюджетом."""
+
+    def __init__(self, areas: dict, ttl_s: float = TEMP_TTL_S, max_bytes: int = TEMP_MAX_BYTES,
+                 lock_dir: Optional[str] = None):
+        self.areas = areas
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.lock_dir = lock_dir or tempfile.gettempdir()
+        self.last_sweep: Optional[dict] = None
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+
+    @contextmanager
+    def scratch_dir(self, area: str):
+        """Черновой каталог запроса в области ``area``; удаляется при выходе."""
+
+        root = self.areas[area].path
+        os.makedirs(root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=f"scratch_{os.getpid()}_", dir=root)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _scan(self) -> list:
+        """Возвращает записи верхнего уровня всех областей."""
+
+        entries = []
+        for area in list(self.areas.values()):
+            try:
+                children = list(os.scandir(area.path))
+            except OSError:
+                continue
+            for child in children:
+                if child.name.startswith("."):
+                    continue
+                try:
+                    if area.files_only and not child.is_file(follow_symlinks=False):
+                        continue
+                    size, files, mtime = _measure(child.path)
+                except OSError:
+                    continue
+                owner_alive = False
+                if area.pid_scoped:
+                    match = OWNER_PID_RE.search(child.name)
+                    owner_alive = match is not None and _pid_alive(int(match.group(1)))
+                entries.append(TempEntry(area.name, child.path, size, files, mtime, owner_alive))
+        return entries
+
+    def _expired(self, entry: TempEntry, now: float) -> bool:
+        area = self.areas[entry.area]
+        if area.pid_scoped:
+            if entry.owner_alive:
+                return False
+            if OWNER_PID_RE.search(os.path.basename(entry.path)):
+                return True
+        return area.ttl_s is not None and now - entry.mtime > area.ttl_s
+
+    @contextmanager
+    def _sweep_lock(self):
+        """Неблокирующая блокировка: уборку одновременно выполняет один процесс."""
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with open(os.path.join(self.lock_dir, SWEEP_LOCK_NAME), "a+b") as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield False
+                    return
+            try:
+                yield True
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def sweep(self) -> Optional[dict]:
+        """Удаляет просроченные и осиротевшие записи, затем укладывает объём в бюджет.
+
+        Бюджет соблюдается насколько возможно: записи живых владельцев и записи
+        моложе ``TEMP_EVICT_MIN_AGE_S`` не удаляются, так что ``bytes_after`` в
+        итогах может остаться больше ``max_bytes``. Возвращает итоги уборки или
+        None, если её сейчас выполняет другой процесс.
+        """
+
+        with self._sweep_lock() as acquired:
+            if not acquired:
+                return None
+
+            now = time.time()
+            removed_files = removed_bytes = 0
+            kept = []
+            for entry in self._scan():
+                if self._expired(entry, now):
+                    _remove(entry.path)
+                    removed_files += entry.files
+                    removed_bytes += entry.size
+                else:
+                    kept.append(entry)
+
+            total = sum(entry.size for entry in kept)
+            if self.max_bytes > 0 and total > self.max_bytes:
+                candidates = [
+                    entry for entry in kept
+                    if not entry.owner_alive and now - entry.mtime > TEMP_EVICT_MIN_AGE_S
+                ]
+                for entry in sorted(candidates, key=lambda item: item.mtime):
+                    if total <= self.max_bytes:
+                        break
+                    _remove(entry.path)
+                    total -= entry.size
+                    removed_files += entry.files
+                    removed_bytes += entry.size
+
+            self.last_sweep = {
+                "at": now,
+                "removed_files": removed_files,
+                "removed_bytes": removed_bytes,
+                "bytes_after": total,
+            }
+            return self.last_sweep
+
+    def stats(self) -> dict:
+        """Возвращает объём и число файлов по областям и в сумме."""
+
+        areas = {name: {"path": area.path, "bytes": 0, "files": 0} for name, area in self.areas.items()}
+        for entry in self._scan():
+            areas[entry.area]["bytes"] += entry.size
+            areas[entry.area]["files"] += entry.files
+        return {
+            "bytes": sum(area["bytes"] for area in areas.values()),
+            "files": sum(area["files"] for area in areas.values()),
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl_s,
+            "areas": areas,
+            "last_sweep": self.last_sweep,
+        }
+
+    def _sweep_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception:
+                traceback.print_exc()
+
+    def start_sweeper(self, interval: float = TEMP_SWEEP_INTERVAL_S) -> None:
+        """Запускает фоновую уборку в текущем процессе."""
+
+        if interval <= 0 or (self._sweeper is not None and self._sweeper.is_alive()):
+            return
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop, args=(interval,), name="temp-sweeper", daemon=True
+        )
+        self._sweeper.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_store: Optional[TempArtifactStore] = None
+_store_pid: Optional[int] = None
+_store_lock = threading.Lock()
+
+
+def get_temp_store() -> TempArtifactStore:
+    """Возвращает хранилище процесса, запуская уборку после fork."""
+
+    global _store, _store_pid
+
+    with _store_lock:
+        if _store is None or _store_pid != os.getpid():
+            _store = TempArtifactStore(_areas)
+            _store_pid = os.getpid()
+            _store.start_sweeper()
+        return _store
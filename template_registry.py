@@ -0,0 +1,179 @@
+"""Реестр DOCX-шаблонов: предкомпиляция, выбор по имени и горячая перезагрузка.
+
+Реестр сканирует каталог ``Templates/`` и компилирует каждый ``*.docx`` при
+старте воркера (``preload``). Имя шаблона — имя файла без расширения; его
+передают параметром ``template``, без параметра используется шаблон по
+умолчанию.
+
+Не чаще раза в ``LEADFORCE_TEMPLATE_CHECK_INTERVAL_S`` секунд реестр проверяет
+mtime и размер файла шаблона. Если они изменились, шаблон компилируется заново
+и подменяет старый одной операцией присваивания — запросы, уже взявшие прежний
+шаблон, дорабатывают с ним. Если содержимое (sha256) не поменялось, остаётся
+прежний объект, а если новый файл не разбирается (например, ещё копируется),
+прежняя версия продолжает работать до следующей проверки. Версия шаблона
+входит в ключи кэшей, поэтому старые артефакты после замены файла не отдаются.
+"""
+
+import os
+import threading
+import time
+import traceback
+from typing import NamedTuple, Optional
+
+from docx_template import CompiledTemplate
+
+TEMPLATES_DIR = os.environ.get("LEADFORCE_TEMPLATES_DIR", "./Templates")
+DEFAULT_TEMPLATE = os.environ.get("LEADFORCE_DEFAULT_TEMPLATE", "LeadsForce_v0")
+TEMPLATE_CHECK_INTERVAL_S = float(os.environ.get("LEADFORCE_TEMPLATE_CHECK_INTERVAL_S", "2"))
+
+TEMPLATE_SUFFIX = ".docx"
+
+
+class UnknownTemplateError(ValueError):
+    """Запрошен шаблон, которого нет в реестре."""
+
+
+class _Entry(NamedTuple):
+    path: str
+    template: Optional[CompiledTemplate]
+    signature: Optional[tuple]  # (mtime_ns, размер) последнего разобранного файла
+    checked_at: float
+
+
+def _file_signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def template_name(path: str) -> str:
+    """Имя шаблона по пути к файлу: имя файла без расширения."""
+
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class TemplateRegistry:
+    """Скомпилированные шаблоны каталога ``root`` и явно добавленные файлы."""
+
+    def __init__(self, root: str, default: str = DEFAULT_TEMPLATE,
+                 check_interval_s: float = TEMPLATE_CHECK_INTERVAL_S):
+        self.root = root
+        self.default = default
+        self.check_interval_s = check_interval_s
+        self._entries: dict = {}
+        self._extra_paths: dict = {}
+        self._scanned_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _scan(self) -> None:
+        """Сверяет список шаблонов с каталогом: новые файлы добавляет, удалённые убирает."""
+
+        paths = dict(self._extra_paths)
+        try:
+            for filename in sorted(os.listdir(self.root)):
+                # ~$name.docx — файл блокировки, который Word кладёт рядом с открытым документом.
+                if filename.endswith(TEMPLATE_SUFFIX) and not filename.startswith("~$"):
+                    paths.setdefault(template_name(filename), os.path.join(self.root, filename))
+        except FileNotFoundError:
+            pass
+
+        entries = {name: entry for name, entry in self._entries.items() if name in paths}
+        for name, path in paths.items():
+            if name not in entries or entries[name].path != path:
+                entries[name] = _Entry(path, None, None, 0.0)
+        self._entries = entries
+        self._scanned_at = time.monotonic()
+
+    def _refresh(self, name: str, entry: _Entry) -> _Entry:
+        """Перекомпилирует шаблон, если файл изменился; при ошибке оставляет прежний."""
+
+        now = time.monotonic()
+        if entry.template is not None and now - entry.checked_at < self.check_interval_s:
+            return entry
+
+        signature = _file_signature(entry.path)
+        if signature is None or signature == entry.signature:
+            entry = entry._replace(checked_at=now)
+        else:
+            try:
+                compiled = CompiledTemplate(entry.path)
+            except Exception:
+                print(f"Не удалось скомпилировать шаблон {entry.path}")
+                traceback.print_exc()
+                # Тот же битый файл не разбирается повторно — ждём следующего изменения.
+                entry = entry._replace(signature=signature, checked_at=now)
+            else:
+                if entry.template is not None and compiled.version == entry.template.version:
+                    compiled = entry.template
+                elif entry.template is not None:
+                    print(f"Шаблон {name} обновлён: {entry.template.version[:12]} -> {compiled.version[:12]}")
+                entry = _Entry(entry.path, compiled, signature, now)
+        self._entries[name] = entry
+        return entry
+
+    def register(self, path: str, name: Optional[str] = None) -> str:
+        """Добавляет в реестр файл вне каталога шаблонов и возвращает его имя."""
+
+        name = name or template_name(path)
+        with self._lock:
+            self._extra_paths[name] = path
+            self._scan()
+        return name
+
+    def preload(self) -> None:
+        """Компилирует все шаблоны, чтобы первый запрос не платил за разбор."""
+
+        with self._lock:
+            self._scan()
+            for name, entry in list(self._entries.items()):
+                self._refresh(name, entry)
+
+    def get(self, name: Optional[str] = None) -> CompiledTemplate:
+        """Возвращает актуальный скомпилированный шаблон по имени (по умолчанию — основной).
+
+        Бросает ``UnknownTemplateError``, если такого шаблона нет или его файл ни
+        разу не удалось скомпилировать.
+        """
+
+        name = (name or self.default).strip()
+        if name.endswith(TEMPLATE_SUFFIX):
+            name = name[:-len(TEMPLATE_SUFFIX)]
+        with self._lock:
+            entry = self._entries.get(name)
+            stale_scan = self._scanned_at is None or time.monotonic() - self._scanned_at >= self.check_interval_s
+            if entry is None and stale_scan:
+                self._scan()
+                entry = self._entries.get(name)
+            if entry is None:
+                raise UnknownTemplateError(
+                    f"Неизвестный шаблон: {name}. Доступны: {', '.join(sorted(self._entries)) or 'нет'}"
+                )
+            entry = self._refresh(name, entry)
+        if entry.template is None:
+            raise UnknownTemplateError(f"Шаблон {name} не удалось загрузить")
+        return entry.template
+
+    def versions(self) -> dict:
+        """``{имя: версия}`` скомпилированных шаблонов — для диагностики."""
+
+        with self._lock:
+            return {
+                name: entry.template.version
+                for name, entry in sorted(self._entries.items())
+                if entry.template is not None
+            }
+
+
+_registry: Optional[TemplateRegistry] = None
+
+
+def get_template_registry() -> TemplateRegistry:
+    """Возвращает реестр шаблонов процесса."""
+
+    global _registry
+
+    if _registry is None:
+        _registry = TemplateRegistry(TEMPLATES_DIR)
+    return _registry
@@ -0,0 +1,29 @@
+"""Общие настройки тестов: модули сервиса импортируются из корня репозитория."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Шаблоны и каталоги вывода заданы относительными путями от корня репозитория.
+os.chdir(ROOT)
+
+
+def pytest_addoption(parser):
+    parser.addoption("--exhaustive", action="store_true",
+                     help="запустить долгие полные сверки (маркер exhaustive)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "exhaustive: долгая полная сверка, запускается с --exhaustive")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--exhaustive"):
+        return
+    skip = pytest.mark.skip(reason="долгая сверка: запустите pytest с --exhaustive")
+    for item in items:
+        if "exhaustive" in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,135 @@
+"""Сумма прописью: формы слов, округление копеек, большие суммы и ошибки разбора.
+
+Сверка с num2words (прежняя реализация) пропускается без ``num2words``; полный
+перебор ``0..EXHAUSTIVE_LIMIT`` идёт несколько минут и запускается только с
+``pytest --exhaustive``.
+"""
+
+import os
+
+import pytest
+
+from amount_words import (
+    KOPECK_FORMS,
+    MAX_NUMBER,
+    RUBLE_FORMS,
+    amount_in_words,
+    number_in_words,
+    parse_kopecks,
+    plural_form,
+)
+
+# Эталонные строки проверены вручную и заморожены. До замены num2words счета
+# всегда писали «рублей … копеек» без согласования с числом; теперь форма слов
+# согласуется, а сами числа прописью совпадают с num2words (см. сверку ниже).
+EXPECTED = {
+    "0": "Ноль рублей 00 копеек",
+    "0.01": "Ноль рублей 01 копейка",
+    "1": "Один рубль 00 копеек",
+    "2": "Два рубля 00 копеек",
+    "5": "Пять рублей 00 копеек",
+    "11": "Одиннадцать рублей 00 копеек",
+    "14": "Четырнадцать рублей 00 копеек",
+    "21": "Двадцать один рубль 00 копеек",
+    "22": "Двадцать два рубля 00 копеек",
+    "101": "Сто один рубль 00 копеек",
+    "111": "Сто одиннадцать рублей 00 копеек",
+    "1000": "Одна тысяча рублей 00 копеек",
+    "1001": "Одна тысяча один рубль 00 копеек",
+    "2000": "Две тысячи рублей 00 копеек",
+    "5000": "Пять тысяч рублей 00 копеек",
+    "12011": "Двенадцать тысяч одиннадцать рублей 00 копеек",
+    "21000": "Двадцать одна тысяча рублей 00 копеек",
+    "100000": "Сто тысяч рублей 00 копеек",
+    "29990.50": "Двадцать девять тысяч девятьсот девяносто рублей 50 копеек",
+    "1000000": "Один миллион рублей 00 копеек",
+    "2000000": "Два миллиона рублей 00 копеек",
+    "40000000": "Сорок миллионов рублей 00 копеек",
+    "1234567.89": "Один миллион двести тридцать четыре тысячи пятьсот шестьдесят семь рублей 89 копеек",
+    "-15.20": "Минус пятнадцать рублей 20 копеек",
+}
+
+
+@pytest.mark.parametrize("value, expected", sorted(EXPECTED.items()))
+def test_amount_in_words_matches_frozen_strings(value, expected):
+    assert amount_in_words(value, kopecks_in_words=False) == expected
+
+
+@pytest.mark.parametrize("number, expected", [
+    (0, "рублей"), (1, "рубль"), (2, "рубля"), (4, "рубля"), (5, "рублей"),
+    (11, "рублей"), (12, "рублей"), (14, "рублей"), (21, "рубль"), (22, "рубля"),
+    (25, "рублей"), (100, "рублей"), (101, "рубль"), (111, "рублей"), (1012, "рублей"),
+    (1021, "рубль"), (-3, "рубля"),
+])
+def test_plural_form(number, expected):
+    assert plural_form(number, RUBLE_FORMS) == expected
+
+
+def test_kopecks_plural_and_feminine_forms():
+    assert amount_in_words("21.21", kopecks_in_words=True) == "Двадцать один рубль двадцать одна копейка"
+    assert amount_in_words("2.02", kopecks_in_words=True) == "Два рубля две копейки"
+    assert amount_in_words("0.11", kopecks_in_words=False) == "Ноль рублей 11 копеек"
+    assert plural_form(3, KOPECK_FORMS) == "копейки"
+
+
+def test_zero():
+    assert number_in_words(0) == "ноль"
+    assert amount_in_words(0, kopecks_in_words=False) == "Ноль рублей 00 копеек"
+    assert amount_in_words("0", kopecks_in_words=True) == "Ноль рублей ноль копеек"
+
+
+@pytest.mark.parametrize("value, kopecks", [
+    ("0.005", 1),
+    ("0.004", 0),
+    ("0.995", 100),
+    ("2.675", 268),
+    ("1 234,565", 123457),
+    ("-0.005", -1),
+    (1.005, 101),
+])
+def test_kopecks_round_half_up(value, kopecks):
+    assert parse_kopecks(value) == kopecks
+
+
+def test_rounding_carries_into_rubles():
+    assert amount_in_words("0.995", kopecks_in_words=False) == "Один рубль 00 копеек"
+    assert amount_in_words("1,5", kopecks_in_words=False) == "Один рубль 50 копеек"
+
+
+def test_large_values():
+    assert amount_in_words("999999999999.99", kopecks_in_words=False) == (
+        "Девятьсот девяносто девять миллиардов девятьсот девяносто девять миллионов "
+        "девятьсот девяносто девять тысяч девятьсот девяносто девять рублей 99 копеек"
+    )
+    assert number_in_words(2 * 10 ** 12) == "два триллиона"
+    assert number_in_words(MAX_NUMBER).startswith("девятьсот девяносто девять секстиллионов")
+    with pytest.raises(ValueError):
+        number_in_words(MAX_NUMBER + 1)
+    with pytest.raises(ValueError):
+        amount_in_words(MAX_NUMBER + 1)
+
+
+@pytest.mark.parametrize("value", ["", "abc", "12.3.4", "1e", "inf", "NaN", None, "1" * 100])
+def test_invalid_input(value):
+    with pytest.raises(ValueError):
+        amount_in_words(value)
+
+
+QUICK_LIMIT = 20_000
+EXHAUSTIVE_LIMIT = 10 ** 7
+
+
+def _num2words_mismatches(limit: int) -> list:
+    pytest.importorskip("num2words")
+    from benchmarks.bench_amount_words import check_currency, check_integers
+
+    return check_currency() + check_integers(limit, os.cpu_count() or 1)
+
+
+def test_matches_num2words_quick():
+    assert _num2words_mismatches(QUICK_LIMIT) == []
+
+
+@pytest.mark.exhaustive
+def test_matches_num2words_exhaustive():
+    assert _num2words_mismatches(EXHAUSTIVE_LIMIT) == []
@@ -0,0 +1,17 @@
+"""Кэш артефактов: учёт объёма при записи и перезаписи ключа."""
+
+from artifact_cache import ArtifactCache
+
+
+def test_overwrite_counts_only_size_difference(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=10_000)
+
+    cache.put("ab12", {"pdf": b"x" * 300, "docx": b"y" * 200})
+    assert cache.stats()["bytes"] == 500
+
+    cache.put("ab12", {"pdf": b"x" * 100})
+    assert cache.stats()["bytes"] == 300
+
+    cache.put("ab12", {"pdf": b"x" * 100, "docx": b"y" * 200})
+    assert cache.stats()["bytes"] == 300
+    assert cache.get("ab12", ["pdf", "docx"]) == {"pdf": b"x" * 100, "docx": b"y" * 200}
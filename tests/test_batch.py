@@ -0,0 +1,68 @@
+"""Пакетная генерация: большие пакеты уходят в очередь заданий."""
+
+import io
+import json
+import time
+import zipfile
+
+import pytest
+
+import app
+import jobs
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "_queue", None)
+    monkeypatch.setattr(jobs, "_queue_pid", None)
+    monkeypatch.setattr(app, "BATCH_SYNC_MAX_ITEMS", 2)
+    return app.app.test_client()
+
+
+def test_large_batch_runs_as_job(client):
+    items = [{"deal": f"batch-{index}", "price": "100"} for index in range(3)]
+
+    response = client.post("/Document/Batch", json=items)
+    assert response.status_code == 202
+    body = response.get_json()
+    assert response.headers["Location"] == body["status_url"]
+
+    deadline = time.monotonic() + 60
+    while client.get(body["status_url"]).get_json()["status"] not in ("done", "failed"):
+        assert time.monotonic() < deadline, "задание не завершилось"
+        time.sleep(0.05)
+
+    result = client.get(body["result_url"])
+    assert result.status_code == 200
+    assert result.mimetype == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(result.data)) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        names = archive.namelist()
+    assert [item["deal"] for item in manifest["items"]] == ["batch-0", "batch-1", "batch-2"]
+    assert all(f"batch-{index}/document.docx" in names for index in range(3))
+
+
+def test_large_batch_rejects_internal_callback(client):
+    items = [{"deal": str(index), "price": "100"} for index in range(3)]
+    response = client.post("/Document/Batch?callback_url=http://127.0.0.1/", json=items)
+    assert response.status_code == 400
+
+
+def test_batch_over_limit_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(app, "BATCH_MAX_ITEMS", 3)
+    response = client.post("/Document/Batch", json=[{"deal": str(index)} for index in range(4)])
+    assert response.status_code == 400
+
+
+def test_sync_batch_has_content_length(client, monkeypatch):
+    monkeypatch.setattr(app, "convert_many_to_pdf", lambda documents: [b"%PDF-1.4 test"] * len(documents))
+    items = [{"deal": "sync-1", "price": "100"}, {"deal": "sync-2", "price": "abc"}]
+
+    response = client.post("/Document/Batch", json=items)
+    assert response.status_code == 200
+    assert response.content_length == len(response.data)
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        assert archive.read("sync-1/document.pdf") == b"%PDF-1.4 test"
+    assert [item["status"] for item in manifest["items"]] == ["ok", "error"]
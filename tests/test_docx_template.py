@@ -0,0 +1,172 @@
+"""Предкомпилированный шаблон: разрезанные плейсхолдеры, надписи, колонтитулы, экранирование.
+
+Части собираются из маленьких синтетических XML; отдельный тест проверяет
+основной шаблон ``Templates/LeadsForce_v0.docx``, где Word разрезал
+``{{INVOICE_DATE}}``, ``{{SUM}}`` и ``{{ID}}`` в колонтитуле.
+"""
+
+import zipfile
+from io import BytesIO
+
+import pytest
+from lxml import etree
+
+from docx_template import W_P, W_T, CompiledTemplate, _merge_split_placeholders, _own_text_nodes
+
+NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+TEMPLATE = "Templates/LeadsForce_v0.docx"
+
+
+def run(text: str, bold: bool = False) -> str:
+    props = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    return f'<w:r>{props}<w:t xml:space="preserve">{text}</w:t></w:r>'
+
+
+def paragraph(*runs: str) -> str:
+    return f"<w:p>{''.join(runs)}</w:p>"
+
+
+def part(*paragraphs: str, root: str = "document") -> bytes:
+    body = "".join(paragraphs)
+    if root == "document":
+        body = f"<w:body>{body}</w:body>"
+    return f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:{root} {NS}>{body}</w:{root}>'.encode()
+
+
+def parse_paragraph(xml: str):
+    return etree.fromstring(f"<w:body {NS}>{xml}</w:body>").find(W_P)
+
+
+def texts(element) -> list:
+    return [node.text or "" for node in element.iter(W_T)]
+
+
+def make_docx(tmp_path, parts: dict) -> str:
+    path = tmp_path / "template.docx"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("[Content_Types].xml", "<Types/>")
+        for name, data in parts.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def xml_parts(docx) -> dict:
+    """XML-части DOCX (путь или байты) в виде строк."""
+
+    with zipfile.ZipFile(BytesIO(docx) if isinstance(docx, bytes) else docx) as archive:
+        return {name: archive.read(name).decode("utf-8") for name in archive.namelist() if name.endswith(".xml")}
+
+
+def paragraph_texts(xml: str) -> list:
+    root = etree.fromstring(xml.encode("utf-8"))
+    return ["".join(node.text or "" for node in _own_text_nodes(p)) for p in root.iter(W_P)]
+
+
+def test_placeholder_split_across_two_runs_keeps_formatting():
+    element = parse_paragraph(paragraph(run("Дата: {{INVOICE"), run("_DATE}} г.", bold=True)))
+
+    assert _merge_split_placeholders(element)
+    assert texts(element) == ["Дата: {{INVOICE_DATE}}", " г."]
+    # Второй run сохранил своё форматирование, пробел в начале не потерян.
+    second = element.findall(f"{{{element.nsmap['w']}}}r")[1]
+    assert second.find("w:rPr/w:b", element.nsmap) is not None
+    assert second.find("w:t", element.nsmap).get("{http://www.w3.org/XML/1998/namespace}space") == "preserve"
+
+
+def test_placeholder_split_across_many_runs():
+    element = parse_paragraph(paragraph(run("Сумма {"), run("{S"), run("U"), run("M}"), run("} руб.")))
+
+    assert _merge_split_placeholders(element)
+    assert texts(element) == ["Сумма {{SUM}}", "", "", "", " руб."]
+
+
+def test_two_placeholders_in_one_paragraph():
+    element = parse_paragraph(paragraph(run("{{A"), run("}} и {{"), run("B}}")))
+
+    assert _merge_split_placeholders(element)
+    assert "".join(texts(element)) == "{{A}} и {{B}}"
+    assert texts(element)[0] == "{{A}}"
+    assert texts(element)[1] == " и {{B}}"
+
+
+def test_whole_placeholders_are_left_alone():
+    element = parse_paragraph(paragraph(run("{{A}}"), run(" и {{B}}")))
+
+    assert not _merge_split_placeholders(element)
+    assert texts(element) == ["{{A}}", " и {{B}}"]
+
+
+def test_text_box_paragraph_is_not_merged_with_outer_one():
+    text_box = (
+        "<w:r><w:pict><w:txbxContent>"
+        + paragraph(run("{{IN"), run("NER}}"))
+        + "</w:txbxContent></w:pict></w:r>"
+    )
+    outer = parse_paragraph(paragraph(run("{{OUT"), text_box, run("ER}}")))
+    inner = outer.find(f".//{W_P}")
+
+    assert [node.text for node in _own_text_nodes(outer)] == ["{{OUT", "ER}}"]
+    assert [node.text for node in _own_text_nodes(inner)] == ["{{IN", "NER}}"]
+    assert _merge_split_placeholders(outer)
+    assert _merge_split_placeholders(inner)
+    assert [node.text for node in _own_text_nodes(outer)] == ["{{OUTER}}", ""]
+    assert [node.text for node in _own_text_nodes(inner)] == ["{{INNER}}", ""]
+
+
+def test_render_fills_headers_and_footers(tmp_path):
+    path = make_docx(tmp_path, {
+        "word/document.xml": part(paragraph(run("Счёт № {{I"), run("D}}"))),
+        "word/header1.xml": part(paragraph(run("Шапка {{"), run("ID}}")), root="hdr"),
+        "word/footer2.xml": part(paragraph(run("{{CUSTOMER}}")), root="ftr"),
+        "word/styles.xml": "<w:styles {{ID}}/>",
+    })
+    template = CompiledTemplate(path)
+
+    assert template.placeholders == {"ID", "CUSTOMER"}
+    parts = xml_parts(template.render({"ID": "42", "CUSTOMER": "ООО «Ромашка»"}))
+    assert paragraph_texts(parts["word/document.xml"]) == ["Счёт № 42"]
+    assert paragraph_texts(parts["word/header1.xml"]) == ["Шапка 42"]
+    assert paragraph_texts(parts["word/footer2.xml"]) == ["ООО «Ромашка»"]
+    # Части вне document/header/footer копируются без изменений.
+    assert parts["word/styles.xml"] == "<w:styles {{ID}}/>"
+
+
+@pytest.mark.parametrize("value, text", [
+    ("A & B <c> \"d\"", "A & B <c> \"d\""),
+    (None, ""),
+    (1500, "1500"),
+])
+def test_render_escapes_values(tmp_path, value, text):
+    template = CompiledTemplate(make_docx(tmp_path, {"word/document.xml": part(paragraph(run("{{V}}")))}))
+
+    xml = xml_parts(template.render({"V": value}))["word/document.xml"]
+    assert paragraph_texts(xml) == [text]
+    if value == "A & B <c> \"d\"":
+        assert "A &amp; B &lt;c&gt;" in xml
+
+
+def test_missing_keys_stay_as_placeholders(tmp_path):
+    template = CompiledTemplate(make_docx(tmp_path, {
+        "word/document.xml": part(paragraph(run("{{KNOWN}} {{QR"), run("_CODE}}"))),
+    }))
+
+    xml = xml_parts(template.render({"KNOWN": "да"}))["word/document.xml"]
+    assert paragraph_texts(xml) == ["да {{QR_CODE}}"]
+
+
+def test_main_template_split_placeholders_are_filled():
+    template = CompiledTemplate(TEMPLATE)
+    raw = xml_parts(TEMPLATE)
+    # Шаблон действительно содержит разрезанные плейсхолдеры.
+    assert "{{INVOICE_DATE}}" not in raw["word/document.xml"]
+    assert "{{SUM}}" not in raw["word/document.xml"]
+    header = next(name for name in raw if name.startswith("word/header"))
+    assert "{{ID}}" not in raw[header]
+
+    assert {"INVOICE_DATE", "SUM", "ID"} <= template.placeholders
+    parts = xml_parts(template.render({"INVOICE_DATE": "17.10.2026", "SUM": "1 500,00", "ID": "A-7"}))
+    body = paragraph_texts(parts["word/document.xml"])
+    assert any(text.endswith("от 17.10.2026") and "A-7" in text for text in body)
+    assert "1 500,00" in body
+    assert any("A-7" in text for text in paragraph_texts(parts[header]))
+    assert "{{INVOICE_DATE}}" not in parts["word/document.xml"]
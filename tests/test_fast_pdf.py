@@ -0,0 +1,164 @@
+"""Быстрый путь PDF: отказ на неподходящих значениях и совпадение с LibreOffice.
+
+Тесты отказа собирают базовый PDF прямо в PyMuPDF и LibreOffice не требуют.
+Сравнение с конвертацией растеризует оба PDF тестовых сделок в оттенках серого и
+считает долю пикселей, отличающихся больше чем на ``PIXEL_THRESHOLD`` уровней;
+оно пропускается без LibreOffice (``soffice`` в PATH). Для сделок из
+``SUPPORTED_CASES`` быстрый путь обязан собрать PDF; отказ допустим только для
+``FALLBACK_CASES`` (значение не помещается) — их PDF собирает обычная конвертация.
+"""
+
+import functools
+import shutil
+
+import pytest
+
+fitz = pytest.importorskip("pymupdf")
+
+import fast_pdf  # noqa: E402
+from benchmarks.synthetic_template import SAMPLE_DEAL  # noqa: E402
+
+DPI = 100
+PIXEL_THRESHOLD = 64
+MAX_DIFF_RATIO = 0.01
+
+CASES = {
+    "sample": SAMPLE_DEAL,
+    "short": {"deal": "7", "price": "100", "name": "Ян"},
+    "no_customer": {"deal": "219420", "price": "1500.00", "service": "Лиды"},
+    "long_company": dict(SAMPLE_DEAL, companyName="Общество с ограниченной ответственностью «Очень длинное название»"),
+}
+FALLBACK_CASES = {"long_company"}
+SUPPORTED_CASES = set(CASES) - FALLBACK_CASES
+
+
+@pytest.fixture
+def fast_path(monkeypatch):
+    """Включает быстрый путь с PyMuPDF и свежими кэшами шрифтов и движков."""
+
+    monkeypatch.setattr(fast_pdf, "FAST_PDF_ENABLED", True)
+    monkeypatch.setattr(fast_pdf, "fitz", fitz)
+    monkeypatch.setattr(fast_pdf, "_fonts", {})
+    monkeypatch.setattr(fast_pdf, "_engines", {})
+
+
+@pytest.fixture
+def stamp_font(tmp_path, monkeypatch, fast_path):
+    """Шрифт штамповки из встроенных шрифтов PyMuPDF — системные шрифты не нужны."""
+
+    regular = tmp_path / "regular.cff"
+    bold = tmp_path / "bold.cff"
+    regular.write_bytes(fitz.Font("helv").buffer)
+    bold.write_bytes(fitz.Font("hebo").buffer)
+    monkeypatch.setattr(fast_pdf, "FAST_PDF_FONT", str(regular))
+    monkeypatch.setattr(fast_pdf, "FAST_PDF_BOLD_FONT", str(bold))
+    return str(regular)
+
+
+def _base_pdf(font_path: str) -> bytes:
+    """Ячейка со строкой «Price: {{price}} rub.», справа — граница таблицы, снизу — подпись."""
+
+    with fitz.open() as document:
+        page = document.new_page(width=595, height=842)
+        page.insert_text((72, 100), "Price: {{price}} rub.", fontsize=11, fontname="F0", fontfile=font_path)
+        page.insert_text((72, 130), "Signature", fontsize=11, fontname="F0", fontfile=font_path)
+        page.draw_line((300, 80), (300, 110))
+        return document.tobytes()
+
+
+def _engine(font_path: str) -> "fast_pdf.FastPdfEngine":
+    pdf = _base_pdf(font_path)
+    return fast_pdf.FastPdfEngine("test", lambda width_mm: (pdf, None))
+
+
+def test_value_is_stamped(stamp_font):
+    pdf = _engine(stamp_font).render({"price": "100"}, None, 30)
+
+    assert pdf is not None
+    with fitz.open("pdf", pdf) as document:
+        page = document[0]
+        assert "{{price}}" not in page.get_text()
+        label, = page.search_for("Price:")
+        value, = page.search_for("100 rub.")
+    # Значение стоит в той же строке сразу за подписью.
+    assert abs(value.y1 - label.y1) < 1
+    assert 0 <= value.x0 - label.x1 < 11
+
+
+def test_overflowing_word_falls_back(stamp_font):
+    assert _engine(stamp_font).render({"price": "9" * 80}, None, 30) is None
+
+
+def test_value_wrapping_into_next_line_falls_back(stamp_font):
+    assert _engine(stamp_font).render({"price": " ".join(["overflowing"] * 12)}, None, 30) is None
+
+
+def test_missing_font_falls_back(stamp_font, monkeypatch, tmp_path):
+    monkeypatch.setattr(fast_pdf, "FAST_PDF_FONT", str(tmp_path / "missing.ttf"))
+    engine = _engine(stamp_font)
+
+    assert engine.layout(30) is None
+    assert engine.render({"price": "100"}, None, 30) is None
+
+
+def test_layout_builder_override_is_used_once(stamp_font):
+    pdf = _base_pdf(stamp_font)
+    calls = []
+    engine = fast_pdf.FastPdfEngine("test", lambda width_mm: calls.append("engine") or (pdf, None))
+
+    assert engine.layout(30, lambda width_mm: calls.append("warm_up") or (pdf, None)) is not None
+    assert engine.render({"price": "100"}, None, 30) is not None
+    assert calls == ["warm_up"]
+
+
+def rasterize(pdf: bytes) -> list:
+    """Страницы PDF в оттенках серого: ``[(ширина, высота, байты), ...]``."""
+
+    pages = []
+    with fitz.open("pdf", pdf) as document:
+        for page in document:
+            pixmap = page.get_pixmap(dpi=DPI, colorspace=fitz.csGRAY, alpha=False)
+            pages.append((pixmap.width, pixmap.height, pixmap.samples))
+    return pages
+
+
+def diff_ratio(first: tuple, second: tuple) -> float:
+    """Доля пикселей страницы, различающихся больше чем на ``PIXEL_THRESHOLD`` уровней."""
+
+    if first[:2] != second[:2]:
+        return 1.0
+    differing = sum(1 for x, y in zip(first[2], second[2]) if abs(x - y) > PIXEL_THRESHOLD)
+    return differing / len(first[2])
+
+
+@pytest.mark.skipif(shutil.which("soffice") is None, reason="нужен LibreOffice (soffice в PATH)")
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_fast_pdf_matches_libreoffice(name, fast_path, tmp_path):
+    import app
+
+    template = app.get_template_registry().get()
+    engine = app.get_fast_pdf_engine(template.version, functools.partial(app._fast_pdf_base, template))
+    assert engine.layout(app.DEFAULT_QR_WIDTH_MM) is not None, "шаблон не поддерживается быстрым путём"
+
+    inputs = app.GenerationRequest.from_params(CASES[name])
+    # Обычный путь без попытки штамповки: только DOCX, затем конвертация.
+    documents = app.build_doc(inputs, {app.ARTIFACT_DOCX})
+    converted = app.convert_to_pdf(documents.docx)
+
+    values = inputs.replacements()
+    if documents.qr_payload and documents.qr_png:
+        values["PAYMENT_QR_PAYLOAD"] = documents.qr_payload
+        values["PAYMENT_QR_BASE64"] = app.encode_bytes_to_base64(documents.qr_png)
+    fast = app.render_pdf_fast(values, documents.qr_payload if documents.qr_png else "", inputs.qr_width_mm)
+    if name not in SUPPORTED_CASES and fast is None:
+        pytest.skip("быстрый путь отказался — PDF собирает обычная конвертация")
+    assert fast is not None, "быстрый путь отказался от поддерживаемой сделки"
+
+    # Пара PDF остаётся в каталоге теста для просмотра, если сравнение не прошло.
+    (tmp_path / f"{name}_converted.pdf").write_bytes(converted)
+    (tmp_path / f"{name}_fast.pdf").write_bytes(fast)
+
+    expected, actual = rasterize(converted), rasterize(fast)
+    assert len(actual) == len(expected), f"страниц {len(actual)} вместо {len(expected)}"
+    worst = max(diff_ratio(a, b) for a, b in zip(expected, actual))
+    assert worst <= MAX_DIFF_RATIO, f"различается {worst:.4%} пикселей, PDF в {tmp_path}"
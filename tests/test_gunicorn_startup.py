@@ -0,0 +1,74 @@
+"""Старт сервиса под gunicorn с конфигурацией из репозитория."""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+pytest.importorskip("gunicorn")
+pytest.importorskip("prometheus_client")
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="gunicorn работает только на *nix")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status, response.read().decode("utf-8")
+    except OSError:
+        return None, ""
+
+
+@pytest.mark.parametrize("preload", ["1", "0"])
+def test_gunicorn_starts_with_fresh_metrics_dir(tmp_path, preload):
+    # Каталога метрик ещё нет (как после перезагрузки), рядом — файл прошлого запуска.
+    metrics_dir = tmp_path / "metrics"
+    env = dict(
+        os.environ,
+        PROMETHEUS_MULTIPROC_DIR=str(metrics_dir),
+        LEADFORCE_PRELOAD_APP=preload,
+        LEADFORCE_SOFFICE_POOL_SIZE="0",
+        LEADFORCE_JOBS_DIR=str(tmp_path / "jobs"),
+    )
+    env.pop("LEADFORCE_METRICS_DIR_READY", None)
+    if preload == "0":
+        metrics_dir.mkdir()
+        (metrics_dir / "counter_999999.db").write_bytes(b"stale")
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py",
+         "--workers", "1", "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        status, body = None, ""
+        while time.monotonic() < deadline and server.poll() is None:
+            status, body = _get(f"http://127.0.0.1:{port}/metrics")
+            if status == 200:
+                break
+            time.sleep(0.2)
+        if status != 200:
+            server.kill()
+            pytest.fail(f"gunicorn не поднялся:\n{server.communicate()[0].decode('utf-8', 'replace')}")
+        assert "leadforce_http_requests_in_flight" in body
+        assert not (metrics_dir / "counter_999999.db").exists()
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
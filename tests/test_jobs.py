@@ -0,0 +1,170 @@
+"""Фоновые задания: выполнение, доставка callback, подбор заданий и защита от SSRF."""
+
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def job_store(tmp_path, monkeypatch):
+    """Хранилище заданий во временном каталоге и свежая очередь процесса."""
+
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "_queue", None)
+    monkeypatch.setattr(jobs, "_queue_pid", None)
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_BACKOFF_S", 0.01)
+    return jobs.get_job_store()
+
+
+@pytest.fixture
+def callback_server(monkeypatch):
+    """Локальный получатель callback: отдаёт (адрес, список полученных POST)."""
+
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append({
+                "path": self.path,
+                "job_id": self.headers["X-Job-Id"],
+                "status": self.headers["X-Job-Status"],
+                "content_type": self.headers["Content-Type"],
+                "body": body,
+            })
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    # Локальный получатель — внутренний адрес, его нужно разрешить явно.
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_ALLOWED_HOSTS", frozenset({"127.0.0.1"}))
+    yield f"http://127.0.0.1:{server.server_port}/callback", received
+    server.shutdown()
+    server.server_close()
+
+
+def _wait_for(load, predicate, timeout=30.0):
+    """Опрашивает ``load()``, пока ``predicate`` от результата не станет истинным."""
+
+    deadline = time.monotonic() + timeout
+    while True:
+        state = load()
+        if predicate(state):
+            return state
+        if time.monotonic() >= deadline:
+            raise AssertionError(f"не дождались: {state}")
+        time.sleep(0.05)
+
+
+def _dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_job_runs_to_done_and_delivers_callback(job_store, callback_server):
+    import app
+
+    callback_url, received = callback_server
+    client = app.app.test_client()
+
+    response = client.post(f"/Jobs?deal=42&price=1000&format=docx&callback_url={callback_url}")
+    assert response.status_code == 202
+    job_id = response.get_json()["id"]
+
+    state = _wait_for(
+        lambda: client.get(f"/Jobs/{job_id}").get_json(),
+        lambda state: state["status"] in ("done", "failed") and state["callback"]["delivered"],
+    )
+    assert state["status"] == "done", state
+    assert state["attempts"] == 1
+    assert "owner" not in state and "params" not in state
+
+    result = client.get(f"/Jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert len(received) == 1
+    assert received[0]["path"] == "/callback"
+    assert received[0]["job_id"] == job_id
+    assert received[0]["status"] == "done"
+    assert received[0]["body"] == result.data
+    assert received[0]["body"][:2] == b"PK"
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/callback",
+    "http://localhost:8080/callback",
+    "http://10.0.0.5/callback",
+    "http://192.168.1.10/callback",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/callback",
+    "http://0.0.0.0/callback",
+])
+def test_callback_url_rejects_internal_addresses(url):
+    assert jobs.validate_callback_url(url) is not None
+
+
+def test_callback_url_rejects_non_http():
+    assert jobs.validate_callback_url("ftp://example.com/x") is not None
+    assert jobs.validate_callback_url("/relative") is not None
+
+
+def test_callback_url_allowlist(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_ALLOWED_HOSTS", frozenset({"127.0.0.1"}))
+    assert jobs.validate_callback_url("http://127.0.0.1:9000/callback") is None
+    assert jobs.validate_callback_url("http://example.com/callback") is not None
+
+
+def test_jobs_route_rejects_internal_callback(job_store):
+    import app
+
+    response = app.app.test_client().post("/Jobs?deal=1&price=10&callback_url=http://169.254.169.254/")
+    assert response.status_code == 400
+
+
+def test_orphaned_job_is_requeued(job_store):
+    runs = []
+
+    def runner(params, timings):
+        runs.append(params)
+        return b"result", "result.bin", "application/octet-stream"
+
+    owner = {"host": jobs.socket.gethostname(), "pid": _dead_pid(), "queue": "gone"}
+    state = job_store.create({"format": "docx"}, owner=owner)
+    job_store.update(state["id"], status=jobs.JOB_RUNNING, attempts=1)
+
+    jobs.get_job_queue(runner)
+    done = _wait_for(lambda: job_store.load(state["id"]), lambda job: job["status"] == jobs.JOB_DONE)
+    assert done["attempts"] == 2
+    assert done["owner"]["pid"] == jobs.os.getpid()
+    assert runs == [{"format": "docx"}]
+
+
+def test_orphaned_job_fails_after_max_attempts(job_store):
+    owner = {"host": jobs.socket.gethostname(), "pid": _dead_pid(), "queue": "gone"}
+    state = job_store.create({"format": "docx"}, owner=owner)
+    job_store.update(state["id"], status=jobs.JOB_RUNNING, attempts=jobs.JOB_MAX_ATTEMPTS)
+
+    queue = jobs.get_job_queue(lambda params, timings: pytest.fail("задание не должно запускаться"))
+    failed = _wait_for(lambda: job_store.load(state["id"]), lambda job: job["status"] == jobs.JOB_FAILED)
+    assert failed["error"]
+    assert queue.recover(state["id"]) is None
+
+
+def test_job_of_live_owner_is_left_alone(job_store):
+    owner = {"host": jobs.socket.gethostname(), "pid": 1, "queue": "init"}
+    state = job_store.create({"format": "docx"}, owner=owner)
+
+    queue = jobs.get_job_queue(lambda params, timings: pytest.fail("задание не должно запускаться"))
+    assert queue.recover(state["id"]) is None
+    assert job_store.load(state["id"])["status"] == jobs.JOB_QUEUED
@@ -0,0 +1,138 @@
+"""Потоковая сборка ZIP-архива без буферизации всего архива в памяти.
+
+``zipfile`` пишет архив в приёмник без ``seek``: в таком режиме размеры и CRC
+каждого файла уходят в дескриптор данных после содержимого, поэтому архив можно
+отдавать клиенту по мере записи. Уже сжатые форматы (PDF, PNG, DOCX) кладутся
+как есть (``ZIP_STORED``): повторное deflate-сжатие их почти не уменьшает.
+Длина архива считается заранее и отдаётся в Content-Length: для несжатых файлов
+она следует из размеров, а небольшие сжимаемые файлы (``manifest.json``)
+сжимаются для подсчёта тем же компрессором и теми же кусками, что и в архиве.
+"""
+
+import io
+import zipfile
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from reproducible import ZIP_EPOCH
+
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Расширения файлов, которые уже сжаты внутри и пишутся в архив без сжатия.
+STORED_EXTENSIONS = (".pdf", ".png", ".docx", ".zip", ".jpg", ".jpeg")
+
+# Длины служебных структур ZIP без ZIP64: локальный заголовок, дескриптор данных
+# (с сигнатурой), запись центрального каталога и его завершающая запись.
+_LOCAL_HEADER_SIZE = 30
+_DATA_DESCRIPTOR_SIZE = 16
+_CENTRAL_HEADER_SIZE = 46
+_END_OF_CENTRAL_DIR_SIZE = 22
+_ZIP64_LIMIT = (1 << 31) - 1
+
+
+def member_compression(arcname: str) -> int:
+    """Возвращает метод сжатия для файла архива по его расширению."""
+
+    if arcname.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _present(members: Iterable) -> list:
+    """Оставляет только сформированные артефакты — пустые в архив не попадают."""
+
+    return [(data, arcname) for data, arcname in members if data]
+
+
+class _ChunkSink(io.RawIOBase):
+    """Приёмник для ``zipfile``: копит записанные байты до очередной выдачи."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        chunk = b"".join(self._chunks)
+        self._chunks.clear()
+        return chunk
+
+
+def _deflated_size(data: bytes, chunk_size: int) -> int:
+    """Размер ``data`` после deflate — как у ``zipfile`` при записи кусками по ``chunk_size``."""
+
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    view = memoryview(data)
+    size = sum(len(compressor.compress(view[offset:offset + chunk_size]))
+               for offset in range(0, len(view), chunk_size))
+    return size + len(compressor.flush())
+
+
+def stream_zip_length(members: Iterable, chunk_size: int = ZIP_STREAM_CHUNK_SIZE) -> Optional[int]:
+    """Возвращает точный размер архива ``stream_zip`` или None для архивов ZIP64.
+
+    ``chunk_size`` должен совпадать с переданным в ``stream_zip``: от кусков
+    зависит вывод компрессора сжимаемых файлов.
+    """
+
+    total = _END_OF_CENTRAL_DIR_SIZE
+    for data, arcname in _present(members):
+        if len(data) * 1.05 > _ZIP64_LIMIT:
+            return None
+        if member_compression(arcname) == zipfile.ZIP_STORED:
+            size = len(data)
+        else:
+            size = _deflated_size(data, chunk_size)
+        name_length = len(arcname.encode("utf-8"))
+        total += (_LOCAL_HEADER_SIZE + name_length + size + _DATA_DESCRIPTOR_SIZE
+                  + _CENTRAL_HEADER_SIZE + name_length)
+    return total
+
+
+def stream_zip(members: Iterable, chunk_size: int = ZIP_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Отдаёт ZIP-архив из пар ``(байты, имя в архиве)`` кусками по ``chunk_size``.
+
+    В памяти одновременно находятся только исходные артефакты и текущий кусок
+    архива, а не полная копия архива. Дата всех файлов — ``ZIP_EPOCH``, поэтому
+    одинаковые артефакты дают побайтно одинаковый архив.
+    """
+
+    members = _present(members)
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for data, arcname in members:
+            info = zipfile.ZipInfo(arcname, date_time=ZIP_EPOCH)
+            info.compress_type = member_compression(arcname)
+            info.external_attr = 0o600 << 16
+            info.file_size = len(data)
+            view = memoryview(data)
+            with archive.open(info, "w") as member:
+                for offset in range(0, len(view), chunk_size):
+                    member.write(view[offset:offset + chunk_size])
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def zip_bytes(members: Iterable) -> bytes:
+    """Собирает тот же архив целиком — для фоновых заданий, которым нужен файл."""
+
+    return b"".join(stream_zip(members))